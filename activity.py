@@ -0,0 +1,88 @@
+# activity.py
+import asyncio
+import datetime
+import logging
+
+from db import member_fields
+from member_log import ACTIVITY, append_events, event_row
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityBuffer:
+    """
+    Буфер отложенной записи активности участников.
+
+    Каждое сообщение только обновляет запись в словаре, ключом которого является
+    пара (chat_id, user_id). Накопленные изменения дописываются в журнал участников
+    (member_log) одним пакетным INSERT по таймеру, при достижении порога размера и
+    при остановке бота.
+    """
+
+    def __init__(self, db, max_size=500):
+        """
+        :param db: Экземпляр db.Database
+        :param max_size: Количество записей, при котором буфер сбрасывается досрочно
+        """
+        self.db = db
+        self.max_size = max_size
+        self._pending = {}
+        self._groups = {}
+        self._lock = asyncio.Lock()
+        self._flush_task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, chat, user):
+        """
+        Запоминает активность пользователя в группе.
+
+        :param chat: Объект telegram.Chat
+        :param user: Объект telegram.User
+        """
+        self._groups.setdefault(chat.id, chat.title)
+        entry = member_fields(user)
+        entry['last_active'] = datetime.datetime.utcnow()
+        self._pending[(chat.id, user.id)] = entry
+
+        if len(self._pending) >= self.max_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    def discard(self, chat_id, user_id):
+        """
+        Удаляет из буфера несохранённую запись, чтобы сброс не вернул в базу
+        уже удалённого участника.
+        """
+        self._pending.pop((chat_id, user_id), None)
+
+    async def flush(self):
+        """
+        Записывает накопленные изменения в базу данных.
+
+        :return: Количество записанных участников
+        """
+        async with self._lock:
+            if not self._pending and not self._groups:
+                return 0
+
+            pending, self._pending = self._pending, {}
+            groups, self._groups = self._groups, {}
+            try:
+                await self.db.run(self._write, pending, groups)
+            except Exception as e:
+                logger.error(f"Ошибка при записи буфера активности в базу: {e}")
+                # Возвращаем записи в буфер, не затирая более свежие данные
+                for key, entry in pending.items():
+                    self._pending.setdefault(key, entry)
+                for chat_id, title in groups.items():
+                    self._groups.setdefault(chat_id, title)
+                return 0
+            return len(pending)
+
+    @staticmethod
+    def _write(session, pending, groups):
+        append_events(session, [
+            event_row(ACTIVITY, chat_id, user_id, entry, created_at=entry['last_active'])
+            for (chat_id, user_id), entry in pending.items()
+        ], groups)
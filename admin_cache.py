@@ -0,0 +1,101 @@
+# admin_cache.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = ('administrator', 'creator')
+
+
+class AdminCache:
+    """
+    Кэш статуса администратора с ограниченным временем жизни.
+
+    Ключом служит пара (chat_id, user_id). Одновременных запросов get_chat_member
+    не больше max_concurrency, а при проверке нескольких групп запросы
+    выполняются параллельно. Записей не больше max_entries: при переполнении
+    вытесняются те, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, ttl=300, max_concurrency=20, max_entries=100000):
+        """
+        :param ttl: Время жизни записи в секундах
+        :param max_concurrency: Максимальное количество одновременных запросов к API
+        :param max_entries: Максимальное количество записей в кэше
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def get(self, chat_id, user_id):
+        """
+        :return: True/False из кэша или None, если записи нет или она устарела
+        """
+        entry = self._entries.get((chat_id, user_id))
+        if entry is None:
+            return None
+        is_admin, expires = entry
+        if expires < time.monotonic():
+            del self._entries[(chat_id, user_id)]
+            return None
+        self._entries.move_to_end((chat_id, user_id))
+        return is_admin
+
+    def set(self, chat_id, user_id, status):
+        """
+        Запоминает статус участника, например из обновления ChatMemberHandler.
+
+        :param status: Статус участника чата (ChatMember.status)
+        """
+        self._entries[(chat_id, user_id)] = (status in ADMIN_STATUSES, time.monotonic() + self.ttl)
+        self._entries.move_to_end((chat_id, user_id))
+        self._prune()
+
+    def invalidate(self, chat_id, user_id):
+        self._entries.pop((chat_id, user_id), None)
+
+    def _prune(self):
+        # Записи упорядочены от давно использованных к недавним: из начала удаляются
+        # устаревшие, а затем лишние сверх max_entries. Устаревшие записи в середине
+        # удаляются при следующем обращении к ним
+        now = time.monotonic()
+        while self._entries:
+            key, (_, expires) = next(iter(self._entries.items()))
+            if expires >= now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    async def is_admin(self, bot, chat_id, user_id):
+        """
+        Проверяет, является ли пользователь администратором или создателем чата.
+
+        :param bot: Экземпляр бота
+        :param chat_id: ID чата (группы)
+        :param user_id: ID пользователя
+        :return: True, если пользователь администратор или создатель, иначе False
+        """
+        cached = self.get(chat_id, user_id)
+        if cached is not None:
+            return cached
+
+        try:
+            async with self._semaphore:
+                member = await bot.get_chat_member(chat_id=chat_id, user_id=user_id)
+        except Exception as e:
+            logger.error(f"Ошибка при проверке статуса администратора для пользователя {user_id} в чате {chat_id}: {e}")
+            return False
+        self.set(chat_id, user_id, member.status)
+        return member.status in ADMIN_STATUSES
+
+    async def filter_admin_groups(self, bot, groups, user_id):
+        """
+        Параллельно отбирает группы, в которых пользователь является администратором.
+
+        :param groups: Объекты Group
+        :return: Список групп в исходном порядке
+        """
+        results = await asyncio.gather(*(self.is_admin(bot, group.telegram_id, user_id) for group in groups))
+        return [group for group, is_admin in zip(groups, results) if is_admin]
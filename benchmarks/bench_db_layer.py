@@ -0,0 +1,156 @@
+# benchmarks/bench_db_layer.py
+"""
+Сравнение пропускной способности обработки обновлений при синхронной работе
+с базой в цикле событий и через поток базы данных (db.Database).
+
+Сценарий пропускной способности: каждое обновление записывает событие в журнал
+участников, как обработчик chat_member_update (member_log.MemberLog.append), и
+ожидает имитацию сетевого запроса к Telegram. Параллельно измеряется задержка
+цикла событий: насколько позже положенного просыпается фоновая задача. Передача
+запроса в поток стоит переключения потоков, поэтому на этом сценарии поток базы
+медленнее синхронной записи.
+
+Сценарий блокировки: другое соединение держит блокировку записи SQLite (как
+VACUUM или второй процесс), и обработчик одного чата ждёт её в пределах
+busy_timeout. Остальные чаты в это время получают обновления, которые, как
+handle_message, обходятся без базы (буфер активности, кэш упоминаний) и ждут
+только Telegram; измеряется задержка их обработки.
+
+Запуск: python benchmarks/bench_db_layer.py [--updates 2000] [--concurrency 32] [--lock-seconds 1]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database, member_fields  # noqa: E402
+from member_log import JOIN, append_events, event_row  # noqa: E402
+
+
+async def measure_loop_lag(stop, interval=0.005):
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+
+async def run_scenario(database, updates, concurrency, api_latency, blocking):
+    queue = asyncio.Queue()
+    for i in range(updates):
+        chat_id = -1000 - i % 20
+        user = SimpleNamespace(id=i % 500, username=f"user{i % 500}", first_name="User", last_name=None)
+        queue.put_nowait((chat_id, user))
+
+    async def worker():
+        while True:
+            try:
+                chat_id, user = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            rows = [event_row(JOIN, chat_id, user.id, member_fields(user))]
+            if blocking:
+                database._call(append_events, rows, {chat_id: "Group"})
+            else:
+                await database.run(append_events, rows, {chat_id: "Group"})
+            await asyncio.sleep(api_latency)
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    return updates / elapsed, await lag_task
+
+
+def hold_write_lock(path, seconds, locked):
+    """Держит блокировку записи SQLite из отдельного соединения seconds секунд."""
+    connection = sqlite3.connect(path, isolation_level=None)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        locked.set()
+        time.sleep(seconds)
+        connection.execute("COMMIT")
+    finally:
+        connection.close()
+
+
+async def run_lock_scenario(database, path, lock_seconds, api_latency, blocking, rate=200):
+    locked = threading.Event()
+    holder = threading.Thread(target=hold_write_lock, args=(path, lock_seconds, locked))
+    holder.start()
+    locked.wait()
+
+    async def locked_chat():
+        rows = [event_row(JOIN, -1, 1, {'username': 'user1'})]
+        if blocking:
+            database._call(append_events, rows, {-1: "Group"})
+        else:
+            await database.run(append_events, rows, {-1: "Group"})
+
+    latencies = []
+
+    async def other_chat(arrived):
+        await asyncio.sleep(api_latency)
+        latencies.append(time.perf_counter() - arrived)
+
+    # Обновления других чатов приходят равномерно, пока длится блокировка и ещё столько же.
+    # Задержка считается от назначенного времени прихода: пока цикл стоит, обновления
+    # продолжают поступать в сокет и ждут его
+    tasks = [asyncio.create_task(locked_chat())]
+    started = time.perf_counter()
+    for i in range(int(lock_seconds * 2 * rate)):
+        arrived = started + i / rate
+        await asyncio.sleep(max(0.0, arrived - time.perf_counter()))
+        tasks.append(asyncio.create_task(other_chat(arrived)))
+    await asyncio.gather(*tasks)
+    await asyncio.to_thread(holder.join)
+
+    latencies.sort()
+    return [latencies[min(len(latencies) - 1, int(len(latencies) * q))] for q in (0.5, 0.99)] + [latencies[-1]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--api-latency', type=float, default=0.005, help="Имитация задержки Telegram API, с")
+    parser.add_argument('--lock-seconds', type=float, default=1.0, help="Длительность блокировки записи, с")
+    args = parser.parse_args()
+    modes = (("синхронно в цикле", True), ("поток базы данных", False))
+
+    print("Пропускная способность")
+    print(f"{'режим':<22}{'обновлений/с':>14}{'макс. задержка цикла, мс':>28}")
+    for name, blocking in modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            database = Database(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            database.create_all()
+            rate, lag = asyncio.run(run_scenario(database, args.updates, args.concurrency, args.api_latency, blocking))
+            database.close()
+        print(f"{name:<22}{rate:>14.1f}{lag * 1000:>28.1f}")
+
+    print()
+    print(f"Задержка обработки других чатов, пока один чат ждёт блокировку {args.lock_seconds:g} с")
+    print(f"{'режим':<22}{'p50, мс':>10}{'p99, мс':>10}{'макс., мс':>12}")
+    for name, blocking in modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            # busy_timeout больше блокировки: запись дожидается её, а не падает с "database is locked"
+            database = Database(f"sqlite:///{path}", sqlite_pragmas={'busy_timeout': int(args.lock_seconds * 2000) + 1000})
+            database.create_all()
+            p50, p99, worst = asyncio.run(run_lock_scenario(database, path, args.lock_seconds, args.api_latency, blocking))
+            database.close()
+        print(f"{name:<22}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}{worst * 1000:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/bench_member_sync.py
+"""
+Сравнение записи участников группы, полученных из Telegram: построчные
+запросы (прежняя реализация update_members) и пакетная запись
+member_sync.sync_members, которую выполняют update_members и /update.
+
+Для каждой группы в файле SQLite создаётся roster из --members участников,
+затем в него записывается список, в котором часть участников новые, а
+остальные уже известны. Считаются SQL-запросы (executemany = один запрос) и
+время выполнения. Пакетная запись выполняет один запрос на группу любого
+размера.
+
+Запуск: python benchmarks/bench_member_sync.py [--members 10000] [--groups 3]
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+from member_sync import sync_members  # noqa: E402
+from models import Group, Member  # noqa: E402
+
+
+def row_by_row_sync(session, group_id, users):
+    """Прежняя реализация: отдельный SELECT на каждого участника."""
+    for user in users:
+        db_member = session.query(Member).filter(Member.telegram_id == user['id'], Member.group_id == group_id).first()
+        if not db_member:
+            db_member = Member(telegram_id=user['id'], group_id=group_id)
+            session.add(db_member)
+        db_member.username = user['username']
+        db_member.first_name = user['first_name']
+        db_member.last_name = user['last_name']
+        db_member.full_name = user['full_name']
+        db_member.last_active = datetime.datetime.utcnow()
+    session.flush()
+
+
+def row_by_row(database, group_id, users):
+    asyncio.run(database.run(row_by_row_sync, group_id, users))
+
+
+def bulk(database, group_id, users):
+    """Запись бота: один INSERT ... ON CONFLICT на группу."""
+    asyncio.run(database.run(sync_members, group_id, users, datetime.datetime.utcnow()))
+
+
+def make_user(user_id):
+    return {'id': user_id, 'username': f"user{user_id}", 'first_name': "User", 'last_name': str(user_id),
+            'full_name': f"User {user_id}"}
+
+
+def seed(session, groups, members):
+    now = datetime.datetime.utcnow()
+    for g in range(groups):
+        group = Group(telegram_id=-1000 - g, name=f"Group {g}")
+        session.add(group)
+        session.flush()
+        # Ключ id из make_user — это telegram_id, первичный ключ назначает база
+        session.bulk_insert_mappings(Member, [
+            dict(make_user(i), id=None, telegram_id=i, group_id=group.id, last_active=now)
+            for i in range(members)
+        ])
+    session.commit()
+
+
+def run(sync, groups, members, churn):
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        database.create_all()
+        session = database.Session()
+        seed(session, groups, members)
+        group_ids = [g.id for g in session.query(Group)]
+        session.close()
+
+        # Часть участников новые, остальные уже есть в базе
+        left = int(members * churn)
+        fetched = [make_user(i) for i in range(left, members + left)]
+
+        statements = [0]
+
+        def count(*args):
+            statements[0] += 1
+
+        event.listen(database.engine, 'before_cursor_execute', count)
+        started = time.perf_counter()
+        for group_id in group_ids:
+            sync(database, group_id, fetched)
+        elapsed = time.perf_counter() - started
+        event.remove(database.engine, 'before_cursor_execute', count)
+        database.close()
+        return statements[0] / len(group_ids), elapsed / len(group_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=10000)
+    parser.add_argument('--groups', type=int, default=3)
+    parser.add_argument('--churn', type=float, default=0.05, help="Доля новых участников")
+    args = parser.parse_args()
+
+    print(f"{'реализация':<16}{'запросов на группу':>20}{'время на группу, с':>22}")
+    for name, sync in (("построчная", row_by_row), ("пакетная", bulk)):
+        statements, elapsed = run(sync, args.groups, args.members, args.churn)
+        print(f"{name:<16}{statements:>20.0f}{elapsed:>22.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+# benchmarks/bench_scenarios.py
+"""
+Набор воспроизводимых сценариев нагрузки на обработчики бота.
+
+Каждый сценарий выполняется в отдельном процессе со своей базой SQLite и
+заглушкой Bot API (fake_bot_api.FakeBotAPI) с настраиваемой задержкой и
+лимитами. Обновления подаются прямо в очередь приложения, поэтому измеряется
+обработка, а не HTTP-приём (его измеряет webhook_load.py).
+
+Сценарии:
+  steady          — сообщения без триггеров, активность групп неравномерна
+  trigger_storm   — волна @all в самых активных группах на фоне обычных сообщений
+  join_leave      — волны вступлений и выходов участников
+  member_sync     — синхронизация администраторов всех групп (update_members)
+  admin_commands  — /groups от администраторов и обычных пользователей
+
+Для каждого сценария выводятся пропускная способность, перцентили задержки,
+количество SQL-запросов, запросов к API и ответов 429, пиковый RSS процесса.
+С одинаковым --seed сценарии генерируют одинаковый трафик.
+
+Запуск: python benchmarks/bench_scenarios.py [--scenarios steady,trigger_storm]
+        [--groups 200] [--messages 5000] [--api-latency 20] [--json results.json]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_bot_api  # noqa: E402
+from fake_bot_api import FakeBotAPI, TOKEN  # noqa: E402
+
+
+class Run:
+    """
+    Окружение одного сценария: приложение бота, заглушка API и замеры.
+    """
+
+    def __init__(self, args, bot_module, application, api):
+        self.args = args
+        self.bot = bot_module
+        # Бот из BOT_TOKEN; его данные в основных таблицах
+        self.tenant = bot_module.tenants[0]
+        self.application = application
+        self.api = api
+        self.rng = random.Random(args.seed)
+        self.sent_at = {}
+        self.done_at = {}
+        self.statements = 0
+        self.started = time.perf_counter()
+        self._next_id = 0
+        self._done = asyncio.Event()
+        self._expected = 0
+
+    def next_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def reset(self):
+        """Обнуляет замеры после подготовки данных."""
+        self.sent_at.clear()
+        self.done_at.clear()
+        self.statements = 0
+        self.started = time.perf_counter()
+        self.api.calls.clear()
+        self.api.rate_limited.clear()
+
+    async def mark_done(self, update, context):
+        self.done_at[update.update_id] = time.perf_counter()
+        if len(self.done_at) >= self._expected:
+            self._done.set()
+
+    async def replay(self, updates, rate=0):
+        """
+        Подаёт обновления в очередь приложения и ждёт окончания их обработки.
+
+        :param rate: Обновлений в секунду (0 - как можно быстрее)
+        """
+        from telegram import Update
+
+        self._expected = len(self.done_at) + len(updates)
+        self._done.clear()
+        started = time.perf_counter()
+        for i, data in enumerate(updates):
+            if rate:
+                delay = started + i / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            update = Update.de_json(data, self.application.bot)
+            self.sent_at[update.update_id] = time.perf_counter()
+            await self.application.update_queue.put(update)
+        if updates:
+            await self._done.wait()
+
+    def latencies(self):
+        return [self.done_at[i] - self.sent_at[i] for i in self.done_at if i in self.sent_at]
+
+    async def seed_groups(self):
+        """Создаёт группы и участников, отправляя по сообщению от каждого."""
+        updates = [
+            fake_bot_api.message_update(self.next_id(), -1000 - g, user_id, "привет")
+            for g in range(self.args.groups) for user_id in range(1, self.args.members + 1)
+        ]
+        await self.replay(updates)
+        await self.tenant.activity_buffer.flush()
+        await self.tenant.member_log.compact()
+        self.reset()
+
+
+def messages(run, count, trigger_ratio=0.0):
+    updates = []
+    for _ in range(count):
+        chat_id = fake_bot_api.skewed_chat(run.rng, run.args.groups)
+        text = "@all внимание" if run.rng.random() < trigger_ratio else f"сообщение {run._next_id}"
+        updates.append(fake_bot_api.message_update(run.next_id(), chat_id, run.rng.randint(1, run.args.members), text))
+    return updates
+
+
+async def steady(run):
+    await run.replay(messages(run, run.args.messages), rate=run.args.rate)
+    return len(run.done_at)
+
+
+async def trigger_storm(run):
+    await run.seed_groups()
+    updates = messages(run, run.args.messages)
+    # Волна триггеров приходится на самые активные группы
+    hot = [-1000 - g for g in range(1, 11)]
+    for i in range(run.args.storm):
+        position = len(updates) // 2 + i * 3
+        chat_id = hot[i % len(hot)]
+        storm = fake_bot_api.message_update(run.next_id(), chat_id, run.rng.randint(1, run.args.members), "@all срочно")
+        updates.insert(position, storm)
+    await run.replay(updates, rate=run.args.rate)
+    return len(run.done_at)
+
+
+async def join_leave(run):
+    await run.seed_groups()
+    updates = []
+    newcomers = range(run.args.members + 1, run.args.members + 1 + run.args.wave)
+    for wave in range(run.args.waves):
+        groups = run.rng.sample(range(run.args.groups), min(10, run.args.groups))
+        for joined in (True, False):
+            for g in groups:
+                for user_id in newcomers:
+                    updates.append(fake_bot_api.chat_member_update(run.next_id(), -1000 - g, user_id, joined))
+    await run.replay(updates, rate=run.args.rate)
+    return len(run.done_at)
+
+
+async def member_sync(run):
+    await run.seed_groups()
+    scheduler = run.tenant.member_sync_scheduler
+    sync_group = scheduler.sync_group
+    durations = []
+
+    async def timed_sync(bot, group, api_budget):
+        start = time.perf_counter()
+        await sync_group(bot, group, api_budget)
+        durations.append(time.perf_counter() - start)
+
+    scheduler.sync_group = timed_sync
+    # Ни одна группа ещё не синхронизирована, поэтому проходим такты всех шардов
+    epoch = datetime.datetime(1970, 1, 1)
+    base = epoch + scheduler.tick * (int((datetime.datetime.utcnow() - epoch) / scheduler.interval) * scheduler.shards)
+    for shard in range(scheduler.shards):
+        await scheduler.run_tick(run.application.bot, now=base + scheduler.tick * shard)
+    return durations
+
+
+async def admin_commands(run):
+    await run.seed_groups()
+    updates = []
+    for _ in range(run.args.commands):
+        # Часть команд от администраторов (ID 1..3), остальные от обычных участников
+        user_id = run.rng.randint(1, 3) if run.rng.random() < 0.5 else run.rng.randint(4, run.args.members)
+        updates.append(fake_bot_api.private_command_update(run.next_id(), user_id, "/groups"))
+    await run.replay(updates, rate=run.args.rate)
+    return len(run.done_at)
+
+
+SCENARIOS = {
+    'steady': steady,
+    'trigger_storm': trigger_storm,
+    'join_leave': join_leave,
+    'member_sync': member_sync,
+    'admin_commands': admin_commands,
+}
+
+# Настройки бота, с которыми сценарий выполняется за разумное время
+SCENARIO_ENV = {
+    'member_sync': {'SYNC_API_RATE': '1000', 'SYNC_CONCURRENCY': '8'},
+}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_scenario(name, args):
+    from sqlalchemy import event
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder, ExtBot, TypeHandler
+    from telegram.request import HTTPXRequest
+
+    import bot as bot_module
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    # Ответы 429 учитываются в отчёте, трассировки необработанных ошибок не нужны
+    logging.getLogger('telegram.ext').setLevel(logging.CRITICAL)
+
+    api = FakeBotAPI(
+        latency=args.api_latency / 1000, jitter=args.api_jitter / 1000,
+        global_rate=args.global_rate, chat_rate=args.chat_rate, members=args.members
+    )
+    await api.start()
+    application = (
+        ApplicationBuilder()
+        .bot(ExtBot(TOKEN, base_url=api.base_url, request=HTTPXRequest(connection_pool_size=256)))
+        .updater(None)
+        .application_class(bot_module.TrackingApplication, kwargs={
+            'tracker': bot_module.tenants[0].update_tracker, 'chat_scheduler': bot_module.chat_scheduler
+        })
+        .build()
+    )
+    run = Run(args, bot_module, application, api)
+    bot_module.register_handlers(application, run.tenant)
+    # Группа 1 выполняется после обработчиков бота из группы 0
+    application.add_handler(TypeHandler(Update, run.mark_done), group=1)
+
+    @event.listens_for(bot_module.db.engine, 'before_cursor_execute')
+    def count_statement(*_):
+        run.statements += 1
+
+    await application.initialize()
+    await application.start()
+    run.reset()
+    result = await SCENARIOS[name](run)
+    # Фоновые рассылки, отложенная запись активности и сворачивание журнала участников тоже входят
+    # в стоимость сценария; подготовка данных — нет
+    if bot_module.chat_scheduler is not None:
+        await bot_module.chat_scheduler.drain()
+    await run.tenant.trigger_coalescer.drain()
+    await run.tenant.activity_buffer.flush()
+    await run.tenant.member_log.compact()
+    elapsed = time.perf_counter() - run.started
+    await application.stop()
+    await application.shutdown()
+    await api.stop()
+
+    # member_sync возвращает длительности синхронизации групп, остальные — число обновлений
+    if isinstance(result, list):
+        events, latencies = len(result), result
+    else:
+        events, latencies = result, run.latencies()
+    return {
+        'scenario': name,
+        'events': events,
+        'seconds': round(elapsed, 3),
+        'throughput': round(events / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'sql_statements': run.statements,
+        'api_calls': sum(api.calls.values()),
+        'api_429': sum(api.rate_limited.values()),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def scenario_process(name, args, results):
+    # bot.py читает настройки при импорте и создаёт bot.db в рабочем каталоге
+    os.environ['BOT_TOKEN'] = TOKEN
+    os.environ['CONCURRENT_UPDATES'] = str(args.concurrent_updates)
+    os.environ.update(SCENARIO_ENV.get(name, {}))
+    random.seed(args.seed)
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        results.put(asyncio.run(run_scenario(name, args)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--groups', type=int, default=200)
+    parser.add_argument('--members', type=int, default=50, help="Участников в группе")
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--storm', type=int, default=60, help="Триггеров в волне trigger_storm")
+    parser.add_argument('--waves', type=int, default=5)
+    parser.add_argument('--wave', type=int, default=20, help="Участников, вступающих в группу за волну")
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=0, help="Обновлений в секунду (0 - как можно быстрее)")
+    parser.add_argument('--concurrent-updates', type=int, default=8, help="Чатов, обрабатываемых одновременно (0 - последовательно)")
+    parser.add_argument('--api-latency', type=float, default=20, help="Задержка ответа API, мс")
+    parser.add_argument('--api-jitter', type=float, default=10, help="Случайная добавка к задержке, мс")
+    parser.add_argument('--global-rate', type=float, default=30, help="Лимит sendMessage в секунду на бота")
+    parser.add_argument('--chat-rate', type=float, default=1, help="Лимит sendMessage в секунду на чат")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="Сохранить результаты в файл")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(unknown)}")
+
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    for name in names:
+        results = context.Queue()
+        process = context.Process(target=scenario_process, args=(name, args, results))
+        process.start()
+        rows.append(results.get())
+        process.join()
+
+    header = f"{'сценарий':<16}{'событий':>9}{'в сек':>9}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}" \
+             f"{'SQL':>8}{'SQL/соб':>9}{'API':>7}{'429':>6}{'RSS МБ':>9}"
+    print(header)
+    for row in rows:
+        per_event = row['sql_statements'] / row['events'] if row['events'] else 0
+        print(f"{row['scenario']:<16}{row['events']:>9}{row['throughput']:>9}{row['p50_ms']:>9}{row['p95_ms']:>9}"
+              f"{row['p99_ms']:>9}{row['sql_statements']:>8}{per_event:>9.2f}{row['api_calls']:>7}"
+              f"{row['api_429']:>6}{row['peak_rss_mb']:>9}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
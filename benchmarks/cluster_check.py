@@ -0,0 +1,212 @@
+# benchmarks/cluster_check.py
+"""
+Проверка работы нескольких процессов бота с общей базой данных.
+
+Запускается --workers процессов. При запуске каждый, как бот, создаёт таблицы
+и применяет миграции к ещё пустой базе одновременно с остальными. Затем каждый
+одновременно записывает активность
+участников с пересекающимися ключами (одни и те же группы и пользователи во всех
+процессах) в журнал member_events, сворачивает журнал в members одновременно с
+остальными и участвует в выборе ведущего; ведущий выполняет «периодическую
+задачу», отмечая её начало и конец в таблице job_runs. Через треть времени
+текущий ведущий аварийно завершается (без освобождения аренды), и роль должен
+перехватить другой процесс.
+
+В конце проверяется, что миграции применены один раз, в members нет дубликатов
+(group_id, telegram_id), журнал свёрнут полностью, запуски задачи разными процессами не пересекаются по времени и ведущий сменился.
+
+По умолчанию используется файл SQLite в режиме WAL; для PostgreSQL передайте
+--database-url (база должна быть пустой).
+
+Запуск: python benchmarks/cluster_check.py [--workers 4] [--duration 12] [--database-url URL]
+"""
+import argparse
+import asyncio
+import datetime
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, select, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from activity import ActivityBuffer  # noqa: E402
+from cluster import LeaderElection  # noqa: E402
+from db import Database  # noqa: E402
+from member_log import compact_events  # noqa: E402
+from migrations import MIGRATIONS, schema_version  # noqa: E402
+from models import Lease, Member, MemberEvent  # noqa: E402
+
+GROUPS = 20
+USERS = 200
+LEASE_TTL = 2
+JOB_SECONDS = 0.2
+
+job_metadata = MetaData()
+job_runs = Table(
+    'job_runs', job_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('holder', String, nullable=False),
+    Column('started', DateTime, nullable=False),
+    Column('finished', DateTime)
+)
+
+
+def start_job(session, holder):
+    return session.execute(job_runs.insert(), {'holder': holder, 'started': datetime.datetime.utcnow()}).inserted_primary_key[0]
+
+
+def finish_job(session, run_id):
+    session.execute(job_runs.update().where(job_runs.c.id == run_id), {'finished': datetime.datetime.utcnow()})
+
+
+async def worker_main(url, holder, deadline):
+    db = Database(url, pool_size=2)
+    db.migrate()
+    leader = LeaderElection(db, holder, ttl=LEASE_TTL)
+    await leader.renew()
+    leader.start()
+
+    async def write_activity():
+        rng = random.Random(holder)
+        writes = 0
+        while time.time() < deadline:
+            now = datetime.datetime.utcnow()
+            pending = {}
+            for _ in range(50):
+                chat_id, user_id = -1000 - rng.randrange(GROUPS), rng.randrange(USERS)
+                pending[(chat_id, user_id)] = {
+                    'username': f"user{user_id}", 'first_name': "User", 'last_name': holder,
+                    'full_name': f"User {user_id}", 'last_active': now
+                }
+            groups = {chat_id: f"Group {chat_id}" for chat_id, _ in pending}
+            await db.run(ActivityBuffer._write, pending, groups)
+            await db.run(compact_events, 1000)
+            writes += len(pending)
+        return writes
+
+    async def run_jobs():
+        runs = 0
+        while time.time() < deadline:
+            if leader.is_leader:
+                run_id = await db.run(start_job, holder)
+                await asyncio.sleep(JOB_SECONDS)
+                await db.run(finish_job, run_id)
+                runs += 1
+            await asyncio.sleep(0.05)
+        return runs
+
+    writes, runs = await asyncio.gather(write_activity(), run_jobs())
+    await leader.stop()
+    db.close()
+    print(f"  {holder}: записей активности {writes}, запусков задачи {runs}")
+
+
+def worker(url, holder, deadline):
+    asyncio.run(worker_main(url, holder, deadline))
+
+
+def current_leader(db):
+    with db.engine.connect() as connection:
+        row = connection.execute(select(Lease.holder, Lease.expires_at)).first()
+    if row and row.expires_at > datetime.datetime.utcnow():
+        return row.holder
+    return None
+
+
+def check(db):
+    failures = []
+    # Остаток журнала после аварийно остановленного процесса сворачивает проверка
+    with db.Session() as session, session.begin():
+        while compact_events(session, 1000)[0]:
+            pass
+    with db.engine.connect() as connection:
+        events = connection.execute(select(func.count()).select_from(MemberEvent.__table__)).scalar()
+        duplicates = connection.execute(
+            select(Member.group_id, Member.telegram_id, func.count())
+            .group_by(Member.group_id, Member.telegram_id)
+            .having(func.count() > 1)
+        ).all()
+        members = connection.execute(select(func.count()).select_from(Member.__table__)).scalar()
+        versions = connection.execute(select(schema_version.c.version)).scalars().all()
+        runs = connection.execute(
+            select(job_runs.c.holder, job_runs.c.started, job_runs.c.finished)
+            .where(job_runs.c.finished.isnot(None))
+            .order_by(job_runs.c.started)
+        ).all()
+
+    print(f"Версии схемы: {versions} (ожидается [{MIGRATIONS[-1][0]}])")
+    if versions != [MIGRATIONS[-1][0]]:
+        failures.append("миграции применены не один раз или не полностью")
+    print(f"Участников в базе: {members} (ожидается не больше {GROUPS * USERS}), дубликатов: {len(duplicates)}")
+    if duplicates:
+        failures.append("в members есть дубликаты (group_id, telegram_id)")
+    if events:
+        failures.append(f"в журнале member_events осталось {events} несвёрнутых событий")
+
+    overlaps = [
+        (a.holder, b.holder) for a, b in zip(runs, runs[1:])
+        if a.holder != b.holder and b.started < a.finished
+    ]
+    holders = list(dict.fromkeys(run.holder for run in runs))
+    print(f"Завершённых запусков задачи: {len(runs)}, ведущие по порядку: {', '.join(holders) or 'нет'}")
+    if overlaps:
+        failures.append(f"запуски задачи пересекаются: {overlaps[:3]}")
+    if len(holders) < 2:
+        failures.append("после остановки ведущего роль не перешла к другому процессу")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=12)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    tmpdir = None
+    url = args.database_url
+    if not url:
+        tmpdir = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(tmpdir.name, 'cluster.db')}"
+
+    # Таблицы бота и миграции процессы применяют сами при запуске
+    db = Database(url)
+    job_metadata.create_all(db.engine)
+    if db.is_sqlite:
+        with db.engine.connect() as connection:
+            connection.execute(text("PRAGMA journal_mode=WAL"))
+
+    deadline = time.time() + args.duration
+    context = multiprocessing.get_context('spawn')
+    processes = {}
+    for i in range(args.workers):
+        holder = f"worker-{i}"
+        processes[holder] = context.Process(target=worker, args=(url, holder, deadline))
+        processes[holder].start()
+
+    # Аварийно останавливаем ведущего, не давая ему освободить аренду
+    time.sleep(args.duration / 3)
+    crashed = current_leader(db)
+    if crashed:
+        processes[crashed].kill()
+        print(f"Ведущий {crashed} остановлен аварийно.")
+
+    for process in processes.values():
+        process.join()
+
+    failures = check(db)
+    db.close()
+    if tmpdir:
+        tmpdir.cleanup()
+    for failure in failures:
+        print(f"ОШИБКА: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
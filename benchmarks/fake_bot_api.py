@@ -0,0 +1,221 @@
+# benchmarks/fake_bot_api.py
+"""
+Локальная заглушка Telegram Bot API и генераторы синтетических обновлений.
+
+FakeBotAPI отвечает на getMe, getUpdates, getChatMember, getChatMemberCount,
+getChatAdministrators и sendMessage. Задержка ответа и лимиты отправки
+настраиваются; при превышении лимита возвращается 429 с retry_after, как у
+настоящего API.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_server import HTTPServer  # noqa: E402
+
+TOKEN = '123456:BENCHMARK'
+BOT_USERNAME = 'bench_bot'
+
+
+class RateLimit:
+    """
+    Неблокирующее ведро токенов: вместо ожидания сообщает, через сколько секунд повторить.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def take(self):
+        """
+        :return: 0, если запрос разрешён, иначе пауза в секундах до повтора
+        """
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+
+def user_json(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+
+
+def chat_json(chat_id):
+    return {'id': chat_id, 'type': 'supergroup', 'title': f"Группа {chat_id}"}
+
+
+class FakeBotAPI:
+    """
+    Заглушка Bot API на http_server.HTTPServer.
+
+    Состав групп детерминирован: в группе members участников с ID 1..members,
+    пользователь 1 — создатель, следующие admins — администраторы.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, global_rate=0, chat_rate=0, chat_burst=3, members=50, admins=2):
+        """
+        :param latency: Задержка ответа в секундах
+        :param jitter: Случайная добавка к задержке (0..jitter секунд)
+        :param global_rate: Лимит sendMessage в секунду на бота (0 - без лимита)
+        :param chat_rate: Лимит sendMessage в секунду на чат (0 - без лимита)
+        :param chat_burst: Допустимая серия сообщений в чат сверх лимита
+        :param members: Количество участников в каждой группе
+        :param admins: Количество администраторов помимо создателя
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.global_limit = RateLimit(global_rate) if global_rate else None
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.members = members
+        self.admins = admins
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        # Обновления для getUpdates; удаляются, когда бот подтверждает их параметром offset
+        self.updates = []
+        self._chat_limits = {}
+        self.http = HTTPServer(self.handle)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.http.port}/bot"
+
+    async def start(self):
+        await self.http.start('127.0.0.1', 0)
+
+    async def stop(self):
+        await self.http.stop()
+
+    def status_of(self, user_id):
+        if user_id == 1:
+            return 'creator'
+        if user_id <= 1 + self.admins:
+            return 'administrator'
+        if user_id <= self.members:
+            return 'member'
+        return 'left'
+
+    def chat_member_json(self, user_id):
+        member = {'status': self.status_of(user_id), 'user': user_json(user_id)}
+        if member['status'] == 'administrator':
+            member['can_be_edited'] = False
+            for right in ('can_manage_chat', 'can_delete_messages', 'can_manage_video_chats', 'can_restrict_members',
+                          'can_promote_members', 'can_change_info', 'can_invite_users', 'is_anonymous'):
+                member[right] = right != 'is_anonymous'
+        elif member['status'] == 'creator':
+            member['is_anonymous'] = False
+        return member
+
+    def _rate_limit(self, chat_id):
+        waits = []
+        if self.global_limit:
+            waits.append(self.global_limit.take())
+        if self.chat_rate:
+            limit = self._chat_limits.get(chat_id)
+            if limit is None:
+                limit = self._chat_limits[chat_id] = RateLimit(self.chat_rate, self.chat_burst)
+            waits.append(limit.take())
+        return max(waits, default=0)
+
+    async def handle(self, method, path, headers, body):
+        name = path.rsplit('/', 1)[-1]
+        self.calls[name] += 1
+        params = {}
+        for key, value in parse_qsl(body.decode()):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+
+        chat_id = int(params.get('chat_id', 0))
+        if name == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': BOT_USERNAME}
+        elif name == 'getUpdates':
+            offset = int(params.get('offset') or 0)
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            result = self.updates[:int(params.get('limit') or 100)]
+            if not result and params.get('timeout'):
+                # Короткое ожидание вместо долгого опроса, чтобы остановка бота не задерживалась
+                await asyncio.sleep(0.05)
+        elif name == 'getChatMember':
+            result = self.chat_member_json(int(params['user_id']))
+        elif name == 'getChatMemberCount':
+            result = self.members
+        elif name == 'getChatAdministrators':
+            result = [self.chat_member_json(user_id) for user_id in range(1, self.admins + 2)]
+        elif name == 'sendMessage':
+            retry_after = self._rate_limit(chat_id)
+            if retry_after:
+                self.rate_limited[name] += 1
+                return 429, {'Content-Type': 'application/json'}, json.dumps({
+                    'ok': False, 'error_code': 429,
+                    'description': f"Too Many Requests: retry after {int(retry_after) + 1}",
+                    'parameters': {'retry_after': int(retry_after) + 1},
+                }).encode()
+            result = {'message_id': self.calls[name], 'date': int(time.time()), 'text': params.get('text', ''),
+                      'chat': chat_json(chat_id)}
+        else:
+            result = True
+        return 200, {'Content-Type': 'application/json'}, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def message_update(update_id, chat_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': chat_json(chat_id),
+            'from': user_json(user_id),
+            'text': text,
+        },
+    }
+
+
+def chat_member_update(update_id, chat_id, user_id, joined):
+    old, new = ('left', 'member') if joined else ('member', 'left')
+    return {
+        'update_id': update_id,
+        'chat_member': {
+            'chat': chat_json(chat_id),
+            'from': user_json(user_id),
+            'date': int(time.time()),
+            'old_chat_member': {'status': old, 'user': user_json(user_id)},
+            'new_chat_member': {'status': new, 'user': user_json(user_id)},
+        },
+    }
+
+
+def private_command_update(update_id, user_id, command):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f"User{user_id}"},
+            'from': user_json(user_id),
+            'text': command,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command.split()[0])}],
+        },
+    }
+
+
+def skewed_chat(rng, groups):
+    """
+    ID группы с неравномерной активностью: первые группы пишут намного чаще.
+    """
+    return -1000 - int(rng.paretovariate(1.2)) % groups
@@ -0,0 +1,150 @@
+# benchmarks/webhook_load.py
+"""
+Нагрузочный генератор для режима webhook без обращения к Telegram.
+
+Скрипт поднимает в одном процессе заглушку Bot API (fake_bot_api.FakeBotAPI),
+приложение бота с обработчиками из bot.py и WebhookServer, после чего
+отправляет синтетические JSON-обновления по нескольким keep-alive
+соединениям. Время обработки измеряется от отправки POST до завершения
+обработчиков этого обновления.
+
+Запуск: python benchmarks/webhook_load.py [--updates 5000] [--connections 16]
+        [--concurrent-updates 8] [--trigger-ratio 0.0]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_bot_api  # noqa: E402
+from fake_bot_api import FakeBotAPI, TOKEN  # noqa: E402
+
+
+def make_update(update_id, groups, trigger_ratio):
+    chat_id = fake_bot_api.skewed_chat(random, groups)
+    text = "@all внимание" if random.random() < trigger_ratio else f"сообщение {update_id}"
+    return fake_bot_api.message_update(update_id, chat_id, random.randint(1, 500), text)
+
+
+async def client(port, path, payloads, sent_at):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    rejected = 0
+    for update_id, body in payloads:
+        sent_at[update_id] = time.perf_counter()
+        writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+        if length:
+            await reader.readexactly(length)
+        if status == 503:
+            rejected += 1
+    writer.close()
+    return rejected
+
+
+async def run(args):
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder, TypeHandler
+
+    import bot
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    from webhook import WebhookServer
+
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    await api.start()
+
+    tenant = bot.tenants[0]
+    application = (
+        ApplicationBuilder().token(TOKEN)
+        .base_url(api.base_url)
+        .updater(None)
+        .application_class(bot.TrackingApplication, kwargs={'tracker': tenant.update_tracker, 'chat_scheduler': bot.chat_scheduler})
+        .update_queue(asyncio.Queue(maxsize=args.queue_size))
+        .build()
+    )
+    bot.register_handlers(application, tenant)
+
+    done_at = {}
+    finished = asyncio.Event()
+
+    async def mark_done(update, context):
+        done_at[update.update_id] = time.perf_counter()
+        if len(done_at) >= args.updates:
+            finished.set()
+
+    # Группа 1 выполняется после обработчиков бота из группы 0
+    application.add_handler(TypeHandler(Update, mark_done), group=1)
+
+    server = WebhookServer({'/telegram': application})
+    await application.initialize()
+    await server.start('127.0.0.1', 0)
+    await application.start()
+
+    updates = [(i, json.dumps(make_update(i, args.groups, args.trigger_ratio)).encode()) for i in range(args.updates)]
+    sent_at = {}
+    started = time.perf_counter()
+    rejected = await asyncio.gather(*(
+        client(server.http.port, '/telegram', updates[i::args.connections], sent_at)
+        for i in range(args.connections)
+    ))
+    accepted = args.updates - sum(rejected)
+    while len(done_at) < accepted:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    await server.stop()
+    await application.stop()
+    await application.shutdown()
+    await tenant.activity_buffer.flush()
+    await api.stop()
+
+    latencies = sorted(done_at[i] - sent_at[i] for i in done_at)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"обновлений: {args.updates}, принято: {accepted}, отклонено (503): {sum(rejected)}")
+    print(f"пропускная способность: {accepted / elapsed:.1f} обновлений/с")
+    print(f"задержка обработки: p50 {p50 * 1000:.1f} мс, p99 {p99 * 1000:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--concurrent-updates', type=int, default=8)
+    parser.add_argument('--queue-size', type=int, default=1000)
+    parser.add_argument('--trigger-ratio', type=float, default=0.0, help="Доля сообщений с @all")
+    parser.add_argument('--api-latency', type=float, default=0, help="Задержка ответа заглушки API, мс")
+    args = parser.parse_args()
+
+    # bot.py читает токен и создаёт bot.db в рабочем каталоге
+    os.environ['BOT_TOKEN'] = TOKEN
+    # Количество чатов, обрабатываемых одновременно (0 - последовательно); bot.py читает его при импорте
+    os.environ['CONCURRENT_UPDATES'] = str(args.concurrent_updates)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(args))
+        os.chdir(ROOT)
+
+
+if __name__ == '__main__':
+    main()
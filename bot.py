@@ -1,15 +1,42 @@
 # bot.py
+import time
+
+# Отсчет времени запуска: от импорта модулей до обработки первого обновления
+STARTED_AT = time.perf_counter()
+
+import asyncio
+import functools
+import html
 import logging
 import os
-from telegram import Update
+import socket
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.constants import ParseMode
 from telegram.ext import (
     ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler,
-    filters, ChatMemberHandler
+    filters, ChatMemberHandler, CallbackQueryHandler, TypeHandler
 )
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import Base, Group, Member
+import db as queries
+import metrics
+from cluster import LeaderElection, UpdateRouter
+from db import Database, member_fields
+from member_sync import sync_members
+from maintenance import run_sqlite_maintenance
+from sync_scheduler import MemberSyncScheduler
+from triggers import BASE_TRIGGERS, TriggerMatcher, format_triggers
+from webhook import run_webhook
+from http_server import HTTPServer
+from activity import ActivityBuffer
+from member_log import JOIN, LEAVE, RENAME, MemberLog
+from update_tracker import TrackingApplication, UpdateTracker
+from chat_scheduler import ChatScheduler
+from roster_cache import RosterCache
+from dispatcher import MentionDispatcher
+from admin_cache import AdminCache
+from coalescer import TriggerCoalescer
+from roles import RoleCache, mentioned_tags, valid_tag
+from profiler import SamplingProfiler
+from tenancy import SharedRequest, parse_bot_tokens, run_polling, tenant_schema
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 import datetime
@@ -21,11 +48,78 @@ load_dotenv()
 
 # Получение настроек из переменных окружения
 BOT_TOKEN = os.getenv('BOT_TOKEN')
+BOT_TOKENS = os.getenv('BOT_TOKENS', '')
 TIMEZONE = os.getenv('TIMEZONE', 'UTC')
+ACTIVITY_FLUSH_INTERVAL = int(os.getenv('ACTIVITY_FLUSH_INTERVAL', '5'))
+ACTIVITY_BUFFER_SIZE = int(os.getenv('ACTIVITY_BUFFER_SIZE', '500'))
+ROSTER_CACHE_SIZE = int(os.getenv('ROSTER_CACHE_SIZE', '1000'))
+MENTIONS_PER_MESSAGE = int(os.getenv('MENTIONS_PER_MESSAGE', '50'))
+GLOBAL_SEND_RATE = float(os.getenv('GLOBAL_SEND_RATE', '25'))
+CHAT_SEND_RATE = float(os.getenv('CHAT_SEND_RATE', '1'))
+ADMIN_CACHE_TTL = int(os.getenv('ADMIN_CACHE_TTL', '300'))
+ADMIN_CHECK_CONCURRENCY = int(os.getenv('ADMIN_CHECK_CONCURRENCY', '20'))
+INACTIVE_SWEEP_BATCH = int(os.getenv('INACTIVE_SWEEP_BATCH', '500'))
+SYNC_INTERVAL_HOURS = float(os.getenv('SYNC_INTERVAL_HOURS', '24'))
+SYNC_SHARDS = int(os.getenv('SYNC_SHARDS', '24'))
+SYNC_CONCURRENCY = int(os.getenv('SYNC_CONCURRENCY', '4'))
+SYNC_API_RATE = float(os.getenv('SYNC_API_RATE', '5'))
+UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling').lower()
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '8'))
+CHAT_QUEUE_DEPTH = int(os.getenv('CHAT_QUEUE_DEPTH', '50'))
+CHAT_QUEUE_LIMIT = int(os.getenv('CHAT_QUEUE_LIMIT', '1000'))
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+DATABASE_URL = os.getenv('DATABASE_URL') or 'sqlite:///bot.db'
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', '-65536'))
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))
+MAINTENANCE_INTERVAL_HOURS = float(os.getenv('MAINTENANCE_INTERVAL_HOURS', '6'))
+MAINTENANCE_VACUUM_PAGES = int(os.getenv('MAINTENANCE_VACUUM_PAGES', '0'))
+MAINTENANCE_FULL_VACUUM_MAX_MB = float(os.getenv('MAINTENANCE_FULL_VACUUM_MAX_MB', '64'))
+CACHE_TTL = int(os.getenv('CACHE_TTL', '0'))
+INSTANCE_NAME = os.getenv('INSTANCE_NAME') or f"{socket.gethostname()}:{os.getpid()}"
+LEADER_LEASE_SECONDS = int(os.getenv('LEADER_LEASE_SECONDS', '30'))
+WORKER_ID = int(os.getenv('WORKER_ID', '0'))
+WARMUP_ROSTERS = int(os.getenv('WARMUP_ROSTERS', '50'))
+MEMBERS_PAGE_SIZE = int(os.getenv('MEMBERS_PAGE_SIZE', '10'))
+MEMBER_LOG_COMPACT_INTERVAL = int(os.getenv('MEMBER_LOG_COMPACT_INTERVAL', '30'))
+MEMBER_LOG_BATCH = int(os.getenv('MEMBER_LOG_BATCH', '5000'))
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '30'))
+CATCHUP_AGE = int(os.getenv('CATCHUP_AGE', '60'))
+CATCHUP_WINDOW = float(os.getenv('CATCHUP_WINDOW', '10'))
+TRIGGER_WINDOW = float(os.getenv('TRIGGER_WINDOW', '2'))
+TRIGGER_COOLDOWN = int(os.getenv('TRIGGER_COOLDOWN', '30'))
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+BOT_ADMINS = {int(user_id) for user_id in os.getenv('BOT_ADMINS', '').split(',') if user_id.strip()}
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', '300'))
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', '20'))
+WORKER_PEERS = [peer.strip() for peer in os.getenv('WORKER_PEERS', '').split(',') if peer.strip()]
+
+# Боты процесса: бот из BOT_TOKEN работает с основными таблицами, боты из BOT_TOKENS — каждый со своей схемой
+TENANT_TOKENS = ([('', BOT_TOKEN)] if BOT_TOKEN else []) + parse_bot_tokens(BOT_TOKENS)
 
 # Проверка наличия обязательных конфигураций
-if not BOT_TOKEN:
-    raise ValueError("Отсутствует токен бота (BOT_TOKEN) в конфигурационном файле .env.")
+if not TENANT_TOKENS:
+    raise ValueError("Отсутствует токен бота (BOT_TOKEN или BOT_TOKENS) в конфигурационном файле .env.")
+if UPDATE_MODE not in ('polling', 'webhook'):
+    raise ValueError(f"Неизвестный режим получения обновлений UPDATE_MODE='{UPDATE_MODE}'. Допустимо: polling, webhook.")
+if UPDATE_MODE == 'webhook' and not WEBHOOK_URL:
+    raise ValueError("Для режима webhook необходимо указать WEBHOOK_URL в конфигурационном файле .env.")
+if WORKER_PEERS and UPDATE_MODE != 'webhook':
+    raise ValueError("Распределение обновлений между процессами (WORKER_PEERS) работает только в режиме webhook.")
+if WORKER_PEERS and len(TENANT_TOKENS) > 1:
+    raise ValueError("Распределение обновлений между процессами (WORKER_PEERS) поддерживается только для одного бота.")
+if WORKER_PEERS and not 0 <= WORKER_ID < len(WORKER_PEERS):
+    raise ValueError(f"WORKER_ID={WORKER_ID} вне списка WORKER_PEERS из {len(WORKER_PEERS)} адресов.")
 
 # Настройка логирования
 logging.basicConfig(
@@ -34,10 +128,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Создание базы данных
-engine = create_engine('sqlite:///bot.db')
-Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
+# Создание базы данных; соединения с ней общие для всех ботов процесса
+db = Database(DATABASE_URL, pool_size=DB_POOL_SIZE, sqlite_pragmas={
+    'synchronous': SQLITE_SYNCHRONOUS,
+    'mmap_size': SQLITE_MMAP_SIZE,
+    'cache_size': SQLITE_CACHE_SIZE,
+    'busy_timeout': SQLITE_BUSY_TIMEOUT,
+})
+db.migrate()
+
+# Обновления одного чата обрабатываются по порядку, разных чатов — параллельно; очереди общие для всех ботов
+chat_scheduler = ChatScheduler(
+    concurrency=CONCURRENT_UPDATES, max_depth=CHAT_QUEUE_DEPTH, max_pending=CHAT_QUEUE_LIMIT
+) if CONCURRENT_UPDATES > 0 else None
+
+# Общий пул HTTP-соединений к Bot API
+bot_request = SharedRequest(connection_pool_size=256)
+
+# Профилирование по команде /profile; пока оно не запущено, затрат нет
+profiler = SamplingProfiler(output_dir=PROFILE_DIR, interval=PROFILE_INTERVAL_MS / 1000, top=PROFILE_TOP)
 
 # Часовой пояс для планировщика
 try:
@@ -46,56 +155,63 @@ except pytz.UnknownTimeZoneError:
     logger.warning(f"Неизвестный часовой пояс '{TIMEZONE}'. Используется UTC.")
     TIMEZONE = pytz.utc
 
-# Глобальный список триггерных слов
-TRIGGER_WORDS = []
+# Планировщик создается заранее, задачи всех ботов добавляются до запуска, а запускается он после прогрева
+scheduler = AsyncIOScheduler(timezone=TIMEZONE)
+
+# Локальный эндпоинт /metrics
+metrics_server = HTTPServer(metrics.handle_metrics)
 
 async def get_bot_username(bot):
     """
     Получает уникальное имя бота.
+
+    Имя берется из данных getMe, сохраненных при инициализации бота; запрос к API
+    выполняется, только если бот еще не инициализирован.
     """
     try:
-        me = await bot.get_me()
-        return f"@{me.username}" if me.username else ""
+        try:
+            username = bot.username
+        except RuntimeError:
+            username = (await bot.get_me()).username
+        return f"@{username}" if username else ""
     except Exception as e:
         logger.error(f"Ошибка при получении имени бота: {e}")
         return ""
 
-async def is_user_admin(bot, chat_id, user_id):
+async def is_user_admin(tenant, bot, chat_id, user_id):
     """
     Проверяет, является ли пользователь администратором или создателем чата.
 
+    :param tenant: Бот процесса (Tenant)
     :param bot: Экземпляр бота
     :param chat_id: ID чата (группы)
     :param user_id: ID пользователя
     :return: True, если пользователь администратор или создатель, иначе False
     """
-    try:
-        member = await bot.get_chat_member(chat_id=chat_id, user_id=user_id)
-        return member.status in ['administrator', 'creator']
-    except Exception as e:
-        logger.error(f"Ошибка при проверке статуса администратора для пользователя {user_id} в чате {chat_id}: {e}")
-        return False
+    return await tenant.admin_cache.is_admin(bot, chat_id, user_id)
 
 # Функция старта
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global TRIGGER_WORDS
+    tenant = context.bot_data['tenant']
     bot = context.bot
     bot_username = await get_bot_username(bot)
     if not bot_username:
         await update.message.reply_text("Не удалось определить имя бота. Пожалуйста, убедитесь, что бот имеет username.")
         return
 
-    # Добавляем в список триггеров имя бота, @all и @everyone
-    TRIGGER_WORDS = [bot_username.lower(), "@all", "@everyone"]
+    # Триггеры по умолчанию: имя бота, @all и @everyone
+    if not tenant.trigger_matcher.default_triggers:
+        tenant.trigger_matcher.set_default_triggers([bot_username.lower()] + BASE_TRIGGERS)
+    trigger_words = ', '.join(tenant.trigger_matcher.default_triggers)
 
     start_message = (
         "Привет!\n"
         "Я бот для упоминания всех участников группы.\n\n"
-        f"Бот {bot_username} помогает упоминать всех участников группы при использовании {', '.join(TRIGGER_WORDS)}.\n\n"
+        f"Бот {bot_username} помогает упоминать всех участников группы при использовании {trigger_words}.\n\n"
         f"Как использовать {bot_username}:\n"
         "- Добавьте бота в группу.\n"
         "- Убедитесь, что бот имеет права читать сообщения и отправлять сообщения.\n"
-        f"- Введите {', '.join(TRIGGER_WORDS)} в сообщении, чтобы бот упомянул всех участников."
+        f"- Введите {trigger_words} в сообщении, чтобы бот упомянул всех участников."
     )
     await update.message.reply_text(start_message)
 
@@ -112,13 +228,21 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/groups - Показать группы, где вы администратор\n"
         "/members <Group_ID> - Показать список участников группы\n"
         "/set_expiration_days <Group_ID> <дней> - Установить дни до удаления неактивных участников из базы\n"
+        "/set_triggers <Group_ID> [триггеры...] - Задать триггерные слова группы (без триггеров - вернуть стандартные)\n"
+        "/set_cooldown <Group_ID> <секунд> - Установить паузу между упоминаниями всех в группе\n"
+        "/tag <Group_ID> <роль> <Telegram_ID...> - Добавить участников в роль для упоминаний вида @роль\n"
+        "/untag <Group_ID> <роль> [Telegram_ID...] - Убрать участников из роли (без ID - удалить роль)\n"
+        "/tags <Group_ID> - Показать роли группы\n"
         "/del_member <Telegram_ID> <Group_ID> - Удалить участника из базы данных\n"
         "/update - Обновить список участников вручную по всем группам\n"
     )
+    if update.effective_user.id in BOT_ADMINS:
+        help_text += "/profile [секунд | updates <N>] - Профилировать бота заданное время или до обработки N обновлений\n"
     await update.message.reply_text(help_text)
 
 # Обработка команды /groups
 async def groups_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
     if update.effective_chat.type != 'private':
         await update.message.reply_text("Эта команда доступна только в личном чате с ботом.")
         return  # Игнорировать команды вне личного чата
@@ -126,14 +250,9 @@ async def groups_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     bot = context.bot
 
-    session = Session()
     try:
-        groups = session.query(Group).all()
-        admin_groups = []
-        for group in groups:
-            is_admin = await is_user_admin(bot, group.telegram_id, user_id)
-            if is_admin:
-                admin_groups.append(group)
+        groups = await tenant.db.run(queries.list_groups)
+        admin_groups = await tenant.admin_cache.filter_admin_groups(bot, groups, user_id)
 
         if not admin_groups:
             await update.message.reply_text("Вы не являетесь администратором ни одной группы.")
@@ -148,11 +267,10 @@ async def groups_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Ошибка при выполнении команды /groups: {e}")
         await update.message.reply_text("Произошла ошибка при получении списка групп.")
-    finally:
-        session.close()
 
 # Обработка команды /members <Group_ID>
 async def members_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
     if update.effective_chat.type != 'private':
         await update.message.reply_text("Эта команда доступна только в личном чате с ботом.")
         return  # Игнорировать команды вне личного чата
@@ -170,56 +288,94 @@ async def members_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     bot = context.bot
 
-    session = Session()
     try:
-        group = session.query(Group).filter(Group.telegram_id == group_id).first()
+        group = await tenant.db.run(queries.get_group, group_id)
         if not group:
             await update.message.reply_text("Группа с таким ID не найдена в базе данных.")
             return
 
         # Проверка, является ли пользователь администратором этой группы
-        is_admin = await is_user_admin(bot, group.telegram_id, user_id)
+        is_admin = await is_user_admin(tenant, bot, group.telegram_id, user_id)
         if not is_admin:
             await update.message.reply_text("Вы не являетесь администратором этой группы.")
             return
 
-        members = session.query(Member).filter(Member.group_id == group.id).all()
+        await tenant.member_log.compact()
+        _, members, has_next = await tenant.db.run(queries.get_members_page, group.telegram_id, limit=MEMBERS_PAGE_SIZE)
         if not members:
             await update.message.reply_text("В базе данных нет участников этой группы.")
             return
 
-        message_lines = [f"<b>Список участников группы '{group.name or 'Без названия'}':</b>"]
-        now = datetime.datetime.utcnow()
-        for member in members:
-            last_active = member.last_active.strftime('%Y-%m-%d %H:%M:%S UTC')
-            days_since_last_active = (now - member.last_active).days
-            expiration_days = group.expiration_days
-            days_until_deletion = max(expiration_days - days_since_last_active, 0)
-            username = f"@{member.username}" if member.username else "Не указан"
-            member_info = (
-                f"<b>ID:</b> <code>{member.telegram_id}</code>\n"
-                f"<b>Имя:</b> {member.full_name or 'Без имени'}\n"
-                f"<b>Username:</b> {username}\n"
-                f"<b>Последняя активность:</b> {last_active}\n"
-                f"<b>Дней до удаления из базы:</b> {days_until_deletion}"
-            )
-            message_lines.append("\n---\n" + member_info)
-
-        message_text = "\n".join(message_lines)
-        # Разбиваем на части при необходимости
-        if len(message_text) > 4096:
-            for chunk in [message_text[i:i+4000] for i in range(0, len(message_text), 4000)]:
-                await update.message.reply_text(chunk, parse_mode=ParseMode.HTML)
-        else:
-            await update.message.reply_text(message_text, parse_mode=ParseMode.HTML)
+        text, keyboard = render_members_page(group, members, has_prev=False, has_next=has_next)
+        await update.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
     except Exception as e:
         logger.error(f"Ошибка при выполнении команды /members: {e}")
         await update.message.reply_text("Произошла ошибка при получении списка участников.")
-    finally:
-        session.close()
+
+# Формирование страницы списка участников с кнопками листания
+def render_members_page(group, members, has_prev, has_next):
+    message_lines = [f"<b>Список участников группы '{html.escape(group.name or 'Без названия')}':</b>"]
+    now = datetime.datetime.utcnow()
+    for member in members:
+        last_active = member.last_active.strftime('%Y-%m-%d %H:%M:%S UTC')
+        days_since_last_active = (now - member.last_active).days
+        expiration_days = group.expiration_days
+        days_until_deletion = max(expiration_days - days_since_last_active, 0)
+        username = f"@{member.username}" if member.username else "Не указан"
+        member_info = (
+            f"<b>ID:</b> <code>{member.telegram_id}</code>\n"
+            f"<b>Имя:</b> {html.escape(member.full_name or 'Без имени')}\n"
+            f"<b>Username:</b> {html.escape(username)}\n"
+            f"<b>Последняя активность:</b> {last_active}\n"
+            f"<b>Дней до удаления из базы:</b> {days_until_deletion}"
+        )
+        message_lines.append("\n---\n" + member_info)
+
+    # В кнопках передается ключ страницы: ID первого или последнего участника на ней
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("« Назад", callback_data=f"members:{group.telegram_id}:p:{members[0].id}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Далее »", callback_data=f"members:{group.telegram_id}:n:{members[-1].id}"))
+    keyboard = InlineKeyboardMarkup([buttons]) if buttons else None
+    return "\n".join(message_lines), keyboard
+
+# Листание списка участников кнопками под сообщением /members
+async def members_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
+    query = update.callback_query
+    try:
+        _, chat_id, direction, key = query.data.split(':')
+        chat_id, key = int(chat_id), int(key)
+    except ValueError:
+        await query.answer()
+        return
+
+    try:
+        if not await is_user_admin(tenant, context.bot, chat_id, query.from_user.id):
+            await query.answer("Вы не являетесь администратором этой группы.", show_alert=True)
+            return
+
+        if direction == 'p':
+            group, members, has_prev = await tenant.db.run(queries.get_members_page, chat_id, before_id=key, limit=MEMBERS_PAGE_SIZE)
+            has_next = True
+        else:
+            group, members, has_next = await tenant.db.run(queries.get_members_page, chat_id, after_id=key, limit=MEMBERS_PAGE_SIZE)
+            has_prev = True
+        if not members:
+            await query.answer("Участников на этой странице больше нет.")
+            return
+
+        text, keyboard = render_members_page(group, members, has_prev=has_prev, has_next=has_next)
+        await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+        await query.answer()
+    except Exception as e:
+        logger.error(f"Ошибка при листании списка участников: {e}")
+        await query.answer("Произошла ошибка при получении списка участников.")
 
 # Обработка команды /set_expiration_days <Group_ID> <дней>
 async def set_expiration_days_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
     if update.effective_chat.type != 'private':
         await update.message.reply_text("Эта команда доступна только в личном чате с ботом.")
         return  # Игнорировать команды вне личного чата
@@ -240,22 +396,19 @@ async def set_expiration_days_command(update: Update, context: ContextTypes.DEFA
     user_id = update.effective_user.id
     bot = context.bot
 
-    session = Session()
     try:
-        group = session.query(Group).filter(Group.telegram_id == group_id).first()
+        group = await tenant.db.run(queries.get_group, group_id)
         if not group:
             await update.message.reply_text("Группа с таким ID не найдена в базе данных.")
             return
 
         # Проверка, является ли пользователь администратором этой группы
-        is_admin = await is_user_admin(bot, group.telegram_id, user_id)
+        is_admin = await is_user_admin(tenant, bot, group.telegram_id, user_id)
         if not is_admin:
             await update.message.reply_text("Вы не являетесь администратором этой группы.")
             return
 
-        old_days = group.expiration_days
-        group.expiration_days = new_days
-        session.commit()
+        old_days = await tenant.db.run(queries.set_expiration_days, group.telegram_id, new_days)
 
         await update.message.reply_text(
             f"Количество дней до удаления участников из базы успешно изменено с {old_days} на {new_days} дней для группы '{group.name or 'Без названия'}'."
@@ -263,11 +416,240 @@ async def set_expiration_days_command(update: Update, context: ContextTypes.DEFA
     except Exception as e:
         logger.error(f"Ошибка при выполнении команды /set_expiration_days: {e}")
         await update.message.reply_text("Произошла ошибка при установке дней до удаления из базы.")
-    finally:
-        session.close()
+
+# Обработка команды /set_triggers <Group_ID> [триггеры...]
+async def set_triggers_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
+    if update.effective_chat.type != 'private':
+        await update.message.reply_text("Эта команда доступна только в личном чате с ботом.")
+        return  # Игнорировать команды вне личного чата
+
+    if len(context.args) < 1:
+        await update.message.reply_text("Использование: /set_triggers <Group_ID> [триггеры...]")
+        return
+
+    try:
+        group_id = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("Неверный формат Group_ID. Пожалуйста, введите числовой ID группы.")
+        return
+
+    user_id = update.effective_user.id
+    bot = context.bot
+
+    try:
+        group = await tenant.db.run(queries.get_group, group_id)
+        if not group:
+            await update.message.reply_text("Группа с таким ID не найдена в базе данных.")
+            return
+
+        # Проверка, является ли пользователь администратором этой группы
+        is_admin = await is_user_admin(tenant, bot, group.telegram_id, user_id)
+        if not is_admin:
+            await update.message.reply_text("Вы не являетесь администратором этой группы.")
+            return
+
+        value = format_triggers(context.args[1:])
+        await tenant.db.run(queries.set_group_triggers, group.telegram_id, value)
+        tenant.trigger_matcher.load(group.telegram_id, value)
+
+        triggers = tenant.trigger_matcher.triggers_for(value)
+        await update.message.reply_text(
+            f"Триггерные слова группы '{group.name or 'Без названия'}': {', '.join(triggers) or 'стандартные'}."
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /set_triggers: {e}")
+        await update.message.reply_text("Произошла ошибка при установке триггерных слов.")
+
+# Обработка команды /set_cooldown <Group_ID> <секунд>
+async def set_cooldown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
+    if update.effective_chat.type != 'private':
+        await update.message.reply_text("Эта команда доступна только в личном чате с ботом.")
+        return  # Игнорировать команды вне личного чата
+
+    if len(context.args) != 2:
+        await update.message.reply_text("Использование: /set_cooldown <Group_ID> <секунд>")
+        return
+
+    try:
+        group_id = int(context.args[0])
+        seconds = int(context.args[1])
+        if seconds < 0:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text("Пожалуйста, введите корректные числовые значения для Group_ID и секунд (неотрицательное число).")
+        return
+
+    user_id = update.effective_user.id
+    bot = context.bot
+
+    try:
+        group = await tenant.db.run(queries.get_group, group_id)
+        if not group:
+            await update.message.reply_text("Группа с таким ID не найдена в базе данных.")
+            return
+
+        # Проверка, является ли пользователь администратором этой группы
+        is_admin = await is_user_admin(tenant, bot, group.telegram_id, user_id)
+        if not is_admin:
+            await update.message.reply_text("Вы не являетесь администратором этой группы.")
+            return
+
+        await tenant.db.run(queries.set_trigger_cooldown, group.telegram_id, seconds)
+        tenant.trigger_coalescer.set_cooldown(group.telegram_id, seconds)
+
+        await update.message.reply_text(
+            f"Пауза между упоминаниями всех в группе '{group.name or 'Без названия'}' установлена: {seconds} с."
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /set_cooldown: {e}")
+        await update.message.reply_text("Произошла ошибка при установке паузы между упоминаниями.")
+
+# Обработка команды /tag <Group_ID> <роль> <Telegram_ID...>
+async def tag_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
+    if update.effective_chat.type != 'private':
+        await update.message.reply_text("Эта команда доступна только в личном чате с ботом.")
+        return  # Игнорировать команды вне личного чата
+
+    if len(context.args) < 3:
+        await update.message.reply_text("Использование: /tag <Group_ID> <роль> <Telegram_ID...>")
+        return
+
+    tag = context.args[1].lstrip('@').lower()
+    if not valid_tag(tag):
+        await update.message.reply_text("Роль должна состоять из букв, цифр и '_' (до 32 символов) и не совпадать с all, everyone или admins.")
+        return
+
+    try:
+        group_id = int(context.args[0])
+        target_ids = [int(arg) for arg in context.args[2:]]
+    except ValueError:
+        await update.message.reply_text("Неверный формат. Пожалуйста, введите числовые значения для Group_ID и Telegram_ID.")
+        return
+
+    user_id = update.effective_user.id
+    bot = context.bot
+
+    try:
+        group = await tenant.db.run(queries.get_group, group_id)
+        if not group:
+            await update.message.reply_text("Группа с таким ID не найдена в базе данных.")
+            return
+
+        # Проверка, является ли пользователь администратором этой группы
+        is_admin = await is_user_admin(tenant, bot, group.telegram_id, user_id)
+        if not is_admin:
+            await update.message.reply_text("Вы не являетесь администратором этой группы.")
+            return
+
+        added = await tenant.db.run(queries.add_member_tags, group.telegram_id, tag, target_ids)
+        tenant.role_cache.invalidate_tags(group.telegram_id)
+
+        await update.message.reply_text(
+            f"В роль @{tag} группы '{group.name or 'Без названия'}' добавлено участников: {added}."
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /tag: {e}")
+        await update.message.reply_text("Произошла ошибка при добавлении участников в роль.")
+
+# Обработка команды /untag <Group_ID> <роль> [Telegram_ID...]
+async def untag_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
+    if update.effective_chat.type != 'private':
+        await update.message.reply_text("Эта команда доступна только в личном чате с ботом.")
+        return  # Игнорировать команды вне личного чата
+
+    if len(context.args) < 2:
+        await update.message.reply_text("Использование: /untag <Group_ID> <роль> [Telegram_ID...]")
+        return
+
+    tag = context.args[1].lstrip('@').lower()
+    try:
+        group_id = int(context.args[0])
+        target_ids = [int(arg) for arg in context.args[2:]] or None
+    except ValueError:
+        await update.message.reply_text("Неверный формат. Пожалуйста, введите числовые значения для Group_ID и Telegram_ID.")
+        return
+
+    user_id = update.effective_user.id
+    bot = context.bot
+
+    try:
+        group = await tenant.db.run(queries.get_group, group_id)
+        if not group:
+            await update.message.reply_text("Группа с таким ID не найдена в базе данных.")
+            return
+
+        # Проверка, является ли пользователь администратором этой группы
+        is_admin = await is_user_admin(tenant, bot, group.telegram_id, user_id)
+        if not is_admin:
+            await update.message.reply_text("Вы не являетесь администратором этой группы.")
+            return
+
+        removed = await tenant.db.run(queries.remove_member_tags, group.telegram_id, tag, target_ids)
+        tenant.role_cache.invalidate_tags(group.telegram_id)
+
+        await update.message.reply_text(
+            f"Из роли @{tag} группы '{group.name or 'Без названия'}' удалено участников: {removed}."
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /untag: {e}")
+        await update.message.reply_text("Произошла ошибка при удалении участников из роли.")
+
+# Обработка команды /tags <Group_ID>
+async def tags_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
+    if update.effective_chat.type != 'private':
+        await update.message.reply_text("Эта команда доступна только в личном чате с ботом.")
+        return  # Игнорировать команды вне личного чата
+
+    if len(context.args) != 1:
+        await update.message.reply_text("Использование: /tags <Group_ID>")
+        return
+
+    try:
+        group_id = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("Неверный формат. Пожалуйста, введите числовое значение для Group_ID.")
+        return
+
+    user_id = update.effective_user.id
+    bot = context.bot
+
+    try:
+        group = await tenant.db.run(queries.get_group, group_id)
+        if not group:
+            await update.message.reply_text("Группа с таким ID не найдена в базе данных.")
+            return
+
+        # Проверка, является ли пользователь администратором этой группы
+        is_admin = await is_user_admin(tenant, bot, group.telegram_id, user_id)
+        if not is_admin:
+            await update.message.reply_text("Вы не являетесь администратором этой группы.")
+            return
+
+        tags = await tenant.db.run(queries.get_group_tags, group.telegram_id)
+        if not tags:
+            await update.message.reply_text(f"В группе '{group.name or 'Без названия'}' нет ролей. Упоминание @admins доступно всегда.")
+            return
+
+        lines = [f"Роли группы '{html.escape(group.name or 'Без названия')}':"]
+        for tag, members in tags.items():
+            names = ', '.join(
+                f"{html.escape(full_name or 'без имени')} (<code>{telegram_id}</code>)"
+                for telegram_id, _, full_name in members
+            )
+            lines.append(f"@{tag}: {names}")
+        await update.message.reply_text('\n'.join(lines), parse_mode=ParseMode.HTML)
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /tags: {e}")
+        await update.message.reply_text("Произошла ошибка при получении ролей группы.")
 
 # Обработка команды /del_member <Telegram_ID> <Group_ID>
 async def del_member_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
     if update.effective_chat.type != 'private':
         await update.message.reply_text("Эта команда доступна только в личном чате с ботом.")
         return  # Игнорировать команды вне личного чата
@@ -286,26 +668,27 @@ async def del_member_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = update.effective_user.id
     bot = context.bot
 
-    session = Session()
     try:
-        group = session.query(Group).filter(Group.telegram_id == group_id).first()
+        group = await tenant.db.run(queries.get_group, group_id)
         if not group:
             await update.message.reply_text("Группа с таким ID не найдена в базе данных.")
             return
 
         # Проверка, является ли пользователь администратором этой группы
-        is_admin = await is_user_admin(bot, group.telegram_id, user_id)
+        is_admin = await is_user_admin(tenant, bot, group.telegram_id, user_id)
         if not is_admin:
             await update.message.reply_text("Вы не являетесь администратором этой группы.")
             return
 
-        member = session.query(Member).filter(Member.telegram_id == target_id, Member.group_id == group.id).first()
+        tenant.activity_buffer.discard(group.telegram_id, target_id)
+        tenant.roster_cache.remove(group.telegram_id, target_id)
+        # Несвёрнутые события участника иначе вернули бы его в базу после удаления
+        await tenant.member_log.compact()
+        member = await tenant.db.run(queries.delete_member, group.telegram_id, target_id)
         if not member:
             await update.message.reply_text(f"Участник с ID <code>{target_id}</code> не найден в группе '{group.name or 'Без названия'}'.")
             return
 
-        session.delete(member)
-        session.commit()
         await update.message.reply_text(
             f"Участник {member.full_name or 'без имени'} (ID: <code>{target_id}</code>) успешно удалён из группы '{group.name or 'Без названия'}'.",
             parse_mode=ParseMode.HTML
@@ -313,11 +696,10 @@ async def del_member_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except Exception as e:
         logger.error(f"Ошибка при выполнении команды /del_member: {e}")
         await update.message.reply_text("Произошла ошибка при удалении участника из базы.")
-    finally:
-        session.close()
 
 # Обработка команды /update
 async def update_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
     if update.effective_chat.type != 'private':
         await update.message.reply_text("Эта команда доступна только в личном чате с ботом.")
         return  # Игнорировать команды вне личного чата
@@ -325,14 +707,9 @@ async def update_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     bot = context.bot
 
-    session = Session()
     try:
-        groups = session.query(Group).all()
-        admin_groups = []
-        for group in groups:
-            is_admin = await is_user_admin(bot, group.telegram_id, user_id)
-            if is_admin:
-                admin_groups.append(group)
+        groups = await tenant.db.run(queries.list_groups)
+        admin_groups = await tenant.admin_cache.filter_admin_groups(bot, groups, user_id)
 
         if not admin_groups:
             await update.message.reply_text("Вы не являетесь администратором ни одной группы.")
@@ -340,313 +717,690 @@ async def update_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         await update.message.reply_text("Начинаю обновление участников для ваших групп...")
 
-        for group in admin_groups:
+        # Синхронизация перезаписывает members, поэтому накопленные события сворачиваются до неё
+        await tenant.member_log.compact()
+
+        async def on_done(group, synced, error):
+            name = group.name or 'Без названия'
+            if isinstance(error, AttributeError):
+                text = f"Произошла ошибка при обновлении группы '{name}'. Проверьте права бота."
+            elif error is not None:
+                text = f"Произошла ошибка при обновлении группы '{name}'."
+            else:
+                text = f"Группа '{name}': обновлено администраторов: {synced}."
             try:
-                # Исправляем метод: теперь get_chat_member_count
-                members_count = await bot.get_chat_member_count(chat_id=group.telegram_id)
-
-                if members_count > 200:
-                    logger.info(f"Группа {group.telegram_id} слишком большая для ручного обновления.")
-                    await update.message.reply_text(f"Группа '{group.name or 'Без названия'}' слишком большая для ручного обновления.")
-                    continue
-
-                # Получаем всех участников группы
-                members = []
-                async for member in bot.get_chat_members(chat_id=group.telegram_id):
-                    members.append(member.user)
-
-                active_ids = set()
-                for user in members:
-                    active_ids.add(user.id)
-                    db_member = session.query(Member).filter(Member.telegram_id == user.id, Member.group_id == group.id).first()
-                    if not db_member:
-                        db_member = Member(
-                            telegram_id=user.id,
-                            username=user.username,
-                            first_name=user.first_name,
-                            last_name=user.last_name,
-                            full_name=f"{user.first_name or ''} {user.last_name or ''}".strip(),
-                            last_active=datetime.datetime.utcnow(),
-                            group=group
-                        )
-                        session.add(db_member)
-                    else:
-                        db_member.username = user.username
-                        db_member.first_name = user.first_name
-                        db_member.last_name = user.last_name
-                        db_member.full_name = f"{user.first_name or ''} {user.last_name or ''}".strip()
-                        db_member.last_active = datetime.datetime.utcnow()
-                session.commit()
-
-                # Удаление неактивных участников из базы
-                deleted = session.query(Member).filter(
-                    Member.group_id == group.id,
-                    Member.telegram_id.notin_(active_ids)
-                ).delete(synchronize_session=False)
-                if deleted:
-                    logger.info(f"Удалено {deleted} неактивных участников из группы {group.telegram_id}.")
-                    await update.message.reply_text(f"Удалено {deleted} неактивных участников из группы '{group.name or 'Без названия'}'.")
-                else:
-                    await update.message.reply_text(f"В группе '{group.name or 'Без названия'}' нет неактивных участников для удаления из базы.")
-                session.commit()
-            except AttributeError as ae:
-                logger.error(f"Ошибка при обновлении группы {group.telegram_id}: {ae}")
-                await update.message.reply_text(f"Произошла ошибка при обновлении группы '{group.name or 'Без названия'}'. Проверьте права бота.")
+                await update.message.reply_text(text)
             except Exception as e:
-                logger.error(f"Ошибка при обновлении группы {group.telegram_id}: {e}")
-                await update.message.reply_text(f"Произошла ошибка при обновлении группы '{group.name or 'Без названия'}'.")
-    
+                logger.error(f"Ошибка при отправке результата обновления группы {group.telegram_id}: {e}")
+
+        # Тот же путь, что и у периодической синхронизации: группы обновляются параллельно в общем лимите API
+        await tenant.member_sync_scheduler.sync_groups(bot, admin_groups, on_done)
+
         await update.message.reply_text("Обновление участников завершено.")
     except Exception as e:
         logger.error(f"Ошибка при выполнении команды /update: {e}")
         await update.message.reply_text("Произошла ошибка при обновлении участников.")
-    finally:
-        session.close()
+
+# Обработка команды /profile (только для администраторов бота из BOT_ADMINS)
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat.type != 'private':
+        await update.message.reply_text("Эта команда доступна только в личном чате с ботом.")
+        return  # Игнорировать команды вне личного чата
+
+    if update.effective_user.id not in BOT_ADMINS:
+        await update.message.reply_text("Эта команда доступна только администраторам бота.")
+        return
+
+    usage = "Использование: /profile [секунд] или /profile updates <количество>"
+    seconds = 30
+    max_updates = None
+    try:
+        if len(context.args) == 1:
+            seconds = int(context.args[0])
+        elif len(context.args) == 2 and context.args[0] == 'updates':
+            # Ограничение по времени остаётся, чтобы профилирование не длилось бесконечно без обновлений
+            seconds = PROFILE_MAX_SECONDS
+            max_updates = int(context.args[1])
+            if max_updates <= 0:
+                raise ValueError
+        elif context.args:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(usage)
+        return
+
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        await update.message.reply_text(f"Длительность должна быть от 1 до {PROFILE_MAX_SECONDS} секунд.")
+        return
+    if profiler.active:
+        await update.message.reply_text("Профилирование уже запущено.")
+        return
+
+    if max_updates:
+        await update.message.reply_text(f"Профилирование запущено до обработки {max_updates} обновлений (не дольше {seconds} с).")
+    else:
+        await update.message.reply_text(f"Профилирование запущено на {seconds} с.")
+    # Команда не занимает очередь чата на время профилирования
+    context.application.create_task(report_profile(update.message, seconds, max_updates))
+
+async def report_profile(message, seconds, max_updates):
+    try:
+        result = await profiler.capture(
+            asyncio.get_running_loop(), seconds, max_updates,
+            lambda: sum(tenant.update_tracker.processed for tenant in tenants)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при профилировании: {e}")
+        await message.reply_text("Произошла ошибка при профилировании.")
+        return
+
+    logger.info(f"Профиль сохранён: {result['folded_path']}, {result['top_path']}.")
+    samples = result['samples'] or 1
+    lines = [
+        f"Профилирование завершено: {result['seconds']:.1f} с, снимков: {result['samples']}, "
+        f"обновлений: {result['updates']}, цикл событий занят: {result['loop_busy']:.0%}.",
+        "",
+        "Самые горячие функции (собственное время / со вложенными):",
+    ]
+    for label, own, total in result['top'][:10]:
+        lines.append(f"{own / samples:.1%} / {total / samples:.1%} {label}")
+    lines += ["", f"Стеки для flamegraph: {result['folded_path']}", f"Таблица: {result['top_path']}"]
+    await message.reply_text("\n".join(lines))
+
+# Рассылка упоминаний всех участников в ответ на сообщение с триггером
+async def broadcast_mentions(tenant, message):
+    mentions = tenant.roster_cache.get(message.chat.id)
+    if mentions is None:
+        # Перед загрузкой сбрасываем буфер и сворачиваем журнал, чтобы в списке были все активные участники
+        await tenant.activity_buffer.flush()
+        await tenant.member_log.compact()
+        _, members = await tenant.db.run(queries.get_group_members, message.chat.id)
+        tenant.roster_cache.put(message.chat.id, members)
+        mentions = tenant.roster_cache.get(message.chat.id)
+    if not mentions:
+        await message.reply_text("Нет участников для упоминания.")
+        return
+
+    await tenant.mention_dispatcher.send(message, mentions)
+
+# Рассылка упоминаний участников ролей (@admins и роли из /tag), названных в сообщении
+async def broadcast_roles(tenant, message):
+    mentions = await tenant.role_cache.resolve(message.get_bot(), message.chat.id, mentioned_tags(message.text))
+    if mentions:
+        await tenant.mention_dispatcher.send(message, mentions)
 
 # Обработка сообщений для отслеживания участников и реакции на триггеры
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
     message = update.message
     if message.chat.type not in ['group', 'supergroup']:
         return  # Игнорировать личные сообщения
 
-    session = Session()
-    try:
-        # Получение или создание записи группы
-        group = session.query(Group).filter(Group.telegram_id == message.chat.id).first()
-        if not group:
-            group = Group(telegram_id=message.chat.id, name=message.chat.title)
-            session.add(group)
-            session.commit()
-
-        # Обновление информации об отправителе
-        user = message.from_user
-        member = session.query(Member).filter(Member.telegram_id == user.id, Member.group_id == group.id).first()
-        if not member:
-            member = Member(
-                telegram_id=user.id,
-                username=user.username,
-                first_name=user.first_name,
-                last_name=user.last_name,
-                full_name=f"{user.first_name or ''} {user.last_name or ''}".strip(),
-                last_active=datetime.datetime.utcnow(),
-                group=group
-            )
-            session.add(member)
-        else:
-            member.username = user.username
-            member.first_name = user.first_name
-            member.last_name = user.last_name
-            member.full_name = f"{user.first_name or ''} {user.last_name or ''}".strip()
-            member.last_active = datetime.datetime.utcnow()
-        session.commit()
+    # Обновление информации об отправителе откладывается в буфер
+    user = message.from_user
+    tenant.activity_buffer.record(message.chat, user)
+    tenant.roster_cache.upsert(message.chat.id, user.id, member_fields(user))
 
+    try:
         # Проверяем наличие любого триггерного слова
-        if not TRIGGER_WORDS:
-            # Если список триггерных слов еще не инициализирован, получаем имя бота
+        if not tenant.trigger_matcher.default_triggers:
+            # Если триггеры по умолчанию еще не инициализированы, получаем имя бота
             bot = context.bot
             bot_username = await get_bot_username(bot)
             if bot_username:
-                TRIGGER_WORDS.extend([bot_username.lower(), "@all", "@everyone"])
+                tenant.trigger_matcher.set_default_triggers([bot_username.lower()] + BASE_TRIGGERS)
             else:
                 logger.warning("Не удалось инициализировать триггерные слова из-за отсутствия имени бота.")
 
-        text_lower = message.text.lower()
-        if any(trigger in text_lower for trigger in TRIGGER_WORDS):
-            members = session.query(Member).filter(Member.group_id == group.id).all()
-            if not members:
-                await message.reply_text("Нет участников для упоминания.")
-                return
-
-            mentions = []
-            for m in members:
-                if m.username:
-                    mentions.append(f"@{m.username}")
-                else:
-                    mentions.append(f"[{m.full_name or 'User'}](tg://user?id={m.telegram_id})")
-            mention_text = ', '.join(mentions)
-            await message.reply_text(mention_text, parse_mode=ParseMode.MARKDOWN)
+        # Кэши триггеров и пауз вытесняют группы независимо, поэтому настройки перечитываются,
+        # если группы нет хотя бы в одном из них
+        if message.chat.id not in tenant.trigger_matcher or message.chat.id not in tenant.trigger_coalescer:
+            triggers, cooldown = await tenant.db.run(queries.get_trigger_settings, message.chat.id)
+            tenant.trigger_matcher.load(message.chat.id, triggers)
+            tenant.trigger_coalescer.set_cooldown(message.chat.id, cooldown)
+
+        # Рассылка выполняется в фоне; одновременные триггеры объединяются. Сообщения, накопившиеся
+        # за время простоя бота, приходят при запуске пачкой, и их триггеры собираются дольше,
+        # чтобы группа получила одну рассылку вместо нескольких
+        age = (datetime.datetime.now(datetime.timezone.utc) - message.date).total_seconds()
+        window = CATCHUP_WINDOW if age > CATCHUP_AGE else None
+        if tenant.trigger_matcher.matches(message.chat.id, message.text):
+            metrics.HOT_GROUPS.inc(message.chat.id)
+            tenant.trigger_coalescer.submit(message, window=window)
+            return
+
+        # Упоминания ролей: @admins и роли, заданные командой /tag; объединяются отдельно для каждого набора ролей.
+        # Роли группы берутся из кэша, поэтому обычные @username в очередь рассылок не попадают
+        names = mentioned_tags(message.text)
+        if names:
+            names = await tenant.role_cache.role_names(message.chat.id, names)
+        if names:
+            tenant.trigger_coalescer.submit(
+                message, window=window, key=(message.chat.id, frozenset(names)), broadcast=tenant.broadcast_roles
+            )
     except Exception as e:
         logger.error(f"Ошибка при обработке сообщения: {e}")
-    finally:
-        session.close()
 
 # Обработчик обновлений участников
 async def chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = context.bot_data['tenant']
     result = update.chat_member
     user = result.new_chat_member.user
     chat = update.effective_chat
 
-    session = Session()
-    try:
-        group = session.query(Group).filter(Group.telegram_id == chat.id).first()
-        if not group:
-            group = Group(telegram_id=chat.id, name=chat.title)
-            session.add(group)
-            session.commit()
+    # Статус администратора известен из самого обновления
+    tenant.admin_cache.set(chat.id, user.id, result.new_chat_member.status)
 
+    try:
         if result.new_chat_member.status in ['member', 'administrator', 'creator']:
-            # Добавление или обновление участника
-            member = session.query(Member).filter(Member.telegram_id == user.id, Member.group_id == group.id).first()
-            if not member:
-                member = Member(
-                    telegram_id=user.id,
-                    username=user.username,
-                    first_name=user.first_name,
-                    last_name=user.last_name,
-                    full_name=f"{user.first_name or ''} {user.last_name or ''}".strip(),
-                    last_active=datetime.datetime.utcnow(),
-                    group=group
-                )
-                session.add(member)
-            else:
-                member.username = user.username
-                member.first_name = user.first_name
-                member.last_name = user.last_name
-                member.full_name = f"{user.first_name or ''} {user.last_name or ''}".strip()
-                member.last_active = datetime.datetime.utcnow()
-            session.commit()
+            # Добавление или обновление участника: вступление или изменение данных уже состоящего в группе
+            fields = member_fields(user)
+            kind = RENAME if result.old_chat_member.status in ['member', 'administrator', 'creator', 'restricted'] else JOIN
+            await tenant.member_log.append(kind, chat.id, user.id, fields, chat_title=chat.title)
+            tenant.roster_cache.upsert(chat.id, user.id, fields)
+            tenant.role_cache.member_updated(chat.id, user.id, result.old_chat_member.status, result.new_chat_member.status, fields)
         else:
             # Удаление участника
-            session.query(Member).filter(Member.telegram_id == user.id, Member.group_id == group.id).delete()
-            session.commit()
+            tenant.activity_buffer.discard(chat.id, user.id)
+            tenant.roster_cache.remove(chat.id, user.id)
+            tenant.role_cache.member_updated(chat.id, user.id, result.old_chat_member.status, result.new_chat_member.status)
+            await tenant.member_log.append(LEAVE, chat.id, user.id, chat_title=chat.title)
+            await tenant.db.run(queries.remove_member_tags, chat.id, None, [user.id])
     except Exception as e:
         logger.error(f"Ошибка при обновлении участника: {e}")
-    finally:
-        session.close()
 
 # Функция удаления неактивных участников из базы с учетом expiration_days
-def remove_inactive_members():
-    session = Session()
+async def remove_inactive_members(tenant):
     try:
-        groups = session.query(Group).all()
+        # Недавняя активность должна попасть в members до проверки сроков
+        await tenant.activity_buffer.flush()
+        await tenant.member_log.compact()
         now = datetime.datetime.utcnow()
-        total_deleted = 0
-
-        for group in groups:
-            cutoff_date = now - datetime.timedelta(days=group.expiration_days)
-            inactive_members = session.query(Member).filter(
-                Member.group_id == group.id,
-                Member.last_active < cutoff_date
-            ).all()
-
-            for member in inactive_members:
-                logger.info(f"Удаление неактивного участника: {member.full_name} (ID: {member.telegram_id}) из группы ID: {group.telegram_id}")
-                session.delete(member)
-                total_deleted += 1
-
-        session.commit()
+        deleted = {}
+        # Удаляем порциями: каждая порция — отдельная короткая транзакция в потоке базы данных
+        for expiration_days in await tenant.db.run(queries.list_expiration_days):
+            cutoff_date = now - datetime.timedelta(days=expiration_days)
+            while True:
+                batch = await tenant.db.run(queries.delete_inactive_members_batch, expiration_days, cutoff_date, INACTIVE_SWEEP_BATCH)
+                if not batch:
+                    break
+                for chat_id, count in batch.items():
+                    deleted[chat_id] = deleted.get(chat_id, 0) + count
+
+        for chat_id, count in deleted.items():
+            tenant.roster_cache.invalidate(chat_id)
+            logger.info(f"Удалено {count} неактивных участников из группы {chat_id}.")
+        total_deleted = sum(deleted.values())
         if total_deleted:
             logger.info(f"Удалено {total_deleted} неактивных участников из всех групп.")
     except Exception as e:
         logger.error(f"Ошибка при удалении неактивных участников из базы: {e}")
-    finally:
-        session.close()
+
+# Синхронизация участников одной группы с учетом общего лимита запросов к API
+async def sync_group(tenant, application_bot, group, api_budget):
+    # Bot API не отдаёт полный список участников, только администраторов. Остальные
+    # участники попадают в базу и удаляются из неё по событиям журнала участников
+    await api_budget.acquire()
+    administrators = await application_bot.get_chat_administrators(chat_id=group.telegram_id)
+
+    users = []
+    for member in administrators:
+        # Заодно обновляем кэш проверки прав для команд
+        tenant.admin_cache.set(group.telegram_id, member.user.id, member.status)
+        if not member.user.is_bot:
+            users.append(dict(member_fields(member.user), id=member.user.id))
+
+    await tenant.db.run(sync_members, group.id, users, datetime.datetime.utcnow())
+    for user in users:
+        tenant.roster_cache.upsert(group.telegram_id, user['id'], user)
+    return len(users)
 
 # Функция обновления участников группы (оптимизирована для минимизации API-запросов)
-async def update_members(application_bot):
-    session = Session()
+async def update_members(tenant, application_bot):
     try:
-        # Получаем все группы из базы данных
-        groups = session.query(Group).all()
-        for group in groups:
-            try:
-                # Получаем количество участников в группе
-                members_count = await application_bot.get_chat_member_count(chat_id=group.telegram_id)
-
-                # Ограничение для небольших групп
-                # Для больших групп рекомендуется полагаться на события обновления участников
-                if members_count > 200:
-                    logger.info(f"Группа {group.telegram_id} слишком большая для ручного обновления.")
-                    continue
-
-                # Получаем всех участников группы
-                members = []
-                async for member in application_bot.get_chat_members(chat_id=group.telegram_id):
-                    members.append(member.user)
-
-                active_ids = set()
-                for user in members:
-                    active_ids.add(user.id)
-                    db_member = session.query(Member).filter(Member.telegram_id == user.id, Member.group_id == group.id).first()
-                    if not db_member:
-                        db_member = Member(
-                            telegram_id=user.id,
-                            username=user.username,
-                            first_name=user.first_name,
-                            last_name=user.last_name,
-                            full_name=f"{user.first_name or ''} {user.last_name or ''}".strip(),
-                            last_active=datetime.datetime.utcnow(),
-                            group=group
-                        )
-                        session.add(db_member)
-                    else:
-                        db_member.username = user.username
-                        db_member.first_name = user.first_name
-                        db_member.last_name = user.last_name
-                        db_member.full_name = f"{user.first_name or ''} {user.last_name or ''}".strip()
-                        db_member.last_active = datetime.datetime.utcnow()
-                session.commit()
-
-                # Удаление неактивных участников из базы
-                deleted = session.query(Member).filter(
-                    Member.group_id == group.id,
-                    Member.telegram_id.notin_(active_ids)
-                ).delete(synchronize_session=False)
-                if deleted:
-                    logger.info(f"Удалено {deleted} неактивных участников из группы {group.telegram_id}.")
-                session.commit()
-            except AttributeError as ae:
-                logger.error(f"Ошибка при обновлении группы {group.telegram_id}: {ae}")
-            except Exception as e:
-                logger.error(f"Ошибка при обновлении группы {group.telegram_id}: {e}")
+        # Синхронизация перезаписывает members, поэтому накопленные события сворачиваются до неё
+        await tenant.member_log.compact()
+        await tenant.member_sync_scheduler.run_tick(application_bot)
     except Exception as e:
         logger.error(f"Ошибка при обновлении участников: {e}")
+
+# Сворачивание журнала участников: в members и кэш упоминаний попадают только изменения
+async def compact_member_log(tenant):
+    try:
+        count, changes = await tenant.member_log.compact()
+        for (chat_id, user_id), fields in changes.items():
+            if fields is None:
+                tenant.roster_cache.remove(chat_id, user_id)
+            else:
+                tenant.roster_cache.upsert(chat_id, user_id, fields)
+        if count:
+            logger.info(f"Журнал участников: свёрнуто {count} событий, изменено участников: {len(changes)}.")
+    except Exception as e:
+        logger.error(f"Ошибка при сворачивании журнала участников: {e}")
+
+# Обслуживание файла SQLite: возврат свободных страниц, обновление статистики и сброс WAL
+async def maintain_database(tenant):
+    if not tenant.db.is_sqlite:
+        return
+    schema = tenant.db.schema or 'main'
+    try:
+        before, after, full_vacuum = await tenant.db.run(
+            run_sqlite_maintenance, MAINTENANCE_VACUUM_PAGES, schema=schema,
+            full_vacuum_max_bytes=MAINTENANCE_FULL_VACUUM_MAX_MB * 1024 * 1024
+        )
+        metrics.DB_FILE_BYTES.set(after['file_bytes'], schema)
+        metrics.DB_FREE_RATIO.set(after['free_ratio'], schema)
+        metrics.DB_WAL_BYTES.set(after['wal_bytes'], schema)
+        if full_vacuum:
+            logger.info(f"База {schema} переведена в режим auto_vacuum=INCREMENTAL полным VACUUM.")
+        elif full_vacuum is False:
+            logger.warning(
+                f"База {schema} ({before['file_bytes']} байт) ожидает перевода в режим auto_vacuum=INCREMENTAL: "
+                f"полный VACUUM остановил бы работу с базой. Увеличьте MAINTENANCE_FULL_VACUUM_MAX_MB "
+                f"или выполните VACUUM при остановленном боте."
+            )
+        logger.info(
+            f"Обслуживание базы {schema}: размер {before['file_bytes']} -> {after['file_bytes']} байт, "
+            f"свободных страниц {before['free_ratio']:.1%} -> {after['free_ratio']:.1%}, "
+            f"WAL {before['wal_bytes']} -> {after['wal_bytes']} байт."
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при обслуживании базы: {e}")
+
+# Выполняющиеся задачи планировщика; при остановке бот дожидается их завершения
+running_jobs = set()
+
+async def run_tracked(job, *args):
+    task = asyncio.current_task()
+    running_jobs.add(task)
+    try:
+        await job(*args)
     finally:
-        session.close()
+        running_jobs.discard(task)
+
+# Запуск задачи бота, только если этот экземпляр ведущий для него
+async def run_if_leader(tenant, job, *args):
+    if not tenant.leader.is_leader:
+        return
+    await run_tracked(job, tenant, *args)
+
+# Сброс буфера активности и сохранение позиции обновлений
+async def flush_activity(tenant):
+    # Позиция снимается до сброса: активность всех обновлений до нее уже в буфере
+    position = tenant.update_tracker.position
+    await tenant.activity_buffer.flush()
+    try:
+        await tenant.update_tracker.save(position)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении позиции обновлений: {e}")
+
+class Tenant:
+    """
+    Бот процесса со своими таблицами, кэшами, очередями рассылок и выбором ведущего.
+
+    Соединения с базой, пул HTTP-соединений, очереди чатов и планировщик общие
+    для всех ботов. Ограничения Telegram на отправку и запросы к API действуют
+    для каждого токена отдельно, поэтому рассылки и бюджет синхронизации у
+    каждого бота свои.
+    """
+
+    def __init__(self, name, token):
+        """
+        :param name: Имя бота из BOT_TOKENS или '' для бота из BOT_TOKEN
+        :param token: Токен бота
+        """
+        self.name = name
+        self.token = token
+        self.application = None
+        # Прогрев завершён; планировщик запускается, когда готовы все боты
+        self.ready = False
+        # Бот остановлен; общие ресурсы освобождаются после остановки всех ботов
+        self.shut_down = False
+
+        # Бот из BOT_TOKEN работает с основными таблицами, остальные — со своей схемой
+        self.db = db.tenant(tenant_schema(name)) if name else db
+
+        # Периодические задачи выполняет только ведущий экземпляр бота
+        self.leader = LeaderElection(self.db, INSTANCE_NAME, ttl=LEADER_LEASE_SECONDS)
+
+        # Позиция обработанных обновлений, сохраняемая между перезапусками
+        self.update_tracker = UpdateTracker(self.db, f"update_offset:{WORKER_ID}")
+
+        # Журнал изменений состава групп, сворачиваемый в таблицу members
+        self.member_log = MemberLog(self.db, batch_size=MEMBER_LOG_BATCH)
+
+        # Буфер отложенной записи активности участников
+        self.activity_buffer = ActivityBuffer(self.db, max_size=ACTIVITY_BUFFER_SIZE)
+
+        # Кэш готовых упоминаний участников по группам
+        self.roster_cache = RosterCache(max_groups=ROSTER_CACHE_SIZE, ttl=CACHE_TTL)
+
+        # Рассылка упоминаний с учетом лимитов Telegram
+        self.mention_dispatcher = MentionDispatcher(
+            global_rate=GLOBAL_SEND_RATE,
+            chat_rate=CHAT_SEND_RATE,
+            max_mentions=MENTIONS_PER_MESSAGE
+        )
+
+        # Кэш статуса администраторов
+        self.admin_cache = AdminCache(ttl=ADMIN_CACHE_TTL, max_concurrency=ADMIN_CHECK_CONCURRENCY)
+
+        # Готовые списки упоминаний для @admins и ролей групп
+        self.role_cache = RoleCache(self.db, self.admin_cache, admin_ttl=ADMIN_CACHE_TTL, max_groups=ROSTER_CACHE_SIZE)
+
+        # Скомпилированные триггеры по группам
+        self.trigger_matcher = TriggerMatcher(max_groups=ROSTER_CACHE_SIZE, ttl=CACHE_TTL)
+
+        # Объединение триггеров одной группы в одну рассылку
+        self.trigger_coalescer = TriggerCoalescer(
+            functools.partial(broadcast_mentions, self),
+            window=TRIGGER_WINDOW,
+            default_cooldown=TRIGGER_COOLDOWN,
+            max_chats=ROSTER_CACHE_SIZE
+        )
+
+        # Рассылка упоминаний ролей через тот же объединитель
+        self.broadcast_roles = functools.partial(broadcast_roles, self)
+
+        # Постепенная синхронизация участников групп по шардам
+        self.member_sync_scheduler = MemberSyncScheduler(
+            self.db, functools.partial(sync_group, self),
+            interval_hours=SYNC_INTERVAL_HOURS,
+            shards=SYNC_SHARDS,
+            concurrency=SYNC_CONCURRENCY,
+            api_rate=SYNC_API_RATE
+        )
+
+    def job_id(self, job):
+        return f"{job}:{self.name}" if self.name else job
+
+    def __repr__(self):
+        return f"Tenant({self.name or 'default'})"
+
+# Боты процесса; таблицы в схемах ботов создаются сразу, как и основные
+tenants = [Tenant(name, token) for name, token in TENANT_TOKENS]
+for tenant in tenants:
+    if tenant.db is not db:
+        tenant.db.migrate()
 
 # Планировщик задач
-def start_scheduler(application):
-    scheduler = AsyncIOScheduler(timezone=TIMEZONE)
-    scheduler.add_job(
-        update_members,
-        IntervalTrigger(hours=24, timezone=TIMEZONE),  # Ежедневно
-        args=[application.bot],
-        id='update_members_job',
-        replace_existing=True
-    )
-    scheduler.add_job(
-        remove_inactive_members,
-        IntervalTrigger(days=1, timezone=TIMEZONE),  # Ежедневно
-        id='remove_inactive_members_job',
-        replace_existing=True
-    )
+def setup_scheduler(tenants):
+    # Первые запуски одной задачи разных ботов равномерно разнесены по её интервалу,
+    # чтобы синхронизации и обслуживание баз не совпадали по времени
+    now = datetime.datetime.now(TIMEZONE)
+
+    def trigger(index, **interval):
+        period = datetime.timedelta(**interval)
+        return IntervalTrigger(start_date=now + period + period * index / len(tenants), timezone=TIMEZONE, **interval)
+
+    for index, tenant in enumerate(tenants):
+        scheduler.add_job(
+            run_if_leader,
+            trigger(index, seconds=tenant.member_sync_scheduler.tick.total_seconds()),  # Один шард за такт
+            args=[tenant, metrics.timed_job('update_members', update_members), tenant.application.bot],
+            id=tenant.job_id('update_members_job'),
+            replace_existing=True
+        )
+        scheduler.add_job(
+            run_if_leader,
+            trigger(index, days=1),  # Ежедневно
+            args=[tenant, metrics.timed_job('remove_inactive_members', remove_inactive_members)],
+            id=tenant.job_id('remove_inactive_members_job'),
+            replace_existing=True
+        )
+        scheduler.add_job(
+            run_if_leader,
+            trigger(index, seconds=MEMBER_LOG_COMPACT_INTERVAL),
+            args=[tenant, metrics.timed_job('compact_member_log', compact_member_log)],
+            id=tenant.job_id('compact_member_log_job'),
+            replace_existing=True
+        )
+        scheduler.add_job(
+            run_if_leader,
+            trigger(index, hours=MAINTENANCE_INTERVAL_HOURS),
+            args=[tenant, metrics.timed_job('maintain_database', maintain_database)],
+            id=tenant.job_id('maintain_database_job'),
+            replace_existing=True
+        )
+        # Буфер активности сбрасывает каждый экземпляр
+        scheduler.add_job(
+            run_tracked,
+            trigger(index, seconds=ACTIVITY_FLUSH_INTERVAL),
+            args=[flush_activity, tenant],
+            id=tenant.job_id('flush_activity_job'),
+            replace_existing=True
+        )
+
+# Прогрев кэшей, чтобы первые обновления после перезапуска обрабатывались так же быстро, как и последующие
+async def warm_up(tenant, application):
+    # Имя бота уже получено при инициализации, повторного запроса getMe не будет
+    bot_username = await get_bot_username(application.bot)
+    if bot_username:
+        tenant.trigger_matcher.set_default_triggers([bot_username.lower()] + BASE_TRIGGERS)
+    else:
+        logger.warning("Не удалось инициализировать триггерные слова из-за отсутствия имени бота.")
+
+    # Настройки самых активных групп и их списки упоминаний; самые активные загружаются последними,
+    # чтобы оказаться в конце очереди вытеснения кэшей
+    # События, не свёрнутые до остановки, сначала попадают в members
+    count, _ = await tenant.member_log.compact()
+    if count:
+        logger.info(f"При запуске свёрнуто {count} событий журнала участников.")
+    groups = await tenant.db.run(queries.list_hot_groups, ROSTER_CACHE_SIZE)
+    for group in reversed(groups):
+        tenant.trigger_matcher.load(group.telegram_id, group.triggers)
+        tenant.trigger_coalescer.set_cooldown(group.telegram_id, group.trigger_cooldown)
+
+    hot_groups = groups[:WARMUP_ROSTERS]
+    rosters = await tenant.db.run(queries.get_members_of_groups, [group.id for group in hot_groups])
+    for group in reversed(hot_groups):
+        tenant.roster_cache.put(group.telegram_id, rosters[group.id])
+    logger.info(f"Загружены настройки {len(groups)} групп и списки участников {len(hot_groups)} групп.")
+
+# Участие в выборе ведущего экземпляра, прогрев и запуск планировщика и эндпоинта метрик
+async def post_init(application):
+    tenant = application.bot_data['tenant']
+    await tenant.leader.renew()
+    tenant.leader.start()
+    try:
+        position = await tenant.update_tracker.load()
+        if position is not None:
+            logger.info(f"Обновления до {position} обработаны предыдущим запуском; повторы будут пропущены.")
+    except Exception as e:
+        logger.error(f"Ошибка при чтении позиции обновлений: {e}")
+    try:
+        await warm_up(tenant, application)
+    except Exception as e:
+        logger.error(f"Ошибка при прогреве кэшей: {e}")
+
+    # Общие планировщик и эндпоинт метрик запускаются после прогрева последнего бота
+    tenant.ready = True
+    if not all(t.ready for t in tenants):
+        return
     scheduler.start()
     logger.info("Планировщик задач запущен.")
+    if METRICS_PORT:
+        await metrics_server.start(METRICS_LISTEN, METRICS_PORT)
+        logger.info(f"Метрики доступны на http://{METRICS_LISTEN}:{metrics_server.port}/metrics")
+    record_startup_phase('warmup')
+
+# Учет времени запуска
+def record_startup_phase(phase):
+    elapsed = time.perf_counter() - STARTED_AT
+    metrics.STARTUP_SECONDS.set(elapsed, phase)
+    logger.info(f"Запуск: этап '{phase}' через {elapsed:.2f} с после старта.")
+
+first_update_handled = False
+
+async def track_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global first_update_handled
+    if not first_update_handled:
+        first_update_handled = True
+        record_startup_phase('first_update')
+
+# Срок плавной остановки по часам цикла событий: этапы остановки всех ботов делят
+# один SHUTDOWN_TIMEOUT, и каждый ждёт не дольше оставшегося времени
+shutdown_deadline = None
+
+def shutdown_time_left():
+    return max(0.0, shutdown_deadline - asyncio.get_running_loop().time())
+
+# Остановка общих для всех ботов очередей чатов и планировщика
+async def stop_shared():
+    # Обновления, принятые в очереди чатов, обрабатываются до конца
+    if chat_scheduler is not None:
+        try:
+            await asyncio.wait_for(chat_scheduler.drain(), shutdown_time_left())
+        except asyncio.TimeoutError:
+            logger.warning(f"При остановке не обработано обновлений из очередей чатов: {len(chat_scheduler)}.")
+        await chat_scheduler.close()
+
+    # Новые запуски задач не планируются, уже идущие дорабатывают
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    if running_jobs:
+        _, pending = await asyncio.wait(set(running_jobs), timeout=shutdown_time_left())
+        if pending:
+            logger.warning(f"При остановке не дождались завершения задач планировщика: {len(pending)}.")
+
+shared_stopped = False
+
+# Плавная остановка: прием обновлений уже остановлен, а очередь приложения разобрана (Application.stop)
+async def post_stop(application):
+    tenant = application.bot_data['tenant']
+    # Приложения останавливаются раньше всех post_stop (tenancy.run_polling, webhook.run_webhook),
+    # поэтому общие очереди разбирает первый вызов
+    global shared_stopped, shutdown_deadline
+    if not shared_stopped:
+        shared_stopped = True
+        shutdown_deadline = asyncio.get_running_loop().time() + SHUTDOWN_TIMEOUT
+        await stop_shared()
+
+    # Отложенные рассылки упоминаний отправляются сразу, без ожидания окна и паузы
+    try:
+        await asyncio.wait_for(tenant.trigger_coalescer.drain(expedite=True), shutdown_time_left())
+    except asyncio.TimeoutError:
+        logger.warning("При остановке не все рассылки упоминаний успели завершиться.")
+    await tenant.trigger_coalescer.close()
+
+    # Отложенная запись в базу; позиция снимается до сброса буфера, как в flush_activity
+    position = tenant.update_tracker.position
+    flushed = await tenant.activity_buffer.flush()
+    if flushed:
+        logger.info(f"При остановке сохранено {flushed} записей активности.")
+    try:
+        await tenant.member_log.compact()
+        if await tenant.update_tracker.save(position) is not None:
+            logger.info(f"Сохранена позиция обработанных обновлений: {position}.")
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении данных при остановке: {e}")
+
+    # Подтверждаем Telegram полученные обновления, чтобы после перезапуска он не присылал их снова
+    if UPDATE_MODE != 'webhook' and position is not None:
+        try:
+            await application.bot.get_updates(offset=position + 1, limit=1, timeout=0)
+        except Exception as e:
+            logger.warning(f"Не удалось подтвердить полученные обновления: {e}")
+
+# Освобождение ресурсов после остановки бота
+async def post_shutdown(application):
+    tenant = application.bot_data['tenant']
+    await tenant.leader.stop()
+    tenant.shut_down = True
+    # Общие эндпоинт метрик и соединения с базой закрываются вместе с последним ботом
+    if not all(t.shut_down for t in tenants):
+        return
+    await metrics_server.stop()
+    db.close()
 
-# Основная функция запуска бота
-def main():
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+# Регистрация обработчиков
+def register_handlers(application, tenant):
+    # Обработчики общие для всех ботов и находят данные своего бота в bot_data
+    application.bot_data['tenant'] = tenant
+    tenant.application = application
 
     # Регистрация обработчиков команд
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("groups", groups_command))
-    application.add_handler(CommandHandler("members", members_command))
-    application.add_handler(CommandHandler("set_expiration_days", set_expiration_days_command))
-    application.add_handler(CommandHandler("del_member", del_member_command))
-    application.add_handler(CommandHandler("update", update_command))
+    commands = {
+        "start": start,
+        "help": help_command,
+        "groups": groups_command,
+        "members": members_command,
+        "set_expiration_days": set_expiration_days_command,
+        "set_triggers": set_triggers_command,
+        "set_cooldown": set_cooldown_command,
+        "tag": tag_command,
+        "untag": untag_command,
+        "tags": tags_command,
+        "del_member": del_member_command,
+        "update": update_command,
+        "profile": profile_command,
+    }
+    for command, callback in commands.items():
+        application.add_handler(CommandHandler(command, metrics.instrument(command, callback)))
+
+    # Листание списка участников
+    application.add_handler(CallbackQueryHandler(metrics.instrument('members_page', members_page_callback), pattern=r'^members:'))
 
     # Обработчик сообщений для отслеживания участников и реакции на триггеры
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, metrics.instrument('handle_message', handle_message)))
 
     # Обработчик обновлений участников
-    application.add_handler(ChatMemberHandler(chat_member_update, ChatMemberHandler.CHAT_MEMBER))
-
-    # Планировщик задач
-    start_scheduler(application)
+    application.add_handler(ChatMemberHandler(metrics.instrument('chat_member_update', chat_member_update), ChatMemberHandler.CHAT_MEMBER))
+
+    # Отметка о первом обработанном обновлении; группа выполняется после основных обработчиков
+    application.add_handler(TypeHandler(Update, track_first_update), group=99)
+
+# Создание приложения бота
+def build_application(tenant):
+    builder = (
+        ApplicationBuilder().token(tenant.token)
+        # Параллельность задается очередями чатов, поэтому сама Application разбирает обновления по одному
+        .application_class(TrackingApplication, kwargs={
+            'tracker': tenant.update_tracker,
+            'chat_scheduler': chat_scheduler,
+            'name': tenant.name,
+        })
+        .request(bot_request)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if UPDATE_MODE == 'webhook':
+        # Обновления приходят через встроенный HTTP-сервер, ограниченная очередь дает обратное давление
+        builder = builder.updater(None).update_queue(asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE))
+    application = builder.build()
+    register_handlers(application, tenant)
+    return application
 
-    # Запуск бота
-    application.run_polling()
+# Основная функция запуска бота
+def main():
+    record_startup_phase('import')
+    applications = [build_application(tenant) for tenant in tenants]
+
+    # Задачи планировщика; сам планировщик запускается после прогрева в post_init
+    setup_scheduler(tenants)
+
+    # Запуск ботов
+    if UPDATE_MODE == 'webhook':
+        # Несколько процессов делят чаты между собой; чужие обновления пересылаются владельцу
+        router = UpdateRouter(WORKER_ID, WORKER_PEERS, WEBHOOK_PATH, WEBHOOK_SECRET) if len(WORKER_PEERS) > 1 else None
+        # Боты из BOT_TOKENS принимают обновления на WEBHOOK_PATH/<имя>
+        paths = {
+            f"{WEBHOOK_PATH}/{tenant.name}" if tenant.name else WEBHOOK_PATH: tenant.application
+            for tenant in tenants
+        }
+        asyncio.get_event_loop().run_until_complete(run_webhook(
+            paths,
+            url=WEBHOOK_URL,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            secret_token=WEBHOOK_SECRET,
+            router=router
+        ))
+    elif len(applications) == 1:
+        applications[0].run_polling(allowed_updates=Update.ALL_TYPES)
+    else:
+        asyncio.get_event_loop().run_until_complete(run_polling(applications, allowed_updates=Update.ALL_TYPES))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,128 @@
+# chat_scheduler.py
+import asyncio
+import logging
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _ChatQueue:
+    __slots__ = ('items', 'space')
+
+    def __init__(self):
+        self.items = deque()
+        self.space = None
+
+
+class ChatScheduler:
+    """
+    Обработка по порядку внутри чата и параллельно между чатами.
+
+    У каждого чата своя очередь; в любой момент выполняется не больше одной
+    задачи чата, поэтому обработчики одной группы не гоняются за строки members.
+    Исполнители берут чаты по кругу и выполняют из каждого по одной задаче, так
+    что шумная группа не задерживает остальные дольше, чем на одну задачу.
+    Если очередь чата или все очереди вместе заполнены, submit ждёт
+    освобождения места — приём обновлений приостанавливается, а обработка уже
+    принятых продолжается. Общий предел не даёт обновлениям множества тихих
+    чатов копиться в памяти в обход очереди вебхука.
+    """
+
+    def __init__(self, concurrency=8, max_depth=50, max_pending=1000):
+        """
+        :param concurrency: Количество чатов, обрабатываемых одновременно
+        :param max_depth: Максимальная длина очереди одного чата
+        :param max_pending: Максимальное количество принятых и ещё не выполненных задач всех чатов
+        """
+        self.concurrency = concurrency
+        self.max_depth = max_depth
+        self.max_pending = max_pending
+        self._chats = {}
+        self._ready = None
+        self._slots = None
+        self._workers = []
+        self._pending = 0
+        self._idle = None
+
+    def _start(self):
+        # Очереди и исполнители создаются внутри цикла событий: сам объект создаётся при импорте модуля бота
+        self._ready = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+
+    async def submit(self, key, func, *args):
+        """
+        Ставит func(*args) в очередь чата key.
+
+        :param key: Ключ очереди (обычно ID чата)
+        """
+        if not self._workers:
+            self._start()
+        # Место освобождается после выполнения задачи
+        if self._slots.locked():
+            metrics.CHAT_QUEUE_FULL.inc()
+        await self._slots.acquire()
+
+        try:
+            chat = self._chats.get(key)
+            while chat is not None and len(chat.items) >= self.max_depth:
+                metrics.CHAT_QUEUE_FULL.inc()
+                if chat.space is None:
+                    chat.space = asyncio.Event()
+                await chat.space.wait()
+                chat = self._chats.get(key)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        if chat is None:
+            chat = self._chats[key] = _ChatQueue()
+            self._ready.put_nowait(key)
+        chat.items.append((func, args))
+        self._pending += 1
+        self._idle.clear()
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            chat = self._chats[key]
+            func, args = chat.items.popleft()
+            if chat.space is not None:
+                chat.space.set()
+                chat.space = None
+            try:
+                await func(*args)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке задачи чата {key}: {e}")
+            finally:
+                # Чат с оставшимися задачами встаёт в конец круга
+                if chat.items:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+                self._pending -= 1
+                self._slots.release()
+                if not self._pending:
+                    self._idle.set()
+
+    def __len__(self):
+        return self._pending
+
+    async def drain(self):
+        """
+        Ожидает выполнения всех принятых задач.
+        """
+        if self._idle is not None:
+            await self._idle.wait()
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._chats.clear()
+        self._pending = 0
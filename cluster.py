@@ -0,0 +1,136 @@
+# cluster.py
+import asyncio
+import datetime
+import logging
+import zlib
+
+import httpx
+
+import db as queries
+
+logger = logging.getLogger(__name__)
+
+FORWARDED_HEADER = 'x-tg-mark-all-forwarded'
+
+
+def shard_of(chat_id, shards):
+    """
+    Номер шарда чата; стабилен между перезапусками и одинаков во всех процессах.
+    """
+    return zlib.crc32(str(chat_id).encode()) % shards
+
+
+def update_chat_id(update):
+    """
+    :return: ID чата, к которому относится обновление, или 0
+    """
+    chat = update.effective_chat
+    return chat.id if chat else 0
+
+
+class LeaderElection:
+    """
+    Выбор ведущего экземпляра через аренду в общей базе данных.
+
+    Экземпляр считается ведущим, пока его аренда не истекла. Аренда продлевается
+    каждые ttl / 3 секунд; если ведущий процесс остановится, аренду через ttl
+    секунд захватит другой.
+    """
+
+    def __init__(self, db, holder, name='scheduler', ttl=30):
+        """
+        :param db: Экземпляр db.Database
+        :param holder: Уникальное имя этого экземпляра
+        :param name: Имя аренды
+        :param ttl: Срок аренды в секундах
+        """
+        self.db = db
+        self.holder = holder
+        self.name = name
+        self.ttl = ttl
+        self._expires = None
+        self._task = None
+
+    @property
+    def is_leader(self):
+        return self._expires is not None and datetime.datetime.utcnow() < self._expires
+
+    async def renew(self):
+        now = datetime.datetime.utcnow()
+        was_leader = self.is_leader
+        try:
+            acquired = await self.db.run(queries.acquire_lease, self.name, self.holder, now, self.ttl)
+        except Exception as e:
+            logger.error(f"Ошибка при продлении аренды '{self.name}': {e}")
+            return self.is_leader
+        self._expires = now + datetime.timedelta(seconds=self.ttl) if acquired else None
+        if acquired and not was_leader:
+            logger.info(f"Экземпляр {self.holder} стал ведущим.")
+        elif was_leader and not acquired:
+            logger.warning(f"Экземпляр {self.holder} потерял роль ведущего.")
+        return acquired
+
+    async def _run(self):
+        while True:
+            await self.renew()
+            await asyncio.sleep(self.ttl / 3)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._expires is not None:
+            self._expires = None
+            await self.db.run(queries.release_lease, self.name, self.holder)
+
+
+class UpdateRouter:
+    """
+    Распределение обновлений между процессами бота по ID чата.
+
+    Все обновления одного чата обрабатывает один процесс, поэтому его кэши
+    остаются согласованными, а записи участников не конкурируют между процессами.
+    Обновления чужих чатов пересылаются владельцу на его вебхук.
+    """
+
+    def __init__(self, worker_id, peers, path, secret_token=None):
+        """
+        :param worker_id: Номер этого процесса в списке peers
+        :param peers: Базовые адреса вебхуков всех процессов, например http://10.0.0.2:8443
+        :param path: Путь вебхука
+        :param secret_token: Секрет вебхука, передаваемый при пересылке
+        """
+        self.worker_id = worker_id
+        self.peers = peers
+        self.path = path
+        self.secret_token = secret_token
+        self._client = None
+
+    def owner(self, chat_id):
+        return shard_of(chat_id, len(self.peers))
+
+    async def forward(self, owner, body):
+        """
+        Пересылает тело вебхука процессу-владельцу.
+
+        :return: HTTP-статус ответа владельца; 503, если он недоступен
+        """
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=10)
+        headers = {'Content-Type': 'application/json', FORWARDED_HEADER: str(self.worker_id)}
+        if self.secret_token:
+            headers['X-Telegram-Bot-Api-Secret-Token'] = self.secret_token
+        try:
+            response = await self._client.post(self.peers[owner].rstrip('/') + self.path, content=body, headers=headers)
+        except httpx.HTTPError as e:
+            logger.error(f"Не удалось переслать обновление процессу {owner}: {e}")
+            return 503
+        return response.status_code
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,158 @@
+# coalescer.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _ChatState:
+    __slots__ = ('cooldown', 'latest', 'task', 'last_sent', 'broadcast')
+
+    def __init__(self):
+        self.cooldown = None
+        self.latest = None
+        self.broadcast = None
+        self.task = None
+        self.last_sent = None
+
+
+class TriggerCoalescer:
+    """
+    Объединение триггеров группы в одну рассылку упоминаний.
+
+    Первый триггер откладывает рассылку на window секунд; триггеры, пришедшие за
+    это время, к ней присоединяются, и бот отвечает один раз на последнее
+    сообщение. После рассылки в группе действует пауза cooldown: триггеры в это
+    время также объединяются и обрабатываются одной рассылкой по её окончании.
+    Рассылки другого вида (например, упоминания ролей) объединяются под своим
+    ключом, но с паузой группы.
+    """
+
+    def __init__(self, broadcast, window=2, default_cooldown=30, max_chats=10000):
+        """
+        :param broadcast: Корутина broadcast(message), рассылающая упоминания в ответ на сообщение
+        :param window: Время сбора триггеров перед рассылкой в секундах
+        :param default_cooldown: Пауза между рассылками для групп без своей настройки
+        :param max_chats: Максимальное количество групп, для которых хранится состояние
+        """
+        self.broadcast = broadcast
+        self.window = window
+        self.default_cooldown = default_cooldown
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+        self._tasks = set()
+        self._expedite = None
+
+    def __contains__(self, chat_id):
+        return chat_id in self._chats
+
+    def _cooling_down(self, state, now):
+        if state.last_sent is None:
+            return False
+        cooldown = self.default_cooldown if state.cooldown is None else state.cooldown
+        return now < state.last_sent + cooldown
+
+    def _state(self, chat_id):
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = _ChatState()
+            # Вытесняем давно не использованные группы без ожидающей рассылки и действующей паузы,
+            # иначе после повторной загрузки группа получила бы рассылку раньше срока
+            now = time.monotonic()
+            for old_id in list(self._chats):
+                if len(self._chats) <= self.max_chats:
+                    break
+                old = self._chats[old_id]
+                if old.task is None and not self._cooling_down(old, now):
+                    del self._chats[old_id]
+        else:
+            self._chats.move_to_end(chat_id)
+        return state
+
+    def set_cooldown(self, chat_id, cooldown):
+        """
+        :param cooldown: Group.trigger_cooldown или None для значения по умолчанию
+        """
+        self._state(chat_id).cooldown = cooldown
+
+    def submit(self, message, window=None, key=None, broadcast=None):
+        """
+        Регистрирует триггер в сообщении; рассылка выполняется в фоне.
+
+        :param window: Время сбора триггеров вместо стандартного (например, при разборе
+                       обновлений, накопившихся за время простоя бота)
+        :param key: Ключ объединения вместо ID группы для рассылок другого вида
+        :param broadcast: Корутина рассылки вместо заданной при создании
+        :return: True, если запланирована новая рассылка, False, если триггер объединён с ожидающей
+        """
+        if key is None:
+            state = self._state(message.chat.id)
+        else:
+            # Пауза берётся из настроек группы; они читаются до создания состояния, которое может их вытеснить
+            group = self._chats.get(message.chat.id)
+            cooldown = group.cooldown if group is not None else None
+            state = self._state(key)
+            state.cooldown = cooldown
+        state.latest = message
+        state.broadcast = broadcast or self.broadcast
+        if state.task is not None:
+            metrics.TRIGGERS_COALESCED.inc()
+            return False
+
+        delay = self.window if window is None else window
+        if state.last_sent is not None:
+            cooldown = self.default_cooldown if state.cooldown is None else state.cooldown
+            delay = max(delay, state.last_sent + cooldown - time.monotonic())
+        state.task = asyncio.ensure_future(self._run(message.chat.id, state, delay))
+        self._tasks.add(state.task)
+        state.task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, chat_id, state, delay):
+        try:
+            if delay > 0 and not self.expedite.is_set():
+                try:
+                    await asyncio.wait_for(self.expedite.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # Триггеры, пришедшие во время рассылки, планируют следующую
+            state.task = None
+
+        message, state.latest = state.latest, None
+        state.last_sent = time.monotonic()
+        try:
+            await state.broadcast(message)
+        except Exception as e:
+            logger.error(f"Ошибка при рассылке упоминаний в группе {chat_id}: {e}")
+
+    @property
+    def expedite(self):
+        # Событие создаётся внутри цикла событий: сам объект создаётся при импорте модуля бота
+        if self._expedite is None:
+            self._expedite = asyncio.Event()
+        return self._expedite
+
+    async def drain(self, expedite=False):
+        """
+        Ожидает завершения всех запланированных и идущих рассылок.
+
+        :param expedite: Не дожидаться окончания окна сбора и паузы (при остановке бота)
+        """
+        if expedite:
+            self.expedite.set()
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def close(self):
+        """
+        Отменяет ожидающие рассылки.
+        """
+        tasks = [state.task for state in self._chats.values() if state.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,539 @@
+# db.py
+import asyncio
+import copy
+import datetime
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, event, func, or_, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+import metrics
+from migrations import apply_migrations
+from models import Base, Checkpoint, Group, Lease, Member, MemberTag
+
+logger = logging.getLogger(__name__)
+
+# Профиль SQLite, применяемый к каждому соединению: WAL позволяет читать во время записи,
+# synchronous=NORMAL в режиме WAL не теряет целостность при сбое процесса, mmap и кэш страниц
+# уменьшают число системных вызовов на чтение, а busy_timeout заменяет ошибки "database is
+# locked" ожиданием. auto_vacuum=INCREMENTAL действует на новых базах и после полного VACUUM
+# (его один раз выполняет maintenance.py) и позволяет возвращать свободные страницы порциями.
+SQLITE_PRAGMAS = {
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # В КиБ, если значение отрицательное
+    'busy_timeout': 5000,  # мс
+    'temp_store': 'MEMORY',
+}
+
+# PRAGMA, которые действуют на отдельный файл и применяются также к подключённым схемам ботов
+SQLITE_SCHEMA_PRAGMAS = ('auto_vacuum', 'journal_mode', 'synchronous', 'mmap_size', 'cache_size')
+
+
+def sqlite_attach_limit():
+    """
+    :return: Сколько файлов можно подключить к одному соединению SQLite (ATTACH DATABASE)
+    """
+    connection = sqlite3.connect(':memory:')
+    try:
+        # getlimit появился в Python 3.11; в сборках по умолчанию предел равен 10
+        return connection.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) if hasattr(connection, 'getlimit') else 10
+    finally:
+        connection.close()
+
+
+class Database:
+    """
+    Асинхронная обёртка над синхронным SQLAlchemy.
+
+    Все обращения к базе выполняются в отдельных потоках, поэтому медленные запросы
+    и ожидание блокировок не задерживают цикл событий бота. Для SQLite поток один:
+    она всё равно допускает только одного писателя, а последовательное выполнение
+    избавляет от ошибок "database is locked". Для серверных СУБД (PostgreSQL)
+    потоков столько же, сколько соединений в пуле.
+    """
+
+    def __init__(self, url, pool_size=5, sqlite_pragmas=None):
+        """
+        :param url: URL базы данных SQLAlchemy
+        :param pool_size: Размер пула соединений для серверных СУБД
+        :param sqlite_pragmas: Значения PRAGMA, заменяющие SQLITE_PRAGMAS (None в значении отключает PRAGMA)
+        """
+        self.is_sqlite = url.startswith('sqlite')
+        # Схема таблиц этого представления (см. tenant); None — основная
+        self.schema = None
+        if self.is_sqlite:
+            self.path = make_url(url).database
+            # Файлы схем ботов, подключаемые к каждому соединению: {схема: путь}
+            self._attached = {}
+            if self.path in (None, '', ':memory:'):
+                self.engine = create_engine(url)
+            else:
+                # По умолчанию SQLAlchemy 1.4 открывает файл SQLite заново на каждую сессию, и PRAGMA
+                # применялись бы к каждому обращению. Соединения переиспользуются из пула; пул сам не
+                # отдаёт одно соединение двум потокам, поэтому проверка потока драйвера отключена.
+                self.engine = create_engine(url, poolclass=QueuePool, connect_args={'check_same_thread': False})
+            self.sqlite_pragmas = {
+                name: value for name, value in dict(SQLITE_PRAGMAS, **(sqlite_pragmas or {})).items()
+                if value is not None
+            }
+            event.listen(self.engine, 'connect', self._apply_pragmas)
+            workers = 1
+        else:
+            self.engine = create_engine(url, pool_size=pool_size, max_overflow=0, pool_pre_ping=True)
+            workers = pool_size
+        # Объекты остаются доступными после закрытия сессии и возврата в цикл событий
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+        # Счётчик SQL-запросов текущего обращения в каждом потоке базы
+        self._local = threading.local()
+        event.listen(self.engine, 'before_cursor_execute', self._count_statement)
+
+    def _apply_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in self.sqlite_pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            for schema, path in self._attached.items():
+                cursor.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+                for name in SQLITE_SCHEMA_PRAGMAS:
+                    if name in self.sqlite_pragmas:
+                        cursor.execute(f"PRAGMA {schema}.{name}={self.sqlite_pragmas[name]}")
+        finally:
+            cursor.close()
+
+    def tenant(self, schema):
+        """
+        Представление базы для отдельного бота: те же соединения и потоки, но таблицы в своей схеме.
+
+        Запросы не меняются: SQLAlchemy подставляет схему ко всем таблицам
+        (schema_translate_map). В PostgreSQL схема создаётся в той же базе, в
+        SQLite — отдельным файлом рядом с основным, который подключается к
+        каждому соединению (ATTACH DATABASE). Представления создаются до первых
+        запросов к базе.
+
+        :param schema: Имя схемы (буквы, цифры и '_')
+        :return: Экземпляр Database с общим пулом соединений
+        """
+        if self.is_sqlite:
+            if self.path in (None, '', ':memory:'):
+                raise ValueError("Схемы ботов не поддерживаются для базы SQLite в памяти.")
+            # Файлы подключаются к каждому соединению; сверх предела SQLite не откроется ни одно,
+            # поэтому превышение обнаруживается при запуске, а не в пуле соединений
+            limit = sqlite_attach_limit()
+            if schema not in self._attached and len(self._attached) >= limit:
+                raise ValueError(
+                    f"SQLite подключает к соединению не больше {limit} схем ботов (SQLITE_LIMIT_ATTACHED); "
+                    f"уменьшите количество ботов в BOT_TOKENS или используйте PostgreSQL."
+                )
+            root, ext = os.path.splitext(self.path)
+            self._attached[schema] = f"{root}.{schema}{ext or '.db'}"
+            # Уже открытые соединения не знают о новом файле
+            self.engine.dispose()
+        else:
+            with self.engine.begin() as conn:
+                conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+
+        view = copy.copy(self)
+        view.schema = schema
+        view.engine = self.engine.execution_options(schema_translate_map={None: schema})
+        view.Session = sessionmaker(bind=view.engine, expire_on_commit=False)
+        return view
+
+    def _count_statement(self, *args):
+        self._local.statements = getattr(self._local, 'statements', 0) + 1
+
+    def create_all(self):
+        Base.metadata.create_all(self.engine)
+
+    def migrate(self):
+        """
+        Создаёт недостающие таблицы и применяет миграции схемы этого представления.
+
+        Безопасно при одновременном запуске нескольких процессов: всё выполняется
+        под блокировкой миграций (см. migrations.apply_migrations).
+
+        :return: Номер версии схемы
+        """
+        return apply_migrations(self.engine, self.schema, Base.metadata)
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Выполняет func(session, *args, **kwargs) в потоке базы данных.
+
+        Сессия фиксируется после успешного выполнения и откатывается при ошибке.
+
+        :param func: Синхронная функция, первым аргументом принимающая сессию
+        :return: Результат func
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(self._call, func, *args, **kwargs)
+        start = time.perf_counter()
+        statements = [0]
+        try:
+            result, statements[0] = await loop.run_in_executor(self._executor, call)
+            return result
+        finally:
+            metrics.record_db_call(func.__qualname__, time.perf_counter() - start, statements[0])
+
+    def _call(self, func, *args, **kwargs):
+        self._local.statements = 0
+        session = self.Session()
+        try:
+            result = func(session, *args, **kwargs)
+            session.commit()
+            return result, self._local.statements
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def close(self):
+        # Представления схем делят пул и потоки основного экземпляра, закрывается он
+        self._executor.shutdown(wait=True)
+        self.engine.dispose()
+
+
+def member_fields(user):
+    """
+    Формирует словарь полей участника из объекта пользователя Telegram.
+
+    :param user: Объект telegram.User
+    :return: Словарь с полями модели Member
+    """
+    return {
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'full_name': f"{user.first_name or ''} {user.last_name or ''}".strip(),
+    }
+
+
+# Запросы, выполняемые через Database.run
+
+def get_group(session, chat_id):
+    return session.query(Group).filter(Group.telegram_id == chat_id).first()
+
+
+def _insert(session, table):
+    # INSERT ... ON CONFLICT есть и в SQLite, и в PostgreSQL, но строится диалектом
+    if session.bind.dialect.name == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def ensure_groups(session, groups):
+    """
+    Создаёт недостающие группы; безопасно при одновременной вставке из нескольких процессов.
+
+    :param groups: Словарь {telegram_id группы: название}
+    :return: Словарь {telegram_id группы: Group.id}
+    """
+    if not groups:
+        return {}
+    session.execute(
+        _insert(session, Group.__table__).on_conflict_do_nothing(index_elements=['telegram_id']),
+        [{'telegram_id': chat_id, 'name': name} for chat_id, name in groups.items()]
+    )
+    return {
+        telegram_id: group_id
+        for group_id, telegram_id in session.query(Group.id, Group.telegram_id).filter(
+            Group.telegram_id.in_(list(groups))
+        )
+    }
+
+
+def list_groups(session):
+    return session.query(Group).all()
+
+
+def list_groups_for_sync(session):
+    """
+    :return: Пары (группа, время последней активности её участников)
+    """
+    return session.query(Group, func.max(Member.last_active)).outerjoin(
+        Member, Member.group_id == Group.id
+    ).group_by(Group.id).all()
+
+
+def list_hot_groups(session, limit):
+    """
+    :return: Группы по убыванию последней активности участников, не больше limit
+    """
+    last_active = func.max(Member.last_active)
+    return [
+        group for group, _ in session.query(Group, last_active).outerjoin(
+            Member, Member.group_id == Group.id
+        ).group_by(Group.id).order_by(last_active.desc()).limit(limit)
+    ]
+
+
+def get_members_of_groups(session, group_ids):
+    """
+    :return: Словарь Group.id -> список участников
+    """
+    members = {group_id: [] for group_id in group_ids}
+    for member in session.query(Member).filter(Member.group_id.in_(group_ids)):
+        members[member.group_id].append(member)
+    return members
+
+
+def mark_synced(session, group_id, synced_at):
+    session.query(Group).filter(Group.id == group_id).update({Group.last_synced: synced_at}, synchronize_session=False)
+
+
+def get_group_members(session, chat_id):
+    """
+    :return: Пара (группа, список участников) или (None, []), если группа не найдена
+    """
+    group = get_group(session, chat_id)
+    if not group:
+        return None, []
+    return group, session.query(Member).filter(Member.group_id == group.id).all()
+
+
+def get_members_page(session, chat_id, after_id=None, before_id=None, limit=10):
+    """
+    Страница участников группы по возрастанию Member.id.
+
+    Страницы выбираются по ключу (keyset): следующая — после after_id, предыдущая —
+    перед before_id, поэтому стоимость запроса не зависит от номера страницы.
+
+    :return: Тройка (группа, участники, есть ли ещё участники в направлении листания);
+             (None, [], False), если группа не найдена
+    """
+    group = get_group(session, chat_id)
+    if not group:
+        return None, [], False
+    query = session.query(Member).filter(Member.group_id == group.id)
+    if before_id is not None:
+        members = query.filter(Member.id < before_id).order_by(Member.id.desc()).limit(limit + 1).all()
+        has_more = len(members) > limit
+        return group, list(reversed(members[:limit])), has_more
+    if after_id is not None:
+        query = query.filter(Member.id > after_id)
+    members = query.order_by(Member.id).limit(limit + 1).all()
+    return group, members[:limit], len(members) > limit
+
+
+def set_expiration_days(session, chat_id, days):
+    """
+    :return: Прежнее значение expiration_days
+    """
+    group = get_group(session, chat_id)
+    old_days = group.expiration_days
+    group.expiration_days = days
+    return old_days
+
+
+def upsert_members(session, rows):
+    """
+    Вставляет участников или обновляет существующих одним пакетным запросом
+    INSERT ... ON CONFLICT по уникальному индексу (group_id, telegram_id).
+
+    :param rows: Список словарей с ключами group_id, telegram_id, last_active и полями member_fields
+    """
+    if not rows:
+        return
+    stmt = _insert(session, Member.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['group_id', 'telegram_id'],
+        set_={
+            name: stmt.excluded[name]
+            for name in ('username', 'first_name', 'last_name', 'full_name', 'last_active')
+        }
+    )
+    session.execute(stmt, rows)
+
+
+def get_trigger_settings(session, chat_id):
+    """
+    :return: Пара (Group.triggers, Group.trigger_cooldown); (None, None), если группа не найдена
+    """
+    row = session.query(Group.triggers, Group.trigger_cooldown).filter(Group.telegram_id == chat_id).first()
+    return tuple(row) if row else (None, None)
+
+
+def set_group_triggers(session, chat_id, value):
+    session.query(Group).filter(Group.telegram_id == chat_id).update({Group.triggers: value}, synchronize_session=False)
+
+
+def set_trigger_cooldown(session, chat_id, seconds):
+    session.query(Group).filter(Group.telegram_id == chat_id).update({Group.trigger_cooldown: seconds}, synchronize_session=False)
+
+
+def delete_member(session, chat_id, user_id):
+    """
+    :return: Удалённый участник или None, если он не найден
+    """
+    group = get_group(session, chat_id)
+    if not group:
+        return None
+    member = session.query(Member).filter(Member.telegram_id == user_id, Member.group_id == group.id).first()
+    if member:
+        session.delete(member)
+    return member
+
+
+def get_group_tags(session, chat_id):
+    """
+    Участники ролей группы вместе с данными для упоминания.
+
+    :return: Словарь тег -> список кортежей (telegram_id, username, full_name);
+             username и full_name равны None, если участника нет в members
+    """
+    rows = session.query(MemberTag.tag, MemberTag.telegram_id, Member.username, Member.full_name).join(
+        Group, Group.id == MemberTag.group_id
+    ).outerjoin(
+        Member, (Member.group_id == MemberTag.group_id) & (Member.telegram_id == MemberTag.telegram_id)
+    ).filter(Group.telegram_id == chat_id).order_by(MemberTag.tag, MemberTag.id)
+    tags = {}
+    for tag, telegram_id, username, full_name in rows:
+        tags.setdefault(tag, []).append((telegram_id, username, full_name))
+    return tags
+
+
+def add_member_tags(session, chat_id, tag, user_ids):
+    """
+    Добавляет участников в роль группы; уже добавленные пропускаются.
+
+    :return: Количество добавленных участников или None, если группа не найдена
+    """
+    group = get_group(session, chat_id)
+    if not group:
+        return None
+    existing = {
+        telegram_id for telegram_id, in session.query(MemberTag.telegram_id).filter(
+            MemberTag.group_id == group.id, MemberTag.tag == tag, MemberTag.telegram_id.in_(user_ids)
+        )
+    }
+    new_ids = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in existing]
+    if new_ids:
+        # ON CONFLICT защищает от одновременного добавления из нескольких процессов
+        session.execute(
+            _insert(session, MemberTag.__table__).on_conflict_do_nothing(index_elements=['group_id', 'tag', 'telegram_id']),
+            [{'group_id': group.id, 'tag': tag, 'telegram_id': user_id} for user_id in new_ids]
+        )
+    return len(new_ids)
+
+
+def remove_member_tags(session, chat_id, tag=None, user_ids=None):
+    """
+    Удаляет участников из ролей группы.
+
+    :param tag: Роль или None для всех ролей
+    :param user_ids: ID участников или None для всех участников
+    :return: Количество удалённых записей
+    """
+    group = get_group(session, chat_id)
+    if not group:
+        return 0
+    query = session.query(MemberTag).filter(MemberTag.group_id == group.id)
+    if tag is not None:
+        query = query.filter(MemberTag.tag == tag)
+    if user_ids is not None:
+        query = query.filter(MemberTag.telegram_id.in_(user_ids))
+    return query.delete(synchronize_session=False)
+
+
+def list_expiration_days(session):
+    """
+    :return: Список различных значений expiration_days среди групп
+    """
+    return [days for (days,) in session.query(Group.expiration_days).distinct()]
+
+
+def delete_inactive_members_batch(session, expiration_days, cutoff_date, limit):
+    """
+    Удаляет порцию участников, неактивных с cutoff_date, из групп с заданным
+    expiration_days.
+
+    :param expiration_days: Значение Group.expiration_days
+    :param cutoff_date: Участники с last_active раньше этой даты удаляются
+    :param limit: Максимальное количество удаляемых за раз участников
+    :return: Словарь {telegram_id группы: количество удалённых участников}
+    """
+    rows = session.query(Member.id, Group.telegram_id).join(Group, Member.group_id == Group.id).filter(
+        Group.expiration_days == expiration_days,
+        Member.last_active < cutoff_date
+    ).limit(limit).all()
+    if not rows:
+        return {}
+
+    session.query(Member).filter(Member.id.in_([member_id for member_id, _ in rows])).delete(synchronize_session=False)
+    deleted = {}
+    for _, chat_id in rows:
+        deleted[chat_id] = deleted.get(chat_id, 0) + 1
+    return deleted
+
+
+def acquire_lease(session, name, holder, now, ttl):
+    """
+    Захватывает или продлевает аренду name для holder.
+
+    Аренду можно захватить, если её никто не держит или она истекла. UPDATE с
+    условием и INSERT ... ON CONFLICT DO NOTHING атомарны, поэтому из нескольких
+    процессов аренду получает только один.
+
+    :param ttl: Срок аренды в секундах
+    :return: True, если аренда принадлежит holder
+    """
+    expires_at = now + datetime.timedelta(seconds=ttl)
+    updated = session.query(Lease).filter(
+        Lease.name == name,
+        or_(Lease.holder == holder, Lease.expires_at < now)
+    ).update({Lease.holder: holder, Lease.expires_at: expires_at}, synchronize_session=False)
+    if updated:
+        return True
+    result = session.execute(
+        _insert(session, Lease.__table__).on_conflict_do_nothing(index_elements=['name']),
+        {'name': name, 'holder': holder, 'expires_at': expires_at}
+    )
+    return result.rowcount == 1
+
+
+def release_lease(session, name, holder):
+    session.query(Lease).filter(Lease.name == name, Lease.holder == holder).delete(synchronize_session=False)
+
+
+def lock_checkpoint(session, name):
+    """
+    Читает позицию name, блокируя её до конца транзакции (в PostgreSQL — SELECT ... FOR UPDATE).
+
+    Отсутствующая позиция создаётся со значением 0. В SQLite вставка сразу
+    захватывает блокировку записи, поэтому процессы также выполняются по очереди.
+
+    :return: Значение позиции
+    """
+    session.execute(
+        _insert(session, Checkpoint.__table__).on_conflict_do_nothing(index_elements=['name']),
+        {'name': name, 'value': 0}
+    )
+    return session.query(Checkpoint.value).filter(Checkpoint.name == name).with_for_update().scalar()
+
+
+def get_checkpoint(session, name):
+    """
+    :return: Значение позиции name или None, если она ещё не сохранялась
+    """
+    return session.query(Checkpoint.value).filter(Checkpoint.name == name).scalar()
+
+
+def set_checkpoint(session, name, value):
+    stmt = _insert(session, Checkpoint.__table__)
+    session.execute(
+        stmt.on_conflict_do_update(index_elements=['name'], set_={'value': stmt.excluded.value}),
+        {'name': name, 'value': value}
+    )
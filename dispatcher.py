@@ -0,0 +1,144 @@
+# dispatcher.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import RetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MENTION_SEPARATOR = ', '
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты «ведро с токенами».
+
+    Ведро пополняется со скоростью rate токенов в секунду до capacity; каждая
+    отправка забирает один токен, а при пустом ведре ждёт его появления.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: Скорость пополнения, токенов в секунду
+        :param capacity: Максимальное количество токенов (допустимый всплеск)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+def split_mentions(mentions, max_length=MessageLimit.MAX_TEXT_LENGTH, max_mentions=50):
+    """
+    Разбивает список упоминаний на сообщения, укладывающиеся в ограничения Telegram.
+
+    :param mentions: Список упоминаний
+    :param max_length: Максимальная длина одного сообщения
+    :param max_mentions: Максимальное количество упоминаний в одном сообщении
+    :return: Список текстов сообщений
+    """
+    batches = []
+    current = []
+    length = 0
+    for mention in mentions:
+        extra = len(mention) + (len(MENTION_SEPARATOR) if current else 0)
+        if current and (length + extra > max_length or len(current) >= max_mentions):
+            batches.append(MENTION_SEPARATOR.join(current))
+            current = []
+            length = 0
+            extra = len(mention)
+        current.append(mention)
+        length += extra
+    if current:
+        batches.append(MENTION_SEPARATOR.join(current))
+    return batches
+
+
+class MentionDispatcher:
+    """
+    Рассылка упоминаний порциями с соблюдением лимитов Telegram.
+
+    Каждое сообщение проходит через общий ограничитель и ограничитель чата;
+    при ответе RetryAfter отправка повторяется после указанной паузы. Ошибка
+    отправки одной порции не прерывает рассылку остальных.
+    """
+
+    def __init__(self, global_rate=25, chat_rate=1, chat_burst=3, max_mentions=50, max_retries=3, max_chats=10000):
+        """
+        :param global_rate: Сообщений в секунду на все чаты
+        :param chat_rate: Сообщений в секунду в один чат
+        :param chat_burst: Допустимый всплеск сообщений в один чат
+        :param max_mentions: Максимальное количество упоминаний в одном сообщении
+        :param max_retries: Количество повторов после RetryAfter
+        :param max_chats: Количество чатов, для которых хранятся ограничители
+        """
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_mentions = max_mentions
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chat_buckets = OrderedDict()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            while len(self._chat_buckets) > self.max_chats:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def send(self, message, mentions):
+        """
+        Отправляет упоминания ответами на сообщение.
+
+        :param message: Сообщение telegram.Message, на которое отвечает бот
+        :param mentions: Список упоминаний в разметке HTML (см. roster_cache.mention_token)
+        :return: Количество отправленных сообщений
+        """
+        metrics.MENTION_FANOUT.observe(len(mentions))
+        sent = 0
+        bucket = self._chat_bucket(message.chat.id)
+        batches = split_mentions(mentions, max_mentions=self.max_mentions)
+        for index, text in enumerate(batches, 1):
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self._send_with_retry(message, text)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке упоминаний в чат {message.chat.id} (порция {index} из {len(batches)}): {e}")
+                continue
+            metrics.MENTION_MESSAGES.inc()
+            sent += 1
+        return sent
+
+    async def _send_with_retry(self, message, text):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await message.reply_text(text, parse_mode=ParseMode.HTML)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Превышен лимит отправки в чат {message.chat.id}, повтор через {e.retry_after} с.")
+                await asyncio.sleep(e.retry_after)
@@ -0,0 +1,110 @@
+# http_server.py
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+
+class HTTPServer:
+    """
+    Минимальный асинхронный HTTP/1.1 сервер на asyncio.
+
+    Поддерживает keep-alive и тела запросов с Content-Length; этого достаточно
+    для приёма вебхуков Telegram и служебных эндпоинтов без сторонних зависимостей.
+    Запросы с Transfer-Encoding отклоняются ответом 411, а с некорректным
+    Content-Length — ответом 400.
+    """
+
+    def __init__(self, handler, max_body_size=1024 * 1024):
+        """
+        :param handler: Корутина handler(method, path, headers, body) -> (status, headers, body)
+        :param max_body_size: Максимальный размер тела запроса в байтах
+        """
+        self.handler = handler
+        self.max_body_size = max_body_size
+        self._server = None
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._serve, host, port)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                except ValueError:
+                    await self._respond(writer, 400, {}, b'', keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                # Без достоверной длины тела неизвестно, где начинается следующий запрос,
+                # поэтому после ошибки соединение закрывается
+                if 'transfer-encoding' in headers:
+                    await self._respond(writer, 411, {}, b'', keep_alive=False)
+                    break
+                length = headers.get('content-length') or '0'
+                if not (length.isascii() and length.isdigit()):
+                    await self._respond(writer, 400, {}, b'', keep_alive=False)
+                    break
+                length = int(length)
+                if length > self.max_body_size:
+                    await self._respond(writer, 413, {}, b'', keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                try:
+                    status, response_headers, response_body = await self.handler(method, path, headers, body)
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке HTTP-запроса {method} {path}: {e}")
+                    status, response_headers, response_body = 500, {}, b''
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, response_headers, response_body, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, headers, body, keep_alive):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+        headers = dict(headers)
+        headers['Content-Length'] = str(len(body))
+        headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
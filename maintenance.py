@@ -0,0 +1,73 @@
+# maintenance.py
+import os
+
+from sqlalchemy import text
+
+
+def sqlite_stats(connection, schema='main'):
+    """
+    :param schema: Имя файла базы в соединении: main или схема бота
+    :return: Словарь с размером базы, долей свободных страниц, размером WAL и режимом auto_vacuum
+    """
+    page_size = connection.execute(text(f"PRAGMA {schema}.page_size")).scalar()
+    page_count = connection.execute(text(f"PRAGMA {schema}.page_count")).scalar()
+    free_pages = connection.execute(text(f"PRAGMA {schema}.freelist_count")).scalar()
+    auto_vacuum = connection.execute(text(f"PRAGMA {schema}.auto_vacuum")).scalar()
+    path = next((row[2] for row in connection.execute(text("PRAGMA database_list")) if row[1] == schema), '')
+    wal_path = f"{path}-wal"
+    return {
+        'file_bytes': page_size * page_count,
+        'free_pages': free_pages,
+        'free_ratio': free_pages / page_count if page_count else 0.0,
+        'wal_bytes': os.path.getsize(wal_path) if path and os.path.exists(wal_path) else 0,
+        'auto_vacuum': auto_vacuum,
+    }
+
+
+def run_sqlite_maintenance(session, vacuum_pages=0, analysis_limit=1000, schema='main', full_vacuum_max_bytes=0):
+    """
+    Обслуживание файла SQLite: очистка свободных страниц, ANALYZE и контрольная точка WAL.
+
+    Выполняется через Database.run, то есть в потоке базы, а не в цикле событий.
+    Если база создана без auto_vacuum=INCREMENTAL, её переводит в этот режим
+    только полный VACUUM, после которого свободные страницы возвращаются
+    порциями. Он переписывает весь файл, и все обращения к базе ждут его
+    окончания, поэтому выполняется, только если файл не больше
+    full_vacuum_max_bytes.
+
+    :param vacuum_pages: Сколько свободных страниц вернуть за раз (0 - все)
+    :param analysis_limit: Ограничение строк, просматриваемых ANALYZE в каждом индексе
+    :param schema: Обслуживаемый файл: main или схема бота (Database.tenant)
+    :param full_vacuum_max_bytes: Наибольший размер файла, который переводится в режим INCREMENTAL полным VACUUM
+    :return: Тройка (статистика до, статистика после, перевод в режим INCREMENTAL: True - выполнен,
+             False - отложен из-за размера файла, None - не нужен)
+    """
+    # VACUUM нельзя выполнять внутри транзакции
+    connection = session.connection(execution_options={'isolation_level': 'AUTOCOMMIT'})
+    before = sqlite_stats(connection, schema)
+
+    full_vacuum = None
+    if before['auto_vacuum'] != 2:
+        full_vacuum = before['file_bytes'] <= full_vacuum_max_bytes
+        if full_vacuum:
+            connection.execute(text(f"PRAGMA {schema}.auto_vacuum=INCREMENTAL"))
+            connection.execute(text(f"VACUUM {schema}"))
+    elif before['free_pages']:
+        # Драйвер sqlite3 выполняет только первый шаг оператора, а каждый шаг освобождает одну
+        # страницу, поэтому страницы возвращаются повторными вызовами в одной транзакции
+        pages = min(vacuum_pages, before['free_pages']) if vacuum_pages else before['free_pages']
+        connection.execute(text("BEGIN"))
+        try:
+            for _ in range(pages):
+                connection.execute(text(f"PRAGMA {schema}.incremental_vacuum(1)"))
+        except Exception:
+            connection.execute(text("ROLLBACK"))
+            raise
+        connection.execute(text("COMMIT"))
+
+    connection.execute(text(f"PRAGMA analysis_limit={int(analysis_limit)}"))
+    connection.execute(text(f"ANALYZE {schema}"))
+    # После очистки WAL содержит все изменённые страницы; TRUNCATE возвращает его к нулевому размеру
+    connection.execute(text(f"PRAGMA {schema}.wal_checkpoint(TRUNCATE)")).fetchall()
+
+    return before, sqlite_stats(connection, schema), full_vacuum
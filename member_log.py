@@ -0,0 +1,175 @@
+# member_log.py
+import asyncio
+import datetime
+import logging
+
+from sqlalchemy import delete, func, insert
+
+from db import ensure_groups, lock_checkpoint, upsert_members
+from member_sync import DELETE_CHUNK_SIZE
+from models import Checkpoint, Member, MemberEvent
+
+logger = logging.getLogger(__name__)
+
+JOIN = 'join'
+LEAVE = 'leave'
+ACTIVITY = 'activity'
+RENAME = 'rename'
+
+# Позиция последнего свёрнутого события в таблице checkpoints
+CHECKPOINT = 'member_events'
+
+members_table = Member.__table__
+events_table = MemberEvent.__table__
+
+
+def event_row(kind, chat_id, user_id, fields=None, created_at=None):
+    """
+    :param fields: Словарь полей участника (см. db.member_fields); для leave не нужен
+    :return: Словарь для вставки в member_events
+    """
+    fields = fields or {}
+    return {
+        'chat_id': chat_id,
+        'telegram_id': user_id,
+        'kind': kind,
+        'username': fields.get('username'),
+        'first_name': fields.get('first_name'),
+        'last_name': fields.get('last_name'),
+        'full_name': fields.get('full_name'),
+        'created_at': created_at or datetime.datetime.utcnow(),
+    }
+
+
+def append_events(session, rows, groups=None):
+    """
+    Добавляет события в журнал одним пакетным INSERT.
+
+    :param rows: Словари из event_row
+    :param groups: Словарь {telegram_id группы: название} для создания недостающих групп
+    """
+    if groups:
+        ensure_groups(session, groups)
+    if rows:
+        session.execute(insert(events_table), rows)
+
+
+def fold_events(events):
+    """
+    Сворачивает события в итоговое состояние каждого затронутого участника.
+
+    :param events: События MemberEvent по возрастанию id
+    :return: Словарь {(chat_id, user_id): поля Member с last_active или None, если участник покинул группу}
+    """
+    state = {}
+    for event in events:
+        key = (event.chat_id, event.telegram_id)
+        if event.kind == LEAVE:
+            state[key] = None
+        else:
+            state[key] = {
+                'username': event.username,
+                'first_name': event.first_name,
+                'last_name': event.last_name,
+                'full_name': event.full_name,
+                'last_active': event.created_at,
+            }
+    return state
+
+
+def compact_events(session, limit):
+    """
+    Применяет к таблице members следующую порцию событий журнала и удаляет их.
+
+    Позиция журнала блокируется на время транзакции, поэтому одновременные
+    сворачивания из нескольких процессов выполняются по очереди и не применяют
+    события повторно. Удаляются ровно прочитанные события, а в позиции
+    сохраняется id, до которого включительно в журнале не осталось событий.
+    Стоимость зависит только от количества новых событий, но не от размера
+    групп.
+
+    :param limit: Максимальное количество событий за раз
+    :return: Пара (количество свёрнутых событий, результат fold_events)
+    """
+    lock_checkpoint(session, CHECKPOINT)
+    # Свёрнутые события удаляются, поэтому в журнале остаются только новые; отбор по позиции
+    # не годится: в PostgreSQL событие с меньшим id может зафиксироваться позже
+    events = session.query(MemberEvent).order_by(MemberEvent.id).limit(limit).all()
+    if not events:
+        return 0, {}
+
+    changes = fold_events(events)
+    group_ids = ensure_groups(session, {chat_id: None for chat_id, _ in changes})
+    upsert_members(session, [
+        dict(fields, group_id=group_ids[chat_id], telegram_id=user_id)
+        for (chat_id, user_id), fields in changes.items() if fields is not None
+    ])
+
+    leaves = {}
+    for (chat_id, user_id), fields in changes.items():
+        if fields is None:
+            leaves.setdefault(group_ids[chat_id], []).append(user_id)
+    for group_id, user_ids in leaves.items():
+        for i in range(0, len(user_ids), DELETE_CHUNK_SIZE):
+            session.execute(delete(members_table).where(
+                members_table.c.group_id == group_id,
+                members_table.c.telegram_id.in_(user_ids[i:i + DELETE_CHUNK_SIZE])
+            ))
+
+    # Удаляются только прочитанные события: событие с меньшим id, зафиксированное после выборки,
+    # остаётся в журнале до следующего сворачивания
+    event_ids = [event.id for event in events]
+    for i in range(0, len(event_ids), DELETE_CHUNK_SIZE):
+        session.execute(delete(events_table).where(events_table.c.id.in_(event_ids[i:i + DELETE_CHUNK_SIZE])))
+
+    # Позиция не переходит через события, оставшиеся в журнале
+    position = event_ids[-1]
+    first_pending = session.query(func.min(MemberEvent.id)).scalar()
+    if first_pending is not None:
+        position = min(position, first_pending - 1)
+    session.query(Checkpoint).filter(Checkpoint.name == CHECKPOINT).update({Checkpoint.value: position}, synchronize_session=False)
+    return len(events), changes
+
+
+class MemberLog:
+    """
+    Журнал изменений состава групп.
+
+    Вступления, выходы, активность и изменения данных участников дописываются в
+    member_events, а периодическое сворачивание переносит в members только
+    изменившихся участников. Поэтому состав больших групп, которые нельзя
+    перечитать через API, поддерживается по событиям, и его обновление стоит
+    пропорционально числу изменений.
+    """
+
+    def __init__(self, db, batch_size=5000):
+        """
+        :param db: Экземпляр db.Database
+        :param batch_size: Количество событий, сворачиваемых в одной транзакции
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self._lock = asyncio.Lock()
+
+    async def append(self, kind, chat_id, user_id, fields=None, chat_title=None):
+        """
+        Записывает одно событие; группа создаётся, если её ещё нет.
+        """
+        await self.db.run(append_events, [event_row(kind, chat_id, user_id, fields)], {chat_id: chat_title})
+
+    async def compact(self):
+        """
+        Сворачивает все накопленные события в таблицу members.
+
+        :return: Пара (количество свёрнутых событий, словарь изменений как у fold_events)
+        """
+        async with self._lock:
+            total = 0
+            changes = {}
+            while True:
+                count, batch = await self.db.run(compact_events, self.batch_size)
+                total += count
+                # Порции идут по порядку, поэтому более поздние состояния заменяют ранние
+                changes.update(batch)
+                if count < self.batch_size:
+                    return total, changes
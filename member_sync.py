@@ -0,0 +1,32 @@
+# member_sync.py
+from db import upsert_members
+
+# Количество ID в одном DELETE ... IN (...), с запасом до лимита параметров SQLite
+DELETE_CHUNK_SIZE = 500
+
+
+def sync_members(session, group_id, users, now):
+    """
+    Записывает участников, полученных из Telegram.
+
+    Новые участники вставляются, известные обновляются одним пакетным
+    INSERT ... ON CONFLICT, поэтому читать участников из базы не нужно и число
+    запросов не зависит от их количества. Участники, которых нет в списке, не
+    удаляются: Bot API отдаёт только администраторов группы, а уход остальных
+    записывает журнал участников (member_log) по событиям chat_member.
+
+    :param users: Словари с ключами id, username, first_name, last_name, full_name
+    :param now: Время, записываемое в last_active
+    """
+    upsert_members(session, [
+        {
+            'group_id': group_id,
+            'telegram_id': user['id'],
+            'username': user['username'],
+            'first_name': user['first_name'],
+            'last_name': user['last_name'],
+            'full_name': user['full_name'],
+            'last_active': now,
+        }
+        for user in users
+    ])
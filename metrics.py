@@ -0,0 +1,294 @@
+# metrics.py
+import contextvars
+import functools
+import threading
+import time
+from collections import Counter as TallyCounter
+
+from telegram.request import HTTPXRequest
+
+# Границы интервалов гистограмм по умолчанию, в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """
+    Монотонно растущий счётчик с метками.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    """
+    Гистограмма значений с метками: накопительные интервалы, сумма и количество.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._values.items()}
+        for labels, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = (('le', _format_value(bound)),)
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, labels, le), cumulative
+            yield f"{self.name}_bucket", _format_labels(self.labelnames, labels, (('le', '+Inf'),)), count
+            yield f"{self.name}_sum", _format_labels(self.labelnames, labels), total
+            yield f"{self.name}_count", _format_labels(self.labelnames, labels), count
+
+
+class Gauge:
+    """
+    Текущее значение с метками.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def samples(self):
+        for labels, value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class TopGroups:
+    """
+    Счётчик событий по группам, в выводе которого только top_n самых активных.
+
+    ID группы как метка Prometheus дал бы неограниченное число рядов, поэтому
+    наружу отдаются лишь самые «горячие» группы.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, top_n=10, max_groups=10000):
+        self.name = name
+        self.documentation = documentation
+        self.top_n = top_n
+        self.max_groups = max_groups
+        self._counts = TallyCounter()
+
+    def inc(self, chat_id, amount=1):
+        self._counts[chat_id] += amount
+        if len(self._counts) > self.max_groups:
+            # Отбрасываем редкие группы, чтобы счётчик не рос без ограничений
+            self._counts = TallyCounter(dict(self._counts.most_common(self.max_groups // 2)))
+
+    def samples(self):
+        for chat_id, value in self._counts.most_common(self.top_n):
+            yield self.name, _format_labels(('chat_id',), (chat_id,)), value
+
+
+class Registry:
+    """
+    Набор метрик, отдаваемый в текстовом формате Prometheus.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STARTUP_SECONDS = registry.register(Gauge(
+    'bot_startup_seconds', "Время от запуска процесса до этапа запуска", ('phase',)))
+HANDLER_SECONDS = registry.register(Histogram(
+    'bot_handler_seconds', "Время обработки обновления обработчиком", ('handler',)))
+HANDLER_ERRORS = registry.register(Counter(
+    'bot_handler_errors_total', "Необработанные исключения в обработчиках", ('handler',)))
+UPDATE_DB_CALLS = registry.register(Histogram(
+    'bot_update_db_calls', "Обращений к базе за одно обновление", ('handler',), COUNT_BUCKETS))
+UPDATE_DB_STATEMENTS = registry.register(Histogram(
+    'bot_update_db_statements', "SQL-запросов за одно обновление", ('handler',), COUNT_BUCKETS))
+UPDATE_DB_SECONDS = registry.register(Histogram(
+    'bot_update_db_seconds', "Время ожидания базы за одно обновление", ('handler',)))
+DB_CALL_SECONDS = registry.register(Histogram(
+    'bot_db_call_seconds', "Время обращения к базе, включая ожидание потока базы", ('query',)))
+DB_STATEMENTS = registry.register(Counter(
+    'bot_db_statements_total', "Выполненные SQL-запросы", ('query',)))
+API_CALL_SECONDS = registry.register(Histogram(
+    'bot_api_call_seconds', "Время запроса к Telegram Bot API", ('method',)))
+API_ERRORS = registry.register(Counter(
+    'bot_api_errors_total', "Ответы Telegram Bot API с ошибкой по HTTP-статусу", ('method', 'status')))
+API_RETRY_AFTER = registry.register(Counter(
+    'bot_api_retry_after_total', "Ответы Telegram Bot API 429 (RetryAfter)", ('method',)))
+MENTION_FANOUT = registry.register(Histogram(
+    'bot_mention_fanout', "Упоминаний в ответе на один триггер", (), COUNT_BUCKETS))
+MENTION_MESSAGES = registry.register(Counter(
+    'bot_mention_messages_total', "Отправленные сообщения с упоминаниями"))
+TRIGGERS_COALESCED = registry.register(Counter(
+    'bot_triggers_coalesced_total', "Триггеры, объединённые с уже ожидающей рассылкой"))
+CHAT_QUEUE_FULL = registry.register(Counter(
+    'bot_chat_queue_full_total', "Ожидания приёма обновления из-за заполненной очереди чата или всех очередей"))
+HOT_GROUPS = registry.register(TopGroups(
+    'bot_hot_group_triggers', "Сработавшие триггеры в самых активных группах"))
+DB_FILE_BYTES = registry.register(Gauge(
+    'bot_db_file_bytes', "Размер файла SQLite после последнего обслуживания", ('schema',)))
+DB_FREE_RATIO = registry.register(Gauge(
+    'bot_db_free_pages_ratio', "Доля свободных страниц SQLite после последнего обслуживания", ('schema',)))
+DB_WAL_BYTES = registry.register(Gauge(
+    'bot_db_wal_bytes', "Размер WAL SQLite после последнего обслуживания", ('schema',)))
+JOB_SECONDS = registry.register(Histogram(
+    'bot_job_seconds', "Время выполнения задачи планировщика", ('job',), DEFAULT_BUCKETS + (120, 300, 900, 3600)))
+
+# Статистика обращений к базе текущего обновления
+_update_stats = contextvars.ContextVar('update_stats', default=None)
+
+
+def record_db_call(query, seconds, statements):
+    """
+    Учитывает одно обращение к базе; вызывается из db.Database.run.
+    """
+    DB_CALL_SECONDS.observe(seconds, query)
+    DB_STATEMENTS.inc(query, amount=statements)
+    stats = _update_stats.get()
+    if stats is not None:
+        stats['calls'] += 1
+        stats['statements'] += statements
+        stats['seconds'] += seconds
+
+
+def instrument(name, callback):
+    """
+    Оборачивает обработчик обновлений: время обработки и обращения к базе.
+
+    :param name: Имя обработчика в метках
+    :param callback: Корутина callback(update, context)
+    """
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        stats = {'calls': 0, 'statements': 0, 'seconds': 0.0}
+        token = _update_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, name)
+            UPDATE_DB_CALLS.observe(stats['calls'], name)
+            UPDATE_DB_STATEMENTS.observe(stats['statements'], name)
+            UPDATE_DB_SECONDS.observe(stats['seconds'], name)
+            _update_stats.reset(token)
+    return wrapper
+
+
+def timed_job(name, job):
+    """
+    Оборачивает задачу планировщика для учёта времени её выполнения.
+    """
+    @functools.wraps(job)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await job(*args, **kwargs)
+        finally:
+            JOB_SECONDS.observe(time.perf_counter() - start, name)
+    return wrapper
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """
+    HTTPXRequest с учётом количества, времени и ошибок запросов к Bot API.
+    """
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception:
+            API_ERRORS.inc(api_method, 'network')
+            raise
+        finally:
+            API_CALL_SECONDS.observe(time.perf_counter() - start, api_method)
+        if code == 429:
+            API_RETRY_AFTER.inc(api_method)
+        elif code >= 400:
+            API_ERRORS.inc(api_method, str(code))
+        return code, payload
+
+
+async def handle_metrics(method, path, headers, body):
+    """
+    Обработчик http_server.HTTPServer, отдающий метрики по /metrics.
+    """
+    if path != '/metrics':
+        return 404, {}, b''
+    if method != 'GET':
+        return 405, {}, b''
+    return 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}, registry.render().encode()
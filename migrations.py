@@ -0,0 +1,152 @@
+# migrations.py
+import contextlib
+import logging
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+
+logger = logging.getLogger(__name__)
+
+# Ключ рекомендательной блокировки миграций в PostgreSQL (произвольное постоянное число)
+MIGRATION_LOCK_KEY = 0x6d696772
+# Сколько секунд процесс SQLite ждёт, пока другой процесс применяет миграции
+MIGRATION_LOCK_TIMEOUT = 600
+
+metadata = MetaData()
+
+schema_version = Table(
+    'schema_version', metadata,
+    Column('version', Integer, nullable=False)
+)
+
+
+def _table(table, schema):
+    # Текстовый SQL не проходит через schema_translate_map, поэтому схема бота указывается явно
+    return f"{schema}.{table}" if schema else table
+
+
+def _create_index(conn, name, table, columns, schema, unique=False):
+    # В SQLite схема указывается у имени индекса, а в PostgreSQL — у таблицы
+    if schema and conn.dialect.name == 'sqlite':
+        name, table = f"{schema}.{name}", table
+    else:
+        table = _table(table, schema)
+    conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+def _unique_members(conn, schema):
+    members = _table('members', schema)
+    # Дубликаты участников сливаются в самую новую запись с наибольшим last_active
+    conn.execute(text(f"""
+        UPDATE {members} SET last_active = (
+            SELECT MAX(m.last_active) FROM {members} AS m
+            WHERE m.group_id = members.group_id AND m.telegram_id = members.telegram_id
+        )
+    """))
+    conn.execute(text(f"""
+        DELETE FROM {members} WHERE id NOT IN (
+            SELECT MAX(id) FROM {members} GROUP BY group_id, telegram_id
+        )
+    """))
+    _create_index(conn, 'ix_members_group_telegram', 'members', 'group_id, telegram_id', schema, unique=True)
+    _create_index(conn, 'ix_members_last_active', 'members', 'last_active', schema)
+
+
+def _members_page_index(conn, schema):
+    # Постраничный вывод /members идёт по (group_id, id)
+    _create_index(conn, 'ix_members_group_id', 'members', 'group_id, id', schema)
+
+
+def _add_column(conn, schema, table, column, column_type):
+    # Новые базы получают столбец из create_all, поэтому добавляем его только при отсутствии
+    if column not in {c['name'] for c in inspect(conn).get_columns(table, schema=schema)}:
+        # Имя типа зависит от СУБД: DATETIME в SQLite, TIMESTAMP в PostgreSQL
+        ddl = column_type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {_table(table, schema)} ADD COLUMN {column} {ddl}"))
+
+
+def _group_last_synced(conn, schema):
+    _add_column(conn, schema, 'groups', 'last_synced', DateTime())
+
+
+def _group_triggers(conn, schema):
+    _add_column(conn, schema, 'groups', 'triggers', String())
+
+
+def _group_trigger_cooldown(conn, schema):
+    _add_column(conn, schema, 'groups', 'trigger_cooldown', Integer())
+
+
+# Миграции применяются по порядку; номер версии только растёт
+MIGRATIONS = [
+    (1, "Уникальный индекс участников (group_id, telegram_id) и индекс last_active", _unique_members),
+    (2, "Время последней синхронизации группы", _group_last_synced),
+    (3, "Триггерные слова группы", _group_triggers),
+    (4, "Пауза между рассылками упоминаний в группе", _group_trigger_cooldown),
+    (5, "Индекс участников для постраничного вывода", _members_page_index),
+]
+
+
+@contextlib.contextmanager
+def _migration_lock(engine):
+    """
+    Транзакция, которую одновременно может держать только один процесс.
+
+    В SQLite транзакция начинается с BEGIN IMMEDIATE и сразу захватывает
+    блокировку записи всех подключённых файлов; остальные процессы ждут её до
+    MIGRATION_LOCK_TIMEOUT секунд. В PostgreSQL берётся рекомендательная
+    блокировка pg_advisory_xact_lock, которая снимается вместе с завершением
+    транзакции.
+
+    :return: (через yield) Соединение внутри транзакции
+    """
+    with engine.connect() as conn:
+        is_sqlite = conn.dialect.name == 'sqlite'
+        if is_sqlite:
+            busy_timeout = conn.exec_driver_sql("PRAGMA busy_timeout").scalar()
+            conn.exec_driver_sql(f"PRAGMA busy_timeout={MIGRATION_LOCK_TIMEOUT * 1000}")
+        try:
+            with conn.begin():
+                if is_sqlite:
+                    # pysqlite не начинает транзакцию сам до первого изменения данных
+                    conn.exec_driver_sql("BEGIN IMMEDIATE")
+                else:
+                    conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+                yield conn
+        finally:
+            if is_sqlite:
+                conn.exec_driver_sql(f"PRAGMA busy_timeout={busy_timeout}")
+
+
+def apply_migrations(engine, schema=None, tables=None):
+    """
+    Применяет к базе данных миграции, которые ещё не были применены.
+
+    Миграции выполняются одной транзакцией вместе с обновлением номера версии
+    схемы и под блокировкой (см. _migration_lock), а версия читается уже под
+    ней. Поэтому при одновременном запуске нескольких процессов миграции
+    применяет первый из них, а остальные дожидаются его и видят новую версию.
+    Миграции получают схему и обращаются к таблицам бота так же, как к
+    основным, поэтому у каждой схемы своя версия.
+
+    :param engine: SQLAlchemy Engine (для схемы бота — Database.tenant(...).engine)
+    :param schema: Схема бота или None для основных таблиц
+    :param tables: MetaData, недостающие таблицы которой создаются под той же блокировкой до миграций
+    :return: Номер версии схемы после применения миграций
+    """
+    with _migration_lock(engine) as conn:
+        if tables is not None:
+            tables.create_all(conn)
+        metadata.create_all(conn)
+        current = conn.execute(select(schema_version.c.version)).scalar()
+        if current is None:
+            current = 0
+            conn.execute(schema_version.insert().values(version=current))
+
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            logger.info(f"Применение миграции {version}{f' к схеме {schema}' if schema else ''}: {description}")
+            migrate(conn, schema)
+            conn.execute(schema_version.update().values(version=version))
+            current = version
+    return current
@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship, declarative_base
 import datetime
 
@@ -8,19 +8,64 @@ Base = declarative_base()
 class Group(Base):
     __tablename__ = 'groups'
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(Integer, unique=True, nullable=False)
+    telegram_id = Column(BigInteger, unique=True, nullable=False)
     name = Column(String, nullable=True)
     expiration_days = Column(Integer, default=60)  # Новое поле
+    last_synced = Column(DateTime, nullable=True)  # Время последней синхронизации участников
+    triggers = Column(String, nullable=True)  # Триггерные слова группы через перевод строки
+    trigger_cooldown = Column(Integer, nullable=True)  # Пауза между рассылками упоминаний в секундах
     members = relationship("Member", back_populates="group", cascade="all, delete-orphan")
 
 class Member(Base):
     __tablename__ = 'members'
+    __table_args__ = (
+        Index('ix_members_group_telegram', 'group_id', 'telegram_id', unique=True),
+        Index('ix_members_last_active', 'last_active'),
+        Index('ix_members_group_id', 'group_id', 'id'),
+    )
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(Integer, nullable=False)
+    telegram_id = Column(BigInteger, nullable=False)
     username = Column(String, nullable=True)
     first_name = Column(String, nullable=True)
     last_name = Column(String, nullable=True)
     full_name = Column(String, nullable=True)
     last_active = Column(DateTime, default=datetime.datetime.utcnow)
     group_id = Column(Integer, ForeignKey('groups.id'))
-    group = relationship("Group", back_populates="members")
\ No newline at end of file
+    group = relationship("Group", back_populates="members")
+
+class MemberTag(Base):
+    # Именованные роли участников группы для упоминаний вида @тег
+    __tablename__ = 'member_tags'
+    __table_args__ = (
+        Index('ix_member_tags_group_tag_user', 'group_id', 'tag', 'telegram_id', unique=True),
+    )
+    id = Column(Integer, primary_key=True)
+    group_id = Column(Integer, ForeignKey('groups.id'), nullable=False)
+    tag = Column(String, nullable=False)
+    telegram_id = Column(BigInteger, nullable=False)
+
+class MemberEvent(Base):
+    # Журнал изменений состава групп; периодически сворачивается в таблицу members
+    __tablename__ = 'member_events'
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True)  # Порядок событий
+    chat_id = Column(BigInteger, nullable=False)
+    telegram_id = Column(BigInteger, nullable=False)
+    kind = Column(String, nullable=False)  # join, leave, activity или rename
+    username = Column(String, nullable=True)
+    first_name = Column(String, nullable=True)
+    last_name = Column(String, nullable=True)
+    full_name = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+class Checkpoint(Base):
+    # Сохранённые позиции обработки (например, последнее свёрнутое событие журнала)
+    __tablename__ = 'checkpoints'
+    name = Column(String, primary_key=True)
+    value = Column(BigInteger, nullable=False)
+
+class Lease(Base):
+    # Аренда для выбора ведущего экземпляра при запуске нескольких процессов бота
+    __tablename__ = 'leases'
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
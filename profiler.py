@@ -0,0 +1,168 @@
+# profiler.py
+import collections
+import datetime
+import os
+import sys
+import threading
+import time
+
+
+# Функции, в которых поток ждёт работы: цикл событий в select, потоки пулов в ожидании задачи.
+# Такие снимки остаются в стеках, но не попадают в таблицу горячих функций.
+IDLE_FRAMES = {
+    ('selectors.py', 'select'),
+    ('thread.py', '_worker'),
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+}
+
+
+def is_idle(code):
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Выборочный профилировщик всего процесса.
+
+    Отдельный поток раз в interval секунд снимает стеки всех потоков
+    (sys._current_frames): цикла событий с обработчиками и задачами
+    планировщика и потоков базы данных с запросами SQLAlchemy. Обработчики при
+    этом не инструментируются, а пока профилирование не запущено, потока нет
+    вовсе, поэтому обработка обновлений не замедляется.
+
+    Результат сохраняется в output_dir в двух файлах: стеки в свёрнутом
+    формате (flamegraph.pl, speedscope, inferno) и таблица самых горячих
+    функций.
+    """
+
+    def __init__(self, output_dir='profiles', interval=0.005, top=20):
+        """
+        :param output_dir: Каталог для результатов
+        :param interval: Интервал между снимками стеков в секундах
+        :param top: Количество функций в таблице
+        """
+        self.output_dir = output_dir
+        self.interval = interval
+        self.top = top
+        self._thread = None
+        self._labels = {}
+
+    @property
+    def active(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    async def capture(self, loop, seconds, max_updates=None, processed=None):
+        """
+        Профилирует процесс seconds секунд или до обработки max_updates обновлений.
+
+        :param loop: Цикл событий, в пуле которого ожидается завершение
+        :param max_updates: Количество обновлений, после которого профилирование останавливается
+        :param processed: Функция без аргументов, возвращающая число обработанных обновлений
+        :return: Словарь с длительностью, количеством снимков и обновлений, занятостью цикла событий, топом функций и путями к файлам
+        """
+        if self.active:
+            raise RuntimeError("Профилирование уже запущено.")
+        result = {}
+        self._thread = threading.Thread(
+            target=self._run, args=(seconds, max_updates, processed, result),
+            name='profiler', daemon=True
+        )
+        self._thread.start()
+        await loop.run_in_executor(None, self._thread.join)
+        if 'error' in result:
+            raise result['error']
+        return result
+
+    def _run(self, seconds, max_updates, processed, result):
+        try:
+            self._sample(seconds, max_updates, processed, result)
+        except Exception as e:
+            result['error'] = e
+
+    def _sample(self, seconds, max_updates, processed, result):
+        own_ident = threading.get_ident()
+        main_ident = threading.main_thread().ident
+        stacks = collections.Counter()
+        idle = set()
+        loop_busy = 0
+        started_updates = processed() if processed else 0
+        started = time.monotonic()
+        deadline = started + seconds
+        samples = 0
+
+        while time.monotonic() < deadline:
+            if max_updates and processed() - started_updates >= max_updates:
+                break
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                if is_idle(frame.f_code):
+                    idle.add(frame.f_code)
+                elif ident == main_ident:
+                    loop_busy += 1
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stack.reverse()
+                stacks[tuple(stack)] += 1
+            samples += 1
+            time.sleep(self.interval)
+
+        result.update(
+            seconds=time.monotonic() - started,
+            samples=samples,
+            loop_busy=loop_busy / samples if samples else 0.0,
+            updates=(processed() if processed else 0) - started_updates,
+            top=self.hot_functions(stacks, {self._label(code) for code in idle}),
+        )
+        result['folded_path'], result['top_path'] = self._save(stacks, result)
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = frame_label(code)
+        return label
+
+    def hot_functions(self, stacks, idle=()):
+        """
+        :param stacks: Счётчик {стек от потока к листу: количество снимков}
+        :param idle: Функции ожидания; стеки, которые ими заканчиваются, не учитываются
+        :return: Список троек (функция, собственные снимки, снимки со вложенными вызовами) по убыванию собственных
+        """
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in stacks.items():
+            if stack[-1] in idle:
+                continue
+            own[stack[-1]] += count
+            # Рекурсивная функция считается в снимке один раз
+            for label in set(stack[1:]):
+                total[label] += count
+        return [(label, count, total[label]) for label, count in own.most_common(self.top)]
+
+    def _save(self, stacks, result):
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = datetime.datetime.now().strftime('profile-%Y%m%d-%H%M%S')
+        folded_path = os.path.join(self.output_dir, f"{name}.folded")
+        top_path = os.path.join(self.output_dir, f"{name}.txt")
+
+        with open(folded_path, 'w') as f:
+            for stack, count in stacks.items():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+        samples = result['samples'] or 1
+        with open(top_path, 'w') as f:
+            f.write(f"Длительность: {result['seconds']:.1f} с, снимков: {result['samples']}, обновлений: {result['updates']}, "
+                    f"цикл событий занят: {result['loop_busy']:.1%}\n\n")
+            f.write(f"{'собств. %':>10}{'всего %':>10}  функция\n")
+            for label, own, total in result['top']:
+                f.write(f"{own / samples:>10.1%}{total / samples:>10.1%}  {label}\n")
+        return folded_path, top_path
@@ -0,0 +1,157 @@
+# roles.py
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+
+import db as queries
+from admin_cache import ADMIN_STATUSES
+from roster_cache import mention_token
+
+logger = logging.getLogger(__name__)
+
+ADMINS_TAG = 'admins'
+# Имена, которые нельзя использовать для ролей: они заняты общими триггерами
+RESERVED_TAGS = {'all', 'everyone', ADMINS_TAG}
+TAG_PATTERN = re.compile(r'^\w{1,32}$')
+MENTION_PATTERN = re.compile(r'(?<![\w@])@(\w+)')
+
+
+def mentioned_tags(text):
+    """
+    :return: Множество имён вида @имя из текста в нижнем регистре
+    """
+    return {name.lower() for name in MENTION_PATTERN.findall(text or '')}
+
+
+def valid_tag(tag):
+    return bool(TAG_PATTERN.match(tag)) and tag not in RESERVED_TAGS
+
+
+class RoleCache:
+    """
+    Готовые списки упоминаний по ролям группы: @admins и именованные роли.
+
+    Администраторы берутся из get_chat_administrators и кэшируются на admin_ttl
+    секунд, роли — из таблицы member_tags. Списки упоминаний собираются один раз
+    и сбрасываются обновлениями участников (chat_member_update) и командами
+    изменения ролей.
+    """
+
+    def __init__(self, db, admin_cache, admin_ttl=300, max_groups=1000):
+        """
+        :param db: Экземпляр db.Database
+        :param admin_cache: Экземпляр admin_cache.AdminCache, пополняемый списками администраторов
+        :param admin_ttl: Время жизни списка администраторов в секундах
+        :param max_groups: Максимальное количество групп в кэше
+        """
+        self.db = db
+        self.admin_cache = admin_cache
+        self.admin_ttl = admin_ttl
+        self.max_groups = max_groups
+        self._admins = OrderedDict()
+        self._tags = OrderedDict()
+        self._admin_requests = {}
+
+    def _remember(self, cache, chat_id, value):
+        cache[chat_id] = value
+        cache.move_to_end(chat_id)
+        while len(cache) > self.max_groups:
+            cache.popitem(last=False)
+
+    async def admins(self, bot, chat_id):
+        """
+        :return: Словарь user_id -> упоминание администраторов группы (без ботов)
+        """
+        entry = self._admins.get(chat_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._admins.move_to_end(chat_id)
+            return entry[1]
+
+        # Одновременные триггеры в одной группе ждут один запрос к API
+        request = self._admin_requests.get(chat_id)
+        if request is None:
+            request = self._admin_requests[chat_id] = asyncio.ensure_future(self._fetch_admins(bot, chat_id))
+            request.add_done_callback(lambda _: self._admin_requests.pop(chat_id, None))
+        return await asyncio.shield(request)
+
+    async def _fetch_admins(self, bot, chat_id):
+        administrators = await bot.get_chat_administrators(chat_id=chat_id)
+        mentions = {}
+        for member in administrators:
+            # Заодно обновляем кэш проверки прав для команд
+            self.admin_cache.set(chat_id, member.user.id, member.status)
+            if not member.user.is_bot:
+                mentions[member.user.id] = mention_token(member.user.id, member.user.username, member.user.full_name)
+        self._remember(self._admins, chat_id, (time.monotonic() + self.admin_ttl, mentions))
+        return mentions
+
+    async def tags(self, chat_id):
+        """
+        :return: Словарь тег -> словарь user_id -> упоминание
+        """
+        tags = self._tags.get(chat_id)
+        if tags is not None:
+            self._tags.move_to_end(chat_id)
+            return tags
+        rows = await self.db.run(queries.get_group_tags, chat_id)
+        tags = {
+            tag: {telegram_id: mention_token(telegram_id, username, full_name) for telegram_id, username, full_name in members}
+            for tag, members in rows.items()
+        }
+        self._remember(self._tags, chat_id, tags)
+        return tags
+
+    async def role_names(self, chat_id, names):
+        """
+        Отбирает из имён, упомянутых в сообщении, роли группы.
+
+        Обычные упоминания пользователей (@username) ролями не являются и
+        отбрасываются до постановки рассылки в очередь.
+
+        :param names: Имена из mentioned_tags
+        :return: Множество имён: @admins и роли группы из member_tags
+        """
+        tags = await self.tags(chat_id)
+        return {name for name in names if name == ADMINS_TAG or name in tags}
+
+    async def resolve(self, bot, chat_id, names):
+        """
+        Собирает упоминания участников ролей, названных в сообщении.
+
+        :param names: Имена из mentioned_tags
+        :return: Список упоминаний без повторов
+        """
+        mentions = {}
+        if ADMINS_TAG in names:
+            try:
+                mentions.update(await self.admins(bot, chat_id))
+            except Exception as e:
+                logger.error(f"Ошибка при получении администраторов чата {chat_id}: {e}")
+        tags = await self.tags(chat_id)
+        for name in sorted(names & tags.keys()):
+            mentions.update(tags[name])
+        return list(mentions.values())
+
+    def member_updated(self, chat_id, user_id, old_status, new_status, fields=None):
+        """
+        Обновляет списки по событию chat_member_update.
+
+        :param fields: Словарь полей участника (см. db.member_fields), если он остался в группе
+        """
+        if old_status in ADMIN_STATUSES or new_status in ADMIN_STATUSES:
+            self._admins.pop(chat_id, None)
+        tags = self._tags.get(chat_id)
+        if tags is None:
+            return
+        for members in tags.values():
+            if user_id not in members:
+                continue
+            if fields is None:
+                del members[user_id]
+            else:
+                members[user_id] = mention_token(user_id, fields['username'], fields['full_name'])
+
+    def invalidate_tags(self, chat_id):
+        self._tags.pop(chat_id, None)
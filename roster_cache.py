@@ -0,0 +1,94 @@
+# roster_cache.py
+import html
+import time
+from collections import OrderedDict
+
+
+def mention_token(telegram_id, username, full_name):
+    """
+    Формирует упоминание участника в разметке HTML.
+
+    Имя экранируется: символы разметки в нём иначе ломают разбор всего сообщения.
+    """
+    if username:
+        return f"@{username}"
+    return f'<a href="tg://user?id={telegram_id}">{html.escape(full_name or "User")}</a>'
+
+
+class RosterCache:
+    """
+    Кэш готовых упоминаний участников по группам.
+
+    Для каждой группы хранится словарь user_id -> упоминание, поэтому ответ на
+    триггер сводится к поиску в словаре и объединению строк. Число групп в кэше
+    ограничено: при переполнении вытесняется группа, к которой дольше всего не
+    обращались. Если задан ttl, список группы перечитывается из базы не реже
+    раза в ttl секунд — это нужно, когда базу меняют другие процессы бота.
+    """
+
+    def __init__(self, max_groups=1000, ttl=0):
+        """
+        :param max_groups: Максимальное количество групп в кэше
+        :param ttl: Время жизни списка группы в секундах (0 - без ограничения)
+        """
+        self.max_groups = max_groups
+        self.ttl = ttl
+        self._rosters = OrderedDict()
+        self._loaded = {}
+
+    def __contains__(self, chat_id):
+        return chat_id in self._rosters
+
+    def __len__(self):
+        return len(self._rosters)
+
+    def get(self, chat_id):
+        """
+        :return: Список упоминаний участников группы или None, если группы нет в кэше
+        """
+        roster = self._rosters.get(chat_id)
+        if roster is None:
+            return None
+        if self.ttl and time.monotonic() - self._loaded[chat_id] > self.ttl:
+            self.invalidate(chat_id)
+            return None
+        self._rosters.move_to_end(chat_id)
+        return list(roster.values())
+
+    def put(self, chat_id, members):
+        """
+        Загружает в кэш полный список участников группы.
+
+        :param chat_id: ID чата (группы)
+        :param members: Объекты Member этой группы
+        """
+        self._rosters[chat_id] = {
+            m.telegram_id: mention_token(m.telegram_id, m.username, m.full_name) for m in members
+        }
+        self._loaded[chat_id] = time.monotonic()
+        self._rosters.move_to_end(chat_id)
+        while len(self._rosters) > self.max_groups:
+            evicted, _ = self._rosters.popitem(last=False)
+            del self._loaded[evicted]
+
+    def upsert(self, chat_id, user_id, fields):
+        """
+        Добавляет или обновляет упоминание участника, если группа уже в кэше.
+
+        :param fields: Словарь полей участника (см. db.member_fields)
+        """
+        roster = self._rosters.get(chat_id)
+        if roster is not None:
+            roster[user_id] = mention_token(user_id, fields['username'], fields['full_name'])
+
+    def remove(self, chat_id, user_id):
+        roster = self._rosters.get(chat_id)
+        if roster is not None:
+            roster.pop(user_id, None)
+
+    def invalidate(self, chat_id):
+        """
+        Удаляет группу из кэша; при следующем триггере список будет загружен из базы.
+        """
+        self._rosters.pop(chat_id, None)
+        self._loaded.pop(chat_id, None)
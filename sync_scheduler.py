@@ -0,0 +1,114 @@
+# sync_scheduler.py
+import asyncio
+import datetime
+import logging
+
+import db as queries
+from cluster import shard_of
+from dispatcher import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class MemberSyncScheduler:
+    """
+    Постепенная синхронизация участников групп.
+
+    Интервал синхронизации делится на shards равных тактов, и за такт
+    синхронизируются только группы соответствующего шарда. Время последней
+    синхронизации хранится в Group.last_synced, поэтому после перезапуска
+    пропущенные за время простоя группы догоняются в ближайший такт, а уже
+    синхронизированные не обрабатываются повторно.
+    """
+
+    def __init__(self, db, sync_group, interval_hours=24, shards=24, concurrency=4, api_rate=5):
+        """
+        :param db: Экземпляр db.Database
+        :param sync_group: Корутина sync_group(bot, group, api_budget), синхронизирующая одну группу
+        :param interval_hours: Период, за который синхронизируются все группы
+        :param shards: Количество тактов в периоде
+        :param concurrency: Количество одновременно синхронизируемых групп
+        :param api_rate: Общий лимит запросов к API в секунду
+        """
+        self.db = db
+        self.sync_group = sync_group
+        self.interval = datetime.timedelta(hours=interval_hours)
+        self.shards = shards
+        self.concurrency = concurrency
+        self.api_budget = TokenBucket(api_rate, api_rate)
+
+    @property
+    def tick(self):
+        """Длительность одного такта."""
+        return self.interval / self.shards
+
+    def current_shard(self, now):
+        epoch = datetime.datetime(1970, 1, 1)
+        return int((now - epoch) / self.tick) % self.shards
+
+    def due_groups(self, rows, now):
+        """
+        Отбирает группы для синхронизации в текущем такте.
+
+        :param rows: Пары (Group, время последней активности в группе)
+        :return: Группы по убыванию недавней активности
+        """
+        shard = self.current_shard(now)
+        due = []
+        for group, last_activity in rows:
+            if group.last_synced is None:
+                is_due = shard_of(group.telegram_id, self.shards) == shard
+            elif now - group.last_synced > self.interval + self.tick:
+                # Такт группы пропущен, например, пока бот был остановлен
+                is_due = True
+            else:
+                is_due = (shard_of(group.telegram_id, self.shards) == shard
+                          and now - group.last_synced >= self.interval / 2)
+            if is_due:
+                due.append((group, last_activity))
+
+        due.sort(key=lambda item: item[1] or datetime.datetime.min, reverse=True)
+        return [group for group, _ in due]
+
+    async def run_tick(self, bot, now=None):
+        """
+        Синхронизирует группы текущего такта.
+
+        :return: Количество успешно синхронизированных групп
+        """
+        now = now or datetime.datetime.utcnow()
+        rows = await self.db.run(queries.list_groups_for_sync)
+        groups = self.due_groups(rows, now)
+        if not groups:
+            return 0
+
+        results = await self.sync_groups(bot, groups)
+        synced = sum(1 for _, _, error in results if error is None)
+        logger.info(f"Синхронизировано групп: {synced} из {len(groups)} (шард {self.current_shard(now)}).")
+        return synced
+
+    async def sync_groups(self, bot, groups, on_done=None):
+        """
+        Синхронизирует группы, не более concurrency одновременно и в общем лимите запросов к API.
+
+        Общий путь для периодической задачи и команды /update.
+
+        :param on_done: Корутина on_done(group, result, error), вызываемая по завершении каждой группы
+        :return: Тройки (группа, результат sync_group, исключение или None) в порядке groups
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_one(group):
+            async with semaphore:
+                result = error = None
+                try:
+                    result = await self.sync_group(bot, group, self.api_budget)
+                    await self.db.run(queries.mark_synced, group.id, datetime.datetime.utcnow())
+                except Exception as e:
+                    logger.error(f"Ошибка при обновлении группы {group.telegram_id}: {e}")
+                    error = e
+                if on_done is not None:
+                    await on_done(group, result, error)
+                return group, result, error
+
+        return await asyncio.gather(*(run_one(group) for group in groups))
@@ -0,0 +1,102 @@
+# tenancy.py
+import asyncio
+import logging
+import re
+import signal
+
+from metrics import InstrumentedRequest
+
+logger = logging.getLogger(__name__)
+
+TENANT_NAME_PATTERN = re.compile(r'^[a-z0-9_]{1,32}$')
+
+
+def parse_bot_tokens(value):
+    """
+    Разбирает список ботов вида "имя=токен,имя=токен".
+
+    :return: Список пар (имя, токен) в порядке перечисления
+    """
+    tenants = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, token = item.partition('=')
+        name, token = name.strip().lower(), token.strip()
+        if not sep or not token:
+            raise ValueError(f"Бот '{item}' в BOT_TOKENS должен быть задан как имя=токен.")
+        if not TENANT_NAME_PATTERN.match(name):
+            raise ValueError(f"Имя бота '{name}' в BOT_TOKENS должно состоять из латинских букв, цифр и '_' (до 32 символов).")
+        if name in {existing for existing, _ in tenants}:
+            raise ValueError(f"Бот '{name}' указан в BOT_TOKENS несколько раз.")
+        tenants.append((name, token))
+    return tenants
+
+
+def tenant_schema(name):
+    """
+    :return: Схема базы для таблиц бота name
+    """
+    return f"tenant_{name}"
+
+
+class SharedRequest(InstrumentedRequest):
+    """
+    Пул HTTP-соединений к Bot API, общий для нескольких ботов процесса.
+
+    Каждый бот инициализирует и закрывает свой запрос сам, поэтому соединения
+    закрываются только вместе с последним ботом.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._users = 0
+
+    async def initialize(self):
+        self._users += 1
+        await super().initialize()
+
+    async def shutdown(self):
+        self._users -= 1
+        if self._users <= 0:
+            await super().shutdown()
+
+
+async def run_polling(applications, allowed_updates=None):
+    """
+    Запускает несколько приложений в режиме опроса до получения SIGINT или SIGTERM.
+
+    Повторяет жизненный цикл Application.run_polling для каждого приложения.
+    Остановка начинается с приёма обновлений всех ботов, и только потом
+    выполняются post_stop: общие очереди чатов и планировщик разбираются уже без
+    новых поступлений.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    try:
+        for application in applications:
+            await application.initialize()
+            if application.post_init:
+                await application.post_init(application)
+        for application in applications:
+            await application.updater.start_polling(allowed_updates=allowed_updates)
+            await application.start()
+        await stop_event.wait()
+    finally:
+        for application in applications:
+            if application.updater.running:
+                await application.updater.stop()
+        for application in applications:
+            if application.running:
+                await application.stop()
+        for application in applications:
+            if application.post_stop:
+                await application.post_stop(application)
+        for application in applications:
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
@@ -0,0 +1,25 @@
+# tests/conftest.py
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Файл SQLite с таблицами и миграциями, как при запуске бота."""
+    database = Database(f"sqlite:///{tmp_path / 'bot.db'}")
+    database.migrate()
+    yield database
+    database.close()
+
+
+def call(database, func, *args, **kwargs):
+    """Выполняет func через Database.run вне цикла событий."""
+    return asyncio.run(database.run(func, *args, **kwargs))
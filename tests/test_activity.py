@@ -0,0 +1,81 @@
+# tests/test_activity.py
+import asyncio
+from types import SimpleNamespace
+
+from activity import ActivityBuffer
+from conftest import call
+from models import MemberEvent
+
+
+def chat(chat_id, title="Группа"):
+    return SimpleNamespace(id=chat_id, title=title)
+
+
+def user(user_id, username):
+    return SimpleNamespace(id=user_id, username=username, first_name=username, last_name=None)
+
+
+def events(database):
+    return call(database, lambda session: sorted(
+        (event.chat_id, event.telegram_id, event.kind, event.username) for event in session.query(MemberEvent)
+    ))
+
+
+def test_repeated_activity_is_written_once_per_member(database):
+    async def scenario():
+        buffer = ActivityBuffer(database)
+        for i in range(5):
+            buffer.record(chat(-1), user(1, f"a{i}"))
+        buffer.record(chat(-1), user(2, 'b'))
+        buffer.record(chat(-2), user(1, 'a'))
+        size = len(buffer)
+        written = await buffer.flush()
+        return size, written, len(buffer)
+
+    assert asyncio.run(scenario()) == (3, 3, 0)
+    # Из повторной активности остаётся последнее состояние участника
+    assert events(database) == [(-2, 1, 'activity', 'a'), (-1, 1, 'activity', 'a4'), (-1, 2, 'activity', 'b')]
+
+
+def test_discarded_member_is_not_written(database):
+    async def scenario():
+        buffer = ActivityBuffer(database)
+        buffer.record(chat(-1), user(1, 'a'))
+        buffer.record(chat(-1), user(2, 'b'))
+        buffer.discard(-1, 1)
+        return await buffer.flush()
+
+    assert asyncio.run(scenario()) == 1
+    assert events(database) == [(-1, 2, 'activity', 'b')]
+
+
+def test_size_threshold_flushes_early(database):
+    async def scenario():
+        buffer = ActivityBuffer(database, max_size=3)
+        for user_id in range(3):
+            buffer.record(chat(-1), user(user_id, f"u{user_id}"))
+        # Досрочный сброс запускается фоном; ждём его завершения
+        await buffer._flush_task
+        return len(buffer)
+
+    assert asyncio.run(scenario()) == 0
+    assert len(events(database)) == 3
+
+
+def test_failed_flush_keeps_entries_without_overwriting_newer_ones():
+    class FailingDatabase:
+        async def run(self, func, *args):
+            buffer.record(chat(-1), user(1, 'newer'))
+            raise RuntimeError("database is locked")
+
+    buffer = ActivityBuffer(FailingDatabase())
+
+    async def scenario():
+        buffer.record(chat(-1), user(1, 'older'))
+        buffer.record(chat(-1), user(2, 'b'))
+        return await buffer.flush()
+
+    assert asyncio.run(scenario()) == 0
+    assert len(buffer) == 2
+    assert buffer._pending[(-1, 1)]['username'] == 'newer'
+    assert buffer._pending[(-1, 2)]['username'] == 'b'
@@ -0,0 +1,71 @@
+# tests/test_admin_cache.py
+import asyncio
+from types import SimpleNamespace
+
+from admin_cache import AdminCache
+
+
+class FakeBot:
+    def __init__(self, admins, latency=0.02):
+        self.admins = admins
+        self.latency = latency
+        self.calls = 0
+        self.active = 0
+        self.peak = 0
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(self.latency)
+        self.active -= 1
+        return SimpleNamespace(status='administrator' if chat_id in self.admins else 'member')
+
+
+def group(chat_id):
+    return SimpleNamespace(telegram_id=chat_id)
+
+
+def test_groups_are_checked_concurrently_and_cached():
+    bot = FakeBot(admins={-1, -3})
+    cache = AdminCache(max_concurrency=2)
+    groups = [group(-1), group(-2), group(-3), group(-4)]
+
+    async def scenario():
+        first = await cache.filter_admin_groups(bot, groups, 7)
+        second = await cache.filter_admin_groups(bot, groups, 7)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert [g.telegram_id for g in first] == [-1, -3]
+    assert [g.telegram_id for g in second] == [-1, -3]
+    assert bot.calls == 4
+    assert bot.peak == 2
+
+
+def test_update_overrides_and_ttl_expires(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('admin_cache.time.monotonic', lambda: now[0])
+    cache = AdminCache(ttl=60)
+    cache.set(-1, 7, 'creator')
+    assert cache.get(-1, 7) is True
+    cache.set(-1, 7, 'member')
+    assert cache.get(-1, 7) is False
+    now[0] += 61
+    assert cache.get(-1, 7) is None
+
+
+def test_size_is_bounded_by_evicting_least_recently_used():
+    cache = AdminCache(max_entries=3)
+    for user_id in range(3):
+        cache.set(-1, user_id, 'member')
+    cache.get(-1, 0)
+    cache.set(-1, 3, 'administrator')
+    assert len(cache._entries) == 3
+    assert cache.get(-1, 1) is None
+    assert cache.get(-1, 0) is False
+    assert cache.get(-1, 3) is True
+
+    for user_id in range(4, 1000):
+        cache.set(-1, user_id, 'member')
+    assert len(cache._entries) == 3
@@ -0,0 +1,150 @@
+# tests/test_chat_scheduler.py
+import asyncio
+
+from chat_scheduler import ChatScheduler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_tasks_of_one_chat_run_in_order():
+    async def scenario():
+        scheduler = ChatScheduler(concurrency=4)
+        done = []
+
+        async def task(i):
+            # Более ранние задачи спят дольше: порядок держит очередь, а не время
+            await asyncio.sleep(0.01 * (5 - i))
+            done.append(i)
+
+        for i in range(5):
+            await scheduler.submit('chat', task, i)
+        await scheduler.drain()
+        await scheduler.close()
+        return done
+
+    assert run(scenario()) == [0, 1, 2, 3, 4]
+
+
+def test_chats_run_concurrently_up_to_limit():
+    async def scenario():
+        scheduler = ChatScheduler(concurrency=3)
+        running = 0
+        peak = 0
+        per_chat = {}
+
+        async def task(chat):
+            nonlocal running, peak
+            running += 1
+            per_chat[chat] = per_chat.get(chat, 0) + 1
+            peak = max(peak, running)
+            assert per_chat[chat] == 1, "две задачи одного чата выполняются одновременно"
+            await asyncio.sleep(0.01)
+            per_chat[chat] -= 1
+            running -= 1
+
+        for i in range(20):
+            await scheduler.submit(i % 5, task, i % 5)
+        await scheduler.drain()
+        await scheduler.close()
+        return peak
+
+    assert run(scenario()) == 3
+
+
+def test_submit_waits_when_chat_queue_is_full():
+    async def scenario():
+        scheduler = ChatScheduler(concurrency=1, max_depth=2)
+        gate = asyncio.Event()
+
+        async def task():
+            await gate.wait()
+
+        # Первая задача уже у исполнителя, ещё две занимают очередь чата
+        for _ in range(3):
+            await scheduler.submit('chat', task)
+            await asyncio.sleep(0)
+        blocked = asyncio.ensure_future(scheduler.submit('chat', task))
+        await asyncio.sleep(0.02)
+        was_blocked = not blocked.done()
+        gate.set()
+        await blocked
+        await scheduler.drain()
+        await scheduler.close()
+        return was_blocked
+
+    assert run(scenario())
+
+
+def test_submit_waits_when_all_queues_are_full():
+    async def scenario():
+        scheduler = ChatScheduler(concurrency=1, max_depth=50, max_pending=3)
+        gate = asyncio.Event()
+
+        async def task():
+            await gate.wait()
+
+        # Каждая задача в своём чате: очереди чатов не заполнены, заполнен общий предел
+        for chat in range(3):
+            await scheduler.submit(chat, task)
+        blocked = asyncio.ensure_future(scheduler.submit(99, task))
+        await asyncio.sleep(0.02)
+        was_blocked = not blocked.done()
+        pending = len(scheduler)
+        gate.set()
+        await blocked
+        await scheduler.drain()
+        await scheduler.close()
+        return was_blocked, pending
+
+    assert run(scenario()) == (True, 3)
+
+
+def test_cancelled_submit_releases_its_slot():
+    async def scenario():
+        scheduler = ChatScheduler(concurrency=1, max_depth=1, max_pending=3)
+        gate = asyncio.Event()
+        done = []
+
+        async def task(i):
+            await gate.wait()
+            done.append(i)
+
+        await scheduler.submit('chat', task, 0)
+        await asyncio.sleep(0)
+        await scheduler.submit('chat', task, 1)
+        # Очередь чата заполнена: отправка ждёт места, уже заняв место в общем пределе
+        waiting = asyncio.ensure_future(scheduler.submit('chat', task, 2))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+        # Если бы место не вернулось, эта отправка ждала бы бесконечно
+        await scheduler.submit('other', task, 3)
+        gate.set()
+        await scheduler.drain()
+        await scheduler.close()
+        return sorted(done)
+
+    assert run(scenario()) == [0, 1, 3]
+
+
+def test_failing_task_does_not_stop_the_chat():
+    async def scenario():
+        scheduler = ChatScheduler(concurrency=1)
+        done = []
+
+        async def fail():
+            raise RuntimeError("ошибка обработчика")
+
+        async def task():
+            done.append(True)
+
+        await scheduler.submit('chat', fail)
+        await scheduler.submit('chat', task)
+        await scheduler.drain()
+        await scheduler.close()
+        return done, len(scheduler)
+
+    assert run(scenario()) == ([True], 0)
@@ -0,0 +1,107 @@
+# tests/test_coalescer.py
+import asyncio
+import time
+from types import SimpleNamespace
+
+from coalescer import TriggerCoalescer
+
+
+def message(chat_id, text=''):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id), text=text)
+
+
+class Recorder:
+    def __init__(self, name='all'):
+        self.name = name
+        self.sent = []
+
+    async def __call__(self, message):
+        self.sent.append((self.name, message.chat.id, message.text, time.monotonic()))
+
+
+def test_burst_is_sent_once_on_latest_message():
+    async def scenario():
+        broadcast = Recorder()
+        coalescer = TriggerCoalescer(broadcast, window=0.05)
+        results = [coalescer.submit(message(1, f"@all {i}")) for i in range(5)]
+        await coalescer.drain()
+        return results, broadcast.sent
+
+    results, sent = asyncio.run(scenario())
+    assert results == [True, False, False, False, False]
+    assert [(chat, text) for _, chat, text, _ in sent] == [(1, "@all 4")]
+
+
+def test_groups_are_coalesced_separately():
+    async def scenario():
+        broadcast = Recorder()
+        coalescer = TriggerCoalescer(broadcast, window=0.01)
+        coalescer.submit(message(1))
+        coalescer.submit(message(2))
+        await coalescer.drain()
+        return sorted(chat for _, chat, _, _ in broadcast.sent)
+
+    assert asyncio.run(scenario()) == [1, 2]
+
+
+def test_group_cooldown_delays_next_broadcast():
+    async def scenario():
+        broadcast = Recorder()
+        coalescer = TriggerCoalescer(broadcast, window=0, default_cooldown=60)
+        coalescer.set_cooldown(1, 0.2)
+        coalescer.submit(message(1, "первый"))
+        await coalescer.drain()
+        coalescer.submit(message(1, "второй"))
+        await coalescer.drain()
+        return broadcast.sent
+
+    sent = asyncio.run(scenario())
+    assert [text for _, _, text, _ in sent] == ["первый", "второй"]
+    assert sent[1][3] - sent[0][3] >= 0.19
+
+
+def test_expedite_skips_window_and_cooldown():
+    async def scenario():
+        broadcast = Recorder()
+        coalescer = TriggerCoalescer(broadcast, window=60)
+        coalescer.submit(message(1))
+        started = time.monotonic()
+        await asyncio.wait_for(coalescer.drain(expedite=True), 1)
+        return time.monotonic() - started, len(broadcast.sent)
+
+    elapsed, count = asyncio.run(scenario())
+    assert count == 1
+    assert elapsed < 1
+
+
+def test_eviction_keeps_groups_in_cooldown():
+    async def scenario():
+        coalescer = TriggerCoalescer(Recorder(), window=0, default_cooldown=60, max_chats=2)
+        coalescer.set_cooldown(1, 100)
+        coalescer.submit(message(1))
+        await coalescer.drain()
+        # Группа 1 используется раньше всех, но её пауза ещё действует
+        for chat_id in (2, 3, 4):
+            coalescer.set_cooldown(chat_id, None)
+        return [chat_id in coalescer for chat_id in (1, 2, 3, 4)]
+
+    assert asyncio.run(scenario()) == [True, False, False, True]
+
+
+def test_role_mentions_use_own_key_and_group_cooldown():
+    async def scenario():
+        everyone = Recorder('all')
+        roles = Recorder('roles')
+        coalescer = TriggerCoalescer(everyone, window=0.02, default_cooldown=60)
+        coalescer.set_cooldown(1, 5)
+        key = (1, frozenset({'admins'}))
+        for i in range(3):
+            coalescer.submit(message(1, f"@admins {i}"), key=key, broadcast=roles)
+        coalescer.submit(message(1, "@all"))
+        await coalescer.drain()
+        return everyone.sent, roles.sent, coalescer._chats[key].cooldown
+
+    everyone, roles, cooldown = asyncio.run(scenario())
+    assert [text for _, _, text, _ in everyone] == ["@all"]
+    assert [text for _, _, text, _ in roles] == ["@admins 2"]
+    assert cooldown == 5
@@ -0,0 +1,73 @@
+# tests/test_dispatcher.py
+import asyncio
+import time
+from types import SimpleNamespace
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
+
+from dispatcher import MENTION_SEPARATOR, MentionDispatcher, TokenBucket, split_mentions
+from roster_cache import mention_token
+
+
+def test_split_respects_length_and_mention_limits():
+    mentions = [f"@user{i:03d}" for i in range(120)]
+    batches = split_mentions(mentions, max_length=100, max_mentions=50)
+    assert all(len(text) <= 100 for text in batches)
+    assert MENTION_SEPARATOR.join(batches).split(MENTION_SEPARATOR) == mentions
+
+    batches = split_mentions(mentions, max_length=4096, max_mentions=50)
+    assert [len(text.split(MENTION_SEPARATOR)) for text in batches] == [50, 50, 20]
+    assert split_mentions([]) == []
+
+
+def test_mention_without_username_is_escaped():
+    assert mention_token(1, 'john_doe', "John") == "@john_doe"
+    assert mention_token(2, None, "<b>*_]&") == '<a href="tg://user?id=2">&lt;b&gt;*_]&amp;</a>'
+    assert mention_token(3, None, None) == '<a href="tg://user?id=3">User</a>'
+
+
+def test_token_bucket_limits_rate_after_burst():
+    async def scenario():
+        bucket = TokenBucket(rate=50, capacity=2)
+        started = time.monotonic()
+        for _ in range(7):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # Два токена сразу, ещё пять — со скоростью 50 в секунду
+    elapsed = asyncio.run(scenario())
+    assert 0.09 <= elapsed < 0.3
+
+
+class FakeMessage:
+    def __init__(self, failures):
+        self.chat = SimpleNamespace(id=-1)
+        self.failures = failures
+        self.sent = []
+
+    async def reply_text(self, text, parse_mode=None):
+        assert parse_mode == ParseMode.HTML
+        error = self.failures.pop(0) if self.failures else None
+        if error is not None:
+            raise error
+        self.sent.append(text)
+
+
+def dispatcher():
+    return MentionDispatcher(global_rate=1000, chat_rate=1000, chat_burst=1000, max_mentions=2, max_retries=1)
+
+
+def test_retry_after_is_retried():
+    message = FakeMessage([RetryAfter(0.01)])
+    sent = asyncio.run(dispatcher().send(message, ['@a', '@b', '@c']))
+    assert sent == 2
+    assert message.sent == ['@a, @b', '@c']
+
+
+def test_failed_batch_does_not_stop_the_rest():
+    message = FakeMessage([BadRequest("Can't parse entities"), None, RetryAfter(0.01), RetryAfter(0.01)])
+    sent = asyncio.run(dispatcher().send(message, ['@a', '@b', '@c', '@d', '@e', '@f', '@g']))
+    # Первая порция отклонена, третья исчерпала повторы, остальные отправлены
+    assert sent == 2
+    assert message.sent == ['@c, @d', '@g']
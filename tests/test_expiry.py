@@ -0,0 +1,49 @@
+# tests/test_expiry.py
+import datetime
+
+import db as queries
+from conftest import call
+from models import Group, Member
+
+
+def seed(database, now):
+    def write(session):
+        ids = queries.ensure_groups(session, {-1: "Месяц", -2: "Неделя"})
+        session.query(Group).filter(Group.telegram_id == -1).update({Group.expiration_days: 30})
+        session.query(Group).filter(Group.telegram_id == -2).update({Group.expiration_days: 7})
+        rows = []
+        for chat_id, days_ago in ((-1, 40), (-1, 40), (-1, 40), (-1, 10), (-2, 10), (-2, 10), (-2, 1)):
+            rows.append({
+                'group_id': ids[chat_id], 'telegram_id': len(rows), 'last_active': now - datetime.timedelta(days=days_ago),
+                'username': None, 'first_name': None, 'last_name': None, 'full_name': None,
+            })
+        queries.upsert_members(session, rows)
+    call(database, write)
+
+
+def remaining(database):
+    return call(database, lambda session: sorted(
+        (group.telegram_id, member.telegram_id)
+        for member, group in session.query(Member, Group).join(Group, Member.group_id == Group.id)
+    ))
+
+
+def test_sweep_respects_each_group_expiration_in_batches(database):
+    now = datetime.datetime.utcnow()
+    seed(database, now)
+    assert sorted(call(database, queries.list_expiration_days)) == [7, 30]
+
+    batches = []
+    for days in (30, 7):
+        cutoff = now - datetime.timedelta(days=days)
+        while batch := call(database, queries.delete_inactive_members_batch, days, cutoff, 2):
+            batches.append(batch)
+
+    # Порции не больше limit, счётчики по группам складываются в итог
+    assert [sum(batch.values()) for batch in batches] == [2, 1, 2]
+    totals = {}
+    for batch in batches:
+        for chat_id, count in batch.items():
+            totals[chat_id] = totals.get(chat_id, 0) + count
+    assert totals == {-1: 3, -2: 2}
+    assert remaining(database) == [(-2, 6), (-1, 3)]
@@ -0,0 +1,58 @@
+# tests/test_http_server.py
+import asyncio
+
+from http_server import HTTPServer
+
+
+async def echo(method, path, headers, body):
+    return 200, {}, body
+
+
+async def exchange(server, request):
+    reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+    writer.write(request)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+def run(*requests, max_body_size=1024):
+    async def scenario():
+        server = HTTPServer(echo, max_body_size=max_body_size)
+        await server.start('127.0.0.1', 0)
+        try:
+            return [await exchange(server, request) for request in requests]
+        finally:
+            await server.stop()
+    return asyncio.run(scenario())
+
+
+def status(response):
+    return int(response.split(b' ', 2)[1])
+
+
+def test_keep_alive_requests_with_bodies():
+    response, = run(
+        b"POST /a HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello"
+        b"POST /b HTTP/1.1\r\nContent-Length: 3\r\nConnection: close\r\n\r\nbye"
+    )
+    assert response.count(b"HTTP/1.1 200 OK") == 2
+    assert response.endswith(b"\r\n\r\nbye")
+
+
+def test_invalid_content_length_is_rejected():
+    responses = run(*(
+        f"POST / HTTP/1.1\r\nContent-Length: {value}\r\n\r\n".encode() + b"x" * 10
+        for value in ("abc", "-5", "+5", "1e3", "٣")
+    ))
+    assert [status(response) for response in responses] == [400] * 5
+
+
+def test_oversized_and_chunked_bodies_are_rejected():
+    too_large, chunked = run(
+        b"POST / HTTP/1.1\r\nContent-Length: 2048\r\n\r\n",
+        b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\n",
+    )
+    assert status(too_large) == 413
+    assert status(chunked) == 411
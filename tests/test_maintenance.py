@@ -0,0 +1,70 @@
+# tests/test_maintenance.py
+import datetime
+
+import pytest
+from sqlalchemy import text
+
+import db as queries
+from conftest import call
+from db import Database
+from maintenance import run_sqlite_maintenance
+
+
+def fill_and_clear(database, count=2000):
+    """Записывает и удаляет участников, оставляя в файле свободные страницы."""
+    def write(session):
+        group_id = queries.ensure_groups(session, {-1: "Группа"})[-1]
+        queries.upsert_members(session, [
+            {'group_id': group_id, 'telegram_id': i, 'last_active': datetime.datetime(2024, 1, 1),
+             'username': f"user{i}", 'first_name': 'x' * 100, 'last_name': 'y' * 100, 'full_name': 'z' * 200}
+            for i in range(count)
+        ])
+
+    call(database, write)
+    # Таблица статистики создаётся первым ANALYZE и занимает свободную страницу
+    call(database, lambda session: session.execute(text("ANALYZE")))
+    call(database, lambda session: session.execute(text("DELETE FROM members")))
+
+
+def test_free_pages_are_reclaimed_in_portions(database):
+    fill_and_clear(database)
+
+    before, after, full_vacuum = call(database, run_sqlite_maintenance, 10)
+    assert full_vacuum is None
+    assert before['auto_vacuum'] == after['auto_vacuum'] == 2
+    assert after['free_pages'] == before['free_pages'] - 10
+
+    before, after, _ = call(database, run_sqlite_maintenance)
+    assert before['free_ratio'] > 0
+    assert after['free_pages'] == 0 and after['free_ratio'] == 0.0
+    assert after['file_bytes'] < before['file_bytes']
+    # Контрольная точка TRUNCATE обнуляет WAL
+    assert after['wal_bytes'] == 0
+
+
+@pytest.fixture
+def legacy_database(tmp_path):
+    """База, созданная до перехода на auto_vacuum=INCREMENTAL."""
+    database = Database(f"sqlite:///{tmp_path / 'legacy.db'}", sqlite_pragmas={'auto_vacuum': None})
+    database.migrate()
+    yield database
+    database.close()
+
+
+def test_full_vacuum_is_deferred_for_large_files(legacy_database):
+    fill_and_clear(legacy_database)
+
+    before, after, full_vacuum = call(legacy_database, run_sqlite_maintenance, full_vacuum_max_bytes=0)
+    assert full_vacuum is False
+    assert before['auto_vacuum'] == after['auto_vacuum'] == 0
+    assert after['free_pages'] == before['free_pages'] > 0
+
+
+def test_full_vacuum_switches_to_incremental(legacy_database):
+    fill_and_clear(legacy_database)
+
+    before, after, full_vacuum = call(legacy_database, run_sqlite_maintenance, full_vacuum_max_bytes=1 << 30)
+    assert full_vacuum is True
+    assert (before['auto_vacuum'], after['auto_vacuum']) == (0, 2)
+    assert after['free_pages'] == 0
+    assert after['file_bytes'] < before['file_bytes']
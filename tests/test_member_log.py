@@ -0,0 +1,72 @@
+# tests/test_member_log.py
+import asyncio
+import datetime
+
+from sqlalchemy import event
+
+import db as queries
+from conftest import call
+from member_log import ACTIVITY, CHECKPOINT, JOIN, LEAVE, MemberLog, compact_events, event_row
+from models import MemberEvent
+
+
+def fields(name):
+    return {'username': name, 'first_name': name, 'last_name': None, 'full_name': name}
+
+
+def roster(database, chat_id):
+    _, members = call(database, queries.get_group_members, chat_id)
+    return sorted((member.telegram_id, member.username) for member in members)
+
+
+def test_compact_applies_latest_state_of_each_member(database):
+    async def scenario():
+        log = MemberLog(database, batch_size=2)
+        await log.append(JOIN, -1, 1, fields('a'), chat_title="Группа")
+        await log.append(JOIN, -1, 2, fields('b'))
+        await log.append(ACTIVITY, -1, 1, fields('a2'))
+        await log.append(LEAVE, -1, 2)
+        await log.append(JOIN, -1, 3, fields('c'))
+        return await log.compact()
+
+    count, changes = asyncio.run(scenario())
+    assert count == 5
+    assert changes[(-1, 2)] is None
+    assert roster(database, -1) == [(1, 'a2'), (3, 'c')]
+    assert call(database, lambda session: session.query(MemberEvent).count()) == 0
+    assert call(database, queries.get_checkpoint, CHECKPOINT) == 5
+
+
+def test_event_committed_behind_the_batch_is_not_lost(database):
+    call(database, lambda session: queries.ensure_groups(session, {-1: "Группа"}))
+    rows = [event_row(JOIN, -1, user_id, fields(f"u{user_id}")) for user_id in (10, 11)]
+    for row, event_id in zip(rows, (10, 11)):
+        row['id'] = event_id
+    call(database, lambda session: session.execute(MemberEvent.__table__.insert(), rows))
+
+    # В PostgreSQL событие с меньшим id может зафиксироваться уже после выборки порции;
+    # здесь оно вставляется сразу после SELECT в том же соединении
+    late = {'done': False}
+
+    def insert_late_event(conn, cursor, statement, parameters, context, executemany):
+        if not late['done'] and statement.startswith('SELECT') and 'FROM member_events' in statement:
+            late['done'] = True
+            cursor.connection.execute(
+                "INSERT INTO member_events (id, chat_id, telegram_id, kind, username, created_at) "
+                "VALUES (5, -1, 99, 'join', 'late', ?)", (datetime.datetime.utcnow().isoformat(' '),)
+            )
+
+    event.listen(database.engine, 'after_cursor_execute', insert_late_event)
+    try:
+        count, _ = call(database, compact_events, 100)
+    finally:
+        event.remove(database.engine, 'after_cursor_execute', insert_late_event)
+
+    assert count == 2
+    # Поздно зафиксированное событие остаётся в журнале, позиция его не обгоняет
+    assert call(database, lambda session: [e.id for e in session.query(MemberEvent)]) == [5]
+    assert call(database, queries.get_checkpoint, CHECKPOINT) == 4
+
+    count, _ = call(database, compact_events, 100)
+    assert count == 1
+    assert roster(database, -1) == [(10, 'u10'), (11, 'u11'), (99, 'late')]
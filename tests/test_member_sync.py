@@ -0,0 +1,60 @@
+# tests/test_member_sync.py
+import datetime
+
+from sqlalchemy import event
+
+import db as queries
+from conftest import call
+from member_sync import sync_members
+
+
+def user(user_id, name=None):
+    name = name or f"u{user_id}"
+    return {'id': user_id, 'username': name, 'first_name': name, 'last_name': None, 'full_name': name}
+
+
+def seed(database, chat_id, user_ids, last_active):
+    def write(session):
+        group_id = queries.ensure_groups(session, {chat_id: "Группа"})[chat_id]
+        queries.upsert_members(session, [
+            {'group_id': group_id, 'telegram_id': u['id'], 'last_active': last_active,
+             **{key: u[key] for key in ('username', 'first_name', 'last_name', 'full_name')}}
+            for u in map(user, user_ids)
+        ])
+        return group_id
+    return call(database, write)
+
+
+def roster(database, chat_id):
+    _, members = call(database, queries.get_group_members, chat_id)
+    return sorted((member.telegram_id, member.username, member.last_active) for member in members)
+
+
+def test_sync_writes_members_with_one_statement(database):
+    before = datetime.datetime(2024, 1, 1)
+    now = datetime.datetime(2024, 1, 2)
+    group_id = seed(database, -1, range(5), before)
+    seed(database, -2, range(3), before)
+    statements = []
+    event.listen(database.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    call(database, sync_members, group_id, [user(3, 'renamed'), user(4), user(10)], now)
+
+    assert len(statements) == 1
+    # Участники, которых нет в списке администраторов, остаются в базе
+    assert roster(database, -1) == [
+        (0, 'u0', before), (1, 'u1', before), (2, 'u2', before),
+        (3, 'renamed', now), (4, 'u4', now), (10, 'u10', now),
+    ]
+    assert [telegram_id for telegram_id, _, _ in roster(database, -2)] == [0, 1, 2]
+
+
+def test_sync_of_empty_list_writes_nothing(database):
+    group_id = seed(database, -1, range(2), datetime.datetime(2024, 1, 1))
+    statements = []
+    event.listen(database.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    call(database, sync_members, group_id, [], datetime.datetime(2024, 1, 2))
+
+    assert statements == []
+    assert len(roster(database, -1)) == 2
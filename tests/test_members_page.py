@@ -0,0 +1,52 @@
+# tests/test_members_page.py
+import datetime
+
+import db as queries
+from conftest import call
+
+
+def seed(database, chat_id, count):
+    def write(session):
+        group_ids = queries.ensure_groups(session, {chat_id: "Группа"})
+        now = datetime.datetime.utcnow()
+        queries.upsert_members(session, [
+            {'group_id': group_ids[chat_id], 'telegram_id': user_id, 'last_active': now,
+             'username': f"u{user_id}", 'first_name': None, 'last_name': None, 'full_name': None}
+            for user_id in range(1, count + 1)
+        ])
+    call(database, write)
+
+
+def ids(members):
+    return [member.telegram_id for member in members]
+
+
+def test_pages_forward_and_back(database):
+    seed(database, -1, 25)
+    seed(database, -2, 5)
+
+    _, first, has_next = call(database, queries.get_members_page, -1, limit=10)
+    assert ids(first) == list(range(1, 11)) and has_next
+    _, second, has_next = call(database, queries.get_members_page, -1, after_id=first[-1].id, limit=10)
+    assert ids(second) == list(range(11, 21)) and has_next
+    _, third, has_next = call(database, queries.get_members_page, -1, after_id=second[-1].id, limit=10)
+    assert ids(third) == list(range(21, 26)) and not has_next
+
+    _, back, has_prev = call(database, queries.get_members_page, -1, before_id=third[0].id, limit=10)
+    assert ids(back) == list(range(11, 21)) and has_prev
+    _, back, has_prev = call(database, queries.get_members_page, -1, before_id=back[0].id, limit=10)
+    assert ids(back) == list(range(1, 11)) and not has_prev
+
+
+def test_deleting_members_between_pages_does_not_skip_or_repeat(database):
+    seed(database, -1, 20)
+    _, first, _ = call(database, queries.get_members_page, -1, limit=10)
+    # Участники удаляются между нажатиями кнопок листания
+    call(database, queries.delete_member, -1, 3)
+    call(database, queries.delete_member, -1, 12)
+    _, second, has_next = call(database, queries.get_members_page, -1, after_id=first[-1].id, limit=10)
+    assert ids(second) == [11] + list(range(13, 21)) and not has_next
+
+
+def test_unknown_group(database):
+    assert call(database, queries.get_members_page, -404) == (None, [], False)
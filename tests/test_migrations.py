@@ -0,0 +1,110 @@
+# tests/test_migrations.py
+import threading
+import time
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.dialects import postgresql
+
+import migrations
+from migrations import MIGRATIONS, apply_migrations
+
+# Схема bot.db до появления миграций
+BASELINE_SCHEMA = (
+    "CREATE TABLE groups (id INTEGER PRIMARY KEY, telegram_id INTEGER NOT NULL UNIQUE, name VARCHAR, expiration_days INTEGER)",
+    "CREATE TABLE members (id INTEGER PRIMARY KEY, telegram_id INTEGER NOT NULL, username VARCHAR, first_name VARCHAR, "
+    "last_name VARCHAR, full_name VARCHAR, last_active DATETIME, group_id INTEGER REFERENCES groups (id))",
+)
+
+
+def baseline_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        for ddl in BASELINE_SCHEMA:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO groups (id, telegram_id, name, expiration_days) VALUES (1, -1, 'Группа', 60)"))
+        # Участник 10 записан трижды из-за одновременных вставок
+        for member_id, telegram_id, username, last_active in (
+            (1, 10, 'old', '2024-01-03 00:00:00'),
+            (2, 20, 'b', '2024-01-01 00:00:00'),
+            (3, 10, 'older', '2024-01-01 00:00:00'),
+            (4, 10, 'newest', '2024-01-02 00:00:00'),
+        ):
+            conn.execute(text(
+                "INSERT INTO members (id, telegram_id, username, last_active, group_id) VALUES (:id, :tid, :name, :active, 1)"
+            ), {'id': member_id, 'tid': telegram_id, 'name': username, 'active': last_active})
+    return engine
+
+
+def test_old_database_is_deduplicated_and_upgraded_in_place(tmp_path):
+    engine = baseline_engine(tmp_path)
+    assert apply_migrations(engine) == MIGRATIONS[-1][0]
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, telegram_id, username, last_active FROM members ORDER BY id")).fetchall()
+    # Остаётся самая новая запись с наибольшим last_active среди дубликатов
+    assert [tuple(row) for row in rows] == [(2, 20, 'b', '2024-01-01 00:00:00'), (4, 10, 'newest', '2024-01-03 00:00:00')]
+
+    inspector = inspect(engine)
+    indexes = {index['name']: index for index in inspector.get_indexes('members')}
+    assert indexes['ix_members_group_telegram']['unique']
+    assert indexes['ix_members_group_telegram']['column_names'] == ['group_id', 'telegram_id']
+    assert 'ix_members_last_active' in indexes
+    assert {'last_synced', 'triggers', 'trigger_cooldown'} <= {c['name'] for c in inspector.get_columns('groups')}
+
+
+def test_migrations_are_applied_once(tmp_path):
+    engine = baseline_engine(tmp_path)
+    version = apply_migrations(engine)
+    assert apply_migrations(engine) == version
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT version FROM schema_version")).fetchall() == [(version,)]
+
+
+def test_concurrent_processes_apply_each_migration_once(tmp_path, monkeypatch):
+    baseline_engine(tmp_path)
+    applied = []
+
+    def slow(migrate):
+        def wrapper(conn, schema):
+            applied.append(migrate.__name__)
+            # Окно, в котором второй процесс без блокировки прочитал бы старую версию
+            time.sleep(0.05)
+            migrate(conn, schema)
+        return wrapper
+
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [(v, d, slow(m)) for v, d, m in migrations.MIGRATIONS])
+    # У каждого «процесса» свой engine и свои соединения с файлом
+    engines = [create_engine(f"sqlite:///{tmp_path / 'old.db'}") for _ in range(3)]
+    versions = []
+    errors = []
+
+    def start(engine):
+        try:
+            versions.append(apply_migrations(engine))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=start, args=(engine,)) for engine in engines]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert versions == [MIGRATIONS[-1][0]] * 3
+    assert len(applied) == len(MIGRATIONS)
+    with engines[0].connect() as conn:
+        assert conn.execute(text("SELECT version FROM schema_version")).fetchall() == [(MIGRATIONS[-1][0],)]
+
+
+def test_added_columns_use_dialect_types(monkeypatch):
+    executed = []
+    conn = SimpleNamespace(dialect=postgresql.dialect(), execute=lambda statement: executed.append(str(statement)))
+    monkeypatch.setattr(migrations, 'inspect', lambda conn: SimpleNamespace(get_columns=lambda table, schema: []))
+    migrations._group_last_synced(conn, 'tenant_a')
+    migrations._group_trigger_cooldown(conn, None)
+    assert executed == [
+        "ALTER TABLE tenant_a.groups ADD COLUMN last_synced TIMESTAMP WITHOUT TIME ZONE",
+        "ALTER TABLE groups ADD COLUMN trigger_cooldown INTEGER",
+    ]
@@ -0,0 +1,96 @@
+# tests/test_roles.py
+import asyncio
+from types import SimpleNamespace
+
+import db as queries
+from admin_cache import AdminCache
+from conftest import call
+from roles import RoleCache, mentioned_tags, valid_tag
+from roster_cache import mention_token
+
+
+def administrator(user_id, username, is_bot=False, status='administrator'):
+    return SimpleNamespace(status=status, user=SimpleNamespace(
+        id=user_id, username=username, full_name=username, is_bot=is_bot
+    ))
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = 0
+
+    async def get_chat_administrators(self, chat_id):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return [administrator(1, 'owner', status='creator'), administrator(2, 'mod'), administrator(3, 'helper_bot', True)]
+
+
+def seed_tags(database):
+    def write(session):
+        group_id = queries.ensure_groups(session, {-1: "Группа"})[-1]
+        queries.upsert_members(session, [
+            {'group_id': group_id, 'telegram_id': user_id, 'last_active': None,
+             'username': username, 'first_name': None, 'last_name': None, 'full_name': "Имя"}
+            for user_id, username in ((10, 'dev1'), (11, None))
+        ])
+    call(database, write)
+    assert call(database, queries.add_member_tags, -1, 'devs', [10, 11, 10]) == 2
+    assert call(database, queries.add_member_tags, -1, 'devs', [10]) == 0
+
+
+def test_mentioned_tags_and_valid_names():
+    assert mentioned_tags("@Admins, @devs и mail@example.com @@x") == {'admins', 'devs'}
+    assert mentioned_tags(None) == set()
+    assert valid_tag('devs') and valid_tag('team_1')
+    assert not valid_tag('all') and not valid_tag('admins') and not valid_tag('a-b') and not valid_tag('x' * 33)
+
+
+def test_only_roles_of_the_group_are_kept(database):
+    seed_tags(database)
+    roles = RoleCache(database, AdminCache())
+    names = asyncio.run(roles.role_names(-1, {'admins', 'devs', 'john_doe', 'everyone'}))
+    assert names == {'admins', 'devs'}
+    assert asyncio.run(roles.role_names(-2, {'devs', 'john_doe'})) == set()
+
+
+def test_resolve_admins_and_tags_without_duplicates(database):
+    seed_tags(database)
+    admin_cache = AdminCache()
+    roles = RoleCache(database, admin_cache)
+    bot = FakeBot()
+
+    async def scenario():
+        # Одновременные упоминания @admins ждут один запрос к API
+        first, second = await asyncio.gather(
+            roles.resolve(bot, -1, {'admins'}), roles.resolve(bot, -1, {'admins', 'devs'})
+        )
+        return first, second, await roles.resolve(bot, -1, {'admins'})
+
+    first, second, cached = asyncio.run(scenario())
+    assert bot.calls == 1
+    assert first == cached == ['@owner', '@mod']
+    assert second == ['@owner', '@mod', '@dev1', mention_token(11, None, "Имя")]
+    # Список администраторов заодно заполняет кэш проверки прав
+    assert admin_cache.get(-1, 1) is True and admin_cache.get(-1, 3) is True
+
+
+def test_member_updates_invalidate_precomputed_lists(database):
+    seed_tags(database)
+    roles = RoleCache(database, AdminCache())
+    bot = FakeBot()
+
+    async def scenario():
+        await roles.resolve(bot, -1, {'admins', 'devs'})
+        roles.member_updated(-1, 10, 'member', 'member', {'username': 'dev1_new', 'full_name': None})
+        renamed = await roles.resolve(bot, -1, {'devs'})
+        roles.member_updated(-1, 11, 'member', 'left')
+        left = await roles.resolve(bot, -1, {'devs'})
+        roles.member_updated(-1, 2, 'administrator', 'member')
+        await roles.resolve(bot, -1, {'admins'})
+        return renamed, left
+
+    renamed, left = asyncio.run(scenario())
+    assert renamed == ['@dev1_new', mention_token(11, None, "Имя")]
+    assert left == ['@dev1_new']
+    # Смена статуса администратора сбрасывает список @admins
+    assert bot.calls == 2
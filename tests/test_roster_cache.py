@@ -0,0 +1,54 @@
+# tests/test_roster_cache.py
+from types import SimpleNamespace
+
+from roster_cache import RosterCache, mention_token
+
+
+def member(telegram_id, username=None, full_name=None):
+    return SimpleNamespace(telegram_id=telegram_id, username=username, full_name=full_name)
+
+
+def fields(username, full_name=None):
+    return {'username': username, 'first_name': full_name, 'last_name': None, 'full_name': full_name}
+
+
+def test_roster_is_updated_incrementally():
+    cache = RosterCache()
+    assert cache.get(-1) is None
+    cache.put(-1, [member(1, 'a'), member(2, None, "Без ника")])
+    assert cache.get(-1) == [mention_token(1, 'a', None), mention_token(2, None, "Без ника")]
+
+    cache.upsert(-1, 3, fields('c'))
+    cache.upsert(-1, 1, fields('a2'))
+    cache.remove(-1, 2)
+    assert cache.get(-1) == [mention_token(1, 'a2', None), mention_token(3, 'c', None)]
+
+    # Изменения групп вне кэша не загружают их частично
+    cache.upsert(-2, 1, fields('x'))
+    assert -2 not in cache
+
+    cache.invalidate(-1)
+    assert cache.get(-1) is None
+
+
+def test_least_recently_used_group_is_evicted():
+    cache = RosterCache(max_groups=2)
+    cache.put(-1, [member(1, 'a')])
+    cache.put(-2, [member(2, 'b')])
+    cache.get(-1)
+    cache.put(-3, [member(3, 'c')])
+    assert -1 in cache and -3 in cache
+    assert -2 not in cache
+    assert len(cache) == 2
+
+
+def test_roster_expires_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('roster_cache.time.monotonic', lambda: now[0])
+    cache = RosterCache(ttl=60)
+    cache.put(-1, [member(1, 'a')])
+    now[0] += 30
+    assert cache.get(-1) == [mention_token(1, 'a', None)]
+    now[0] += 31
+    assert cache.get(-1) is None
+    assert -1 not in cache
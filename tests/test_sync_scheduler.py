@@ -0,0 +1,74 @@
+# tests/test_sync_scheduler.py
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import db as queries
+from cluster import shard_of
+from conftest import call
+from sync_scheduler import MemberSyncScheduler
+
+NOW = datetime.datetime(2024, 1, 1, 12, 0)
+
+
+def group(chat_id, last_synced=None):
+    return SimpleNamespace(id=-chat_id, telegram_id=chat_id, last_synced=last_synced)
+
+
+def chats_in_shard(scheduler, shard, count):
+    chats = []
+    chat_id = -1000
+    while len(chats) < count:
+        if shard_of(chat_id, scheduler.shards) == shard:
+            chats.append(chat_id)
+        chat_id -= 1
+    return chats
+
+
+def test_due_groups_follow_shard_and_persisted_sync_time():
+    scheduler = MemberSyncScheduler(None, None, interval_hours=24, shards=24)
+    shard = scheduler.current_shard(NOW)
+    own = chats_in_shard(scheduler, shard, 4)
+    other = chats_in_shard(scheduler, (shard + 1) % 24, 2)
+    hour = datetime.timedelta(hours=1)
+    rows = [
+        (group(own[0]), NOW - 5 * hour),                           # Ещё не синхронизировалась
+        (group(own[1], NOW - 2 * hour), NOW),                      # Синхронизирована недавно, например /update
+        (group(own[2], NOW - 24 * hour), NOW - hour),              # Прошёл период
+        (group(own[3]), None),                                     # Активности не было
+        (group(other[0]), NOW),                                    # Чужой шард
+        (group(other[1], NOW - 30 * hour), NOW - 10 * hour),       # Чужой шард, но такт пропущен
+    ]
+    due = scheduler.due_groups(rows, NOW)
+    # Недавно активные группы идут первыми
+    assert [g.telegram_id for g in due] == [own[2], own[0], other[1], own[3]]
+
+
+def test_sync_groups_limits_concurrency_and_marks_progress(database):
+    active = [0]
+    peak = [0]
+
+    async def sync_group(bot, g, api_budget):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.01)
+        active[0] -= 1
+        if g.telegram_id == -3:
+            raise RuntimeError("Forbidden")
+        return g.telegram_id
+
+    scheduler = MemberSyncScheduler(database, sync_group, concurrency=2, api_rate=100)
+    done = []
+
+    async def on_done(g, result, error):
+        done.append((g.telegram_id, result, type(error).__name__ if error else None))
+
+    call(database, queries.ensure_groups, {chat_id: "Группа" for chat_id in (-1, -2, -3, -4, -5)})
+    groups = sorted(call(database, queries.list_groups), key=lambda g: -g.telegram_id)
+    results = asyncio.run(scheduler.sync_groups(None, groups, on_done=on_done))
+    assert peak[0] == 2
+    assert [(g.telegram_id, result) for g, result, _ in results] == [(-1, -1), (-2, -2), (-3, None), (-4, -4), (-5, -5)]
+    assert sorted(done) == [(-5, -5, None), (-4, -4, None), (-3, None, 'RuntimeError'), (-2, -2, None), (-1, -1, None)]
+    # Группа с ошибкой останется в очереди следующего такта
+    synced = {g.telegram_id: g.last_synced is not None for g in call(database, queries.list_groups)}
+    assert synced == {-1: True, -2: True, -3: False, -4: True, -5: True}
@@ -0,0 +1,62 @@
+# tests/test_tenancy.py
+import os
+
+import pytest
+
+import db as queries
+from conftest import call
+from db import Database
+from tenancy import parse_bot_tokens, tenant_schema
+
+
+def test_parse_bot_tokens():
+    assert parse_bot_tokens(" Main = 1:aaa , support=2:bbb,") == [('main', '1:aaa'), ('support', '2:bbb')]
+    assert parse_bot_tokens('') == []
+
+
+@pytest.mark.parametrize('value', ['main', 'main=', 'main bot=1:aaa', 'main=1:aaa,MAIN=2:bbb'])
+def test_parse_bot_tokens_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        parse_bot_tokens(value)
+
+
+def test_tenant_tables_are_isolated(tmp_path):
+    database = Database(f"sqlite:///{tmp_path / 'bot.db'}")
+    first = database.tenant(tenant_schema('first'))
+    second = database.tenant(tenant_schema('second'))
+    try:
+        database.migrate()
+        first.migrate()
+        second.migrate()
+        call(first, queries.ensure_groups, {-1: "Первая"})
+        call(second, queries.ensure_groups, {-2: "Вторая"})
+
+        assert [g.telegram_id for g in call(first, queries.list_groups)] == [-1]
+        assert [g.telegram_id for g in call(second, queries.list_groups)] == [-2]
+        assert call(database, queries.list_groups) == []
+        # Схема бота хранится отдельным файлом рядом с основным
+        assert os.path.exists(tmp_path / 'bot.tenant_first.db')
+    finally:
+        database.close()
+
+
+def test_tenant_count_is_limited_by_sqlite(tmp_path, monkeypatch):
+    monkeypatch.setattr('db.sqlite_attach_limit', lambda: 1)
+    database = Database(f"sqlite:///{tmp_path / 'bot.db'}")
+    try:
+        database.tenant('tenant_a')
+        # Повторное представление той же схемы не подключает новый файл
+        database.tenant('tenant_a')
+        with pytest.raises(ValueError):
+            database.tenant('tenant_b')
+    finally:
+        database.close()
+
+
+def test_memory_database_has_no_tenants():
+    database = Database('sqlite://')
+    try:
+        with pytest.raises(ValueError):
+            database.tenant('tenant_a')
+    finally:
+        database.close()
@@ -0,0 +1,48 @@
+# tests/test_triggers.py
+from triggers import TriggerMatcher, compile_triggers, format_triggers, parse_triggers
+
+
+def test_trigger_matches_only_as_separate_word():
+    pattern = compile_triggers(["@all", "@all_team", "сбор"])
+    for text in ("привет @all!", "@ALL", "(@all)", "@all_team, идём", "Сбор в 10"):
+        assert pattern.search(text), text
+    for text in ("@allow", "mail@all", "@all_teams", "сборка", "пересбор"):
+        assert not pattern.search(text), text
+    assert compile_triggers([]) is None
+
+
+def test_triggers_are_stored_normalised():
+    value = format_triggers(["@All", "@here", "@all", ""])
+    assert value == "@all\n@here"
+    assert parse_triggers(value) == ["@all", "@here"]
+    assert format_triggers([]) is None
+    assert parse_triggers(None) is None
+
+
+def test_group_triggers_override_defaults_until_reloaded():
+    matcher = TriggerMatcher()
+    matcher.set_default_triggers(["@bot", "@all"])
+    matcher.load(-1, None)
+    matcher.load(-2, "@here")
+    assert matcher.matches(-1, "@all") and not matcher.matches(-1, "@here")
+    assert matcher.matches(-2, "@here") and not matcher.matches(-2, "@all")
+    assert matcher.triggers_for("@here") == ["@here"]
+    assert matcher.triggers_for(None) == ["@bot", "@all"]
+
+    matcher.invalidate(-2)
+    assert -2 not in matcher
+    matcher.load(-2, None)
+    assert matcher.matches(-2, "@all")
+
+
+def test_cache_is_bounded_and_expires(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('triggers.time.monotonic', lambda: now[0])
+    matcher = TriggerMatcher(max_groups=2, ttl=60)
+    matcher.load(-1, None)
+    matcher.load(-2, None)
+    matcher.matches(-1, "text")
+    matcher.load(-3, None)
+    assert -1 in matcher and -3 in matcher and -2 not in matcher
+    now[0] += 61
+    assert -1 not in matcher
@@ -0,0 +1,67 @@
+# tests/test_update_tracker.py
+import asyncio
+
+from update_tracker import REPLAY_WINDOW, UpdateTracker
+
+
+def test_position_waits_for_earliest_unfinished_update():
+    tracker = UpdateTracker(None, 'test')
+    assert tracker.position is None
+    for update_id in (1, 2, 3):
+        assert tracker.begin(update_id)
+    tracker.done(3)
+    tracker.done(1)
+    assert tracker.position == 1
+    tracker.done(2)
+    assert tracker.position == 3
+
+
+def test_updates_up_to_restored_position_are_skipped():
+    tracker = UpdateTracker(None, 'test')
+    tracker.restored = 100
+    assert not tracker.begin(100)
+    assert not tracker.begin(100 - REPLAY_WINDOW + 1)
+    assert tracker.begin(101)
+    # После недели простоя Telegram начинает нумерацию заново, намного ниже позиции
+    assert tracker.begin(100 - REPLAY_WINDOW - 1)
+
+
+def test_rejected_update_holds_position_until_processed():
+    tracker = UpdateTracker(None, 'test')
+    tracker.begin(11)
+    tracker.done(11)
+    # Обновление 10 получило 503 уже после того, как 11 обработано
+    tracker.reject(10)
+    assert tracker.position == 9
+    tracker.begin(10)
+    assert tracker.position == 9
+    tracker.done(10)
+    assert tracker.position == 11
+
+
+def test_rejected_update_beyond_replay_window_is_forgotten():
+    tracker = UpdateTracker(None, 'test')
+    tracker.begin(1)
+    tracker.done(1)
+    tracker.reject(2)
+    tracker.begin(3)
+    tracker.done(3)
+    assert tracker.position == 1
+    far = 2 + REPLAY_WINDOW
+    tracker.begin(far)
+    tracker.done(far)
+    assert tracker.position == far
+
+
+def test_position_survives_restart(database):
+    async def scenario():
+        tracker = UpdateTracker(database, 'update_offset:0')
+        tracker.begin(5)
+        tracker.done(5)
+        saved = await tracker.save()
+        unchanged = await tracker.save()
+
+        restarted = UpdateTracker(database, 'update_offset:0')
+        return saved, unchanged, await restarted.load(), restarted.begin(5), restarted.begin(6)
+
+    assert asyncio.run(scenario()) == (5, None, 5, False, True)
@@ -0,0 +1,108 @@
+# triggers.py
+import re
+import time
+from collections import OrderedDict
+
+BASE_TRIGGERS = ["@all", "@everyone"]
+
+
+def parse_triggers(value):
+    """
+    :param value: Значение Group.triggers (триггеры через перевод строки) или None
+    :return: Список триггеров или None, если у группы нет своих триггеров
+    """
+    if not value:
+        return None
+    return [word for word in value.split('\n') if word]
+
+
+def format_triggers(words):
+    """
+    Готовит список триггеров для хранения в Group.triggers.
+    """
+    return '\n'.join(dict.fromkeys(word.lower() for word in words if word)) or None
+
+
+def compile_triggers(words):
+    """
+    Собирает триггеры в одно регулярное выражение.
+
+    Триггер срабатывает только как отдельное слово: "@all" находится в "привет @all!",
+    но не в "@allow" и не в "mail@all".
+
+    :param words: Список триггеров
+    :return: Скомпилированное регулярное выражение или None для пустого списка
+    """
+    if not words:
+        return None
+    # Длинные триггеры первыми, чтобы "@all_team" не перекрывался "@all"
+    alternation = '|'.join(re.escape(word) for word in sorted(set(words), key=len, reverse=True))
+    return re.compile(rf"(?<![\w@])(?:{alternation})(?!\w)", re.IGNORECASE)
+
+
+class TriggerMatcher:
+    """
+    Кэш скомпилированных триггеров по группам.
+
+    Группы без своих триггеров используют общее выражение по умолчанию (имя бота,
+    @all, @everyone). Выражение группы собирается один раз и пересобирается
+    только при изменении её настроек или по истечении ttl, если настройки могут
+    меняться другими процессами бота.
+    """
+
+    def __init__(self, max_groups=1000, ttl=0):
+        """
+        :param max_groups: Максимальное количество групп в кэше
+        :param ttl: Время жизни выражения группы в секундах (0 - без ограничения)
+        """
+        self.max_groups = max_groups
+        self.ttl = ttl
+        self.default_triggers = []
+        self._default_pattern = None
+        self._patterns = OrderedDict()
+        self._loaded = {}
+
+    def set_default_triggers(self, words):
+        self.default_triggers = list(words)
+        self._default_pattern = compile_triggers(self.default_triggers)
+
+    def __contains__(self, chat_id):
+        if chat_id not in self._patterns:
+            return False
+        if self.ttl and time.monotonic() - self._loaded[chat_id] > self.ttl:
+            self.invalidate(chat_id)
+            return False
+        return True
+
+    def load(self, chat_id, value):
+        """
+        Сохраняет в кэш триггеры группы.
+
+        :param value: Значение Group.triggers
+        """
+        words = parse_triggers(value)
+        self._patterns[chat_id] = compile_triggers(words) if words else None
+        self._loaded[chat_id] = time.monotonic()
+        self._patterns.move_to_end(chat_id)
+        while len(self._patterns) > self.max_groups:
+            evicted, _ = self._patterns.popitem(last=False)
+            del self._loaded[evicted]
+
+    def invalidate(self, chat_id):
+        self._patterns.pop(chat_id, None)
+        self._loaded.pop(chat_id, None)
+
+    def triggers_for(self, value):
+        """
+        :param value: Значение Group.triggers
+        :return: Действующий список триггеров группы
+        """
+        return parse_triggers(value) or self.default_triggers
+
+    def matches(self, chat_id, text):
+        """
+        Проверяет текст на триггеры группы; группа должна быть загружена в кэш.
+        """
+        self._patterns.move_to_end(chat_id)
+        pattern = self._patterns[chat_id] or self._default_pattern
+        return bool(pattern and pattern.search(text))
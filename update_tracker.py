@@ -0,0 +1,143 @@
+# update_tracker.py
+import logging
+
+from telegram import Update
+from telegram.ext import Application
+
+from cluster import update_chat_id
+from db import get_checkpoint, set_checkpoint
+
+logger = logging.getLogger(__name__)
+
+# Сколько номеров перед сохранённой позицией считаются повторами. После недели без
+# обновлений Telegram начинает нумерацию со случайного числа, и новые обновления
+# с номером намного меньше позиции нельзя отбрасывать.
+REPLAY_WINDOW = 10000
+
+
+class UpdateTracker:
+    """
+    Позиция обработанных обновлений, сохраняемая в базе между перезапусками.
+
+    Позиция — наибольший update_id, до которого включительно обработаны все
+    полученные обновления; при параллельной обработке это номер перед самым
+    ранним незавершённым обновлением. После перезапуска Telegram повторно
+    присылает обновления, получение которых не было подтверждено, и они
+    пропускаются, если не превышают сохранённую позицию. Обновления, которые
+    вебхук не принял (ответ 503), Telegram тоже пришлёт снова, поэтому позиция
+    не переходит через них, пока они не будут обработаны.
+    """
+
+    def __init__(self, db, name):
+        """
+        :param db: Экземпляр db.Database
+        :param name: Имя позиции в таблице checkpoints
+        """
+        self.db = db
+        self.name = name
+        self.saved = None
+        # Повторы отсекаются только по позиции предыдущего запуска: в режиме webhook обновления
+        # текущего запуска могут приходить не по порядку
+        self.restored = None
+        self._max_seen = None
+        self._in_flight = {}
+        # Непринятые обновления, которые Telegram доставит повторно
+        self._gaps = set()
+        # Количество обработанных за время работы обновлений
+        self.processed = 0
+
+    async def load(self):
+        """
+        :return: Позиция, сохранённая предыдущим запуском, или None
+        """
+        self.saved = self.restored = await self.db.run(get_checkpoint, self.name)
+        return self.saved
+
+    def begin(self, update_id):
+        """
+        :return: False, если обновление уже было обработано до перезапуска
+        """
+        if self.restored is not None and self.restored - REPLAY_WINDOW < update_id <= self.restored:
+            return False
+        self._in_flight[update_id] = self._in_flight.get(update_id, 0) + 1
+        self._gaps.discard(update_id)
+        if self._max_seen is None or update_id > self._max_seen:
+            self._max_seen = update_id
+        return True
+
+    def reject(self, update_id):
+        """
+        Отмечает обновление, которое не было принято и будет доставлено повторно.
+        """
+        self._gaps.add(update_id)
+
+    def done(self, update_id):
+        self.processed += 1
+        count = self._in_flight.pop(update_id, 1) - 1
+        if count:
+            self._in_flight[update_id] = count
+
+    @property
+    def position(self):
+        if self._max_seen is None:
+            return None
+        if self._gaps:
+            # Пропуск дальше окна повторов уже не отсекается как повтор и не задерживает позицию
+            self._gaps = {update_id for update_id in self._gaps if update_id > self._max_seen - REPLAY_WINDOW}
+        pending = self._in_flight.keys() | self._gaps
+        if pending:
+            return min(min(pending) - 1, self._max_seen)
+        return self._max_seen
+
+    async def save(self, position=None):
+        """
+        Сохраняет позицию, если она изменилась.
+
+        :param position: Позиция, снятая заранее (по умолчанию текущая)
+        :return: Сохранённая позиция или None
+        """
+        if position is None:
+            position = self.position
+        if position is None or position == self.saved:
+            return None
+        await self.db.run(set_checkpoint, self.name, position)
+        self.saved = position
+        return position
+
+
+class TrackingApplication(Application):
+    """
+    Application, отмечающее начало и конец обработки каждого обновления в UpdateTracker.
+
+    Если задан chat_scheduler (chat_scheduler.ChatScheduler), обновления
+    передаются в очередь своего чата, а process_update возвращается сразу после
+    постановки в очередь; сама Application в этом случае должна обрабатывать
+    обновления последовательно, чтобы порядок постановки совпадал с порядком
+    получения. Очередь может быть общей для нескольких ботов процесса: ключ
+    чата включает name приложения.
+    """
+
+    def __init__(self, tracker, chat_scheduler=None, name='', **kwargs):
+        super().__init__(**kwargs)
+        self.tracker = tracker
+        self.chat_scheduler = chat_scheduler
+        self.name = name
+
+    async def process_update(self, update):
+        if not isinstance(update, Update):
+            return await super().process_update(update)
+        if not self.tracker.begin(update.update_id):
+            logger.info(f"Обновление {update.update_id} уже обработано до перезапуска, пропускаем.")
+            return None
+        if self.chat_scheduler is None:
+            return await self._process_tracked(update)
+        # Обновления без чата (например, inline-запросы) порядка не требуют
+        key = (self.name, update_chat_id(update) or ('update', update.update_id))
+        await self.chat_scheduler.submit(key, self._process_tracked, update)
+        return None
+
+    async def _process_tracked(self, update):
+        try:
+            return await super().process_update(update)
+        finally:
+            self.tracker.done(update.update_id)
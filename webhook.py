@@ -0,0 +1,123 @@
+# webhook.py
+import asyncio
+import json
+import logging
+import signal
+
+from telegram import Update
+
+from cluster import FORWARDED_HEADER, update_chat_id
+from http_server import HTTPServer
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+
+class WebhookServer:
+    """
+    Приём обновлений Telegram через вебхук.
+
+    Обновления кладутся в update_queue приложения. Если очередь заполнена, сервер
+    отвечает 503, и Telegram повторит доставку позже — так нагрузка не копится
+    в памяти бота. При запуске нескольких процессов обновления чужих чатов
+    пересылаются владельцу через cluster.UpdateRouter. Несколько ботов одного
+    процесса принимают обновления на одном порту, каждый на своём пути.
+    """
+
+    def __init__(self, applications, secret_token=None, router=None):
+        """
+        :param applications: Словарь {путь, на который Telegram отправляет обновления: экземпляр telegram.ext.Application}
+        :param secret_token: Секрет из set_webhook для проверки отправителя
+        :param router: Экземпляр cluster.UpdateRouter или None для одного процесса
+        """
+        self.applications = applications
+        self.secret_token = secret_token
+        self.router = router
+        self.http = HTTPServer(self.handle)
+
+    async def start(self, host, port):
+        await self.http.start(host, port)
+        for path in self.applications:
+            logger.info(f"Вебхук принимает обновления на {host}:{self.http.port}{path}")
+
+    async def stop(self):
+        await self.http.stop()
+        if self.router:
+            await self.router.close()
+
+    async def handle(self, method, path, headers, body):
+        application = self.applications.get(path)
+        if application is None:
+            return 404, {}, b''
+        if method != 'POST':
+            return 405, {}, b''
+        if self.secret_token and headers.get(SECRET_HEADER) != self.secret_token:
+            return 401, {}, b''
+
+        try:
+            update = Update.de_json(json.loads(body), application.bot)
+        except Exception as e:
+            logger.error(f"Некорректное обновление во вебхуке: {e}")
+            return 400, {}, b''
+
+        # Пересланные другим процессом обновления обрабатываются здесь без повторной маршрутизации
+        if self.router and FORWARDED_HEADER not in headers:
+            owner = self.router.owner(update_chat_id(update))
+            if owner != self.router.worker_id:
+                return await self.router.forward(owner, body), {}, b''
+
+        try:
+            application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Очередь обновлений заполнена, вебхук отвечает 503.")
+            # Telegram доставит обновление снова; до этого позиция обновлений через него не переходит
+            tracker = getattr(application, 'tracker', None)
+            if tracker is not None:
+                tracker.reject(update.update_id)
+            return 503, {'Retry-After': '1'}, b''
+        return 200, {}, b''
+
+
+async def run_webhook(applications, url, listen, port, secret_token=None, router=None):
+    """
+    Запускает приложения в режиме вебхука до получения SIGINT или SIGTERM.
+
+    Повторяет жизненный цикл Application.run_polling для каждого приложения:
+    post_init, работа, остановка, post_stop, shutdown и post_shutdown. Как и в
+    tenancy.run_polling, post_stop выполняются после остановки всех приложений.
+
+    :param applications: Словарь {путь: экземпляр telegram.ext.Application}
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    server = WebhookServer(applications, secret_token, router)
+    try:
+        for path, application in applications.items():
+            await application.initialize()
+            if application.post_init:
+                await application.post_init(application)
+            await application.bot.set_webhook(
+                url=url.rstrip('/') + path,
+                secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES
+            )
+        await server.start(listen, port)
+        for application in applications.values():
+            await application.start()
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        for application in applications.values():
+            if application.running:
+                await application.stop()
+        for application in applications.values():
+            if application.post_stop:
+                await application.post_stop(application)
+        for application in applications.values():
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)